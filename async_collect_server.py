@@ -0,0 +1,919 @@
+import argparse
+import asyncio
+import socket
+import time
+from contextlib import nullcontext
+import psycopg2
+from psycopg2 import extensions
+from circuit_breaker import ServerUnavailable, connect_with_retry_async
+from collect_server import (
+    DATABASE_COLLECTORS,
+    SERVER_COLLECTORS,
+    SNAPSHOT_RESTORE_QUERY,
+    SNAPSHOT_SAVEPOINT_QUERY,
+    STATS_SNAPSHOT_QUERY,
+    database_collectors,
+    report_failure,
+    select_collectors,
+)
+from collection_budget import (
+    CONNECT_TIMEOUT,
+    SET_TIMEOUTS_QUERY,
+    CollectionBudget,
+    add_budget_arguments,
+    budget_from_args,
+    prioritized,
+    timeout_options,
+)
+from collection_runs import (
+    finish_collection_run,
+    pending_collectors,
+    start_collection_run,
+)
+from collection_timings import (
+    CollectionTimer,
+    print_timing_summary,
+    record_timer,
+    timed_phase,
+    write_collection_timings,
+)
+from database_inventory import (
+    DATABASE_INVENTORY_QUERY,
+    cached_databases,
+    invalidate_database_inventory,
+    update_database_inventory,
+)
+from dba_spool import close_dba_connection, open_dba_connection
+from replica_routing import route_collectors
+from target_throttle import LOAD_QUERY, TargetBusy, get_throttle, throttle_query_async
+
+# Default limits on collections in flight
+ASYNC_GLOBAL_CONCURRENCY = 200
+ASYNC_SERVER_CONCURRENCY = 4
+
+# Asynchronous connections autocommit, so the snapshot of a database is an
+# explicit transaction, see collect_server.begin_snapshot
+SNAPSHOT_BEGIN_QUERY = "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY"
+SNAPSHOT_END_QUERY = "ROLLBACK"
+
+
+async def wait_ready(conn):
+    """
+    Wait until an asynchronous psycopg2 connection has finished its current operation.
+
+    Args:
+        conn (connection): A connection opened with async_=True.
+
+    Raises:
+        psycopg2.OperationalError: If the connection reports an unexpected state.
+    """
+    loop = asyncio.get_running_loop()
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+
+        future = loop.create_future()
+        fileno = conn.fileno()
+
+        def ready():
+            if not future.done():
+                future.set_result(None)
+
+        if state == extensions.POLL_READ:
+            loop.add_reader(fileno, ready)
+            try:
+                await future
+            finally:
+                loop.remove_reader(fileno)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fileno, ready)
+            try:
+                await future
+            finally:
+                loop.remove_writer(fileno)
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+
+
+async def connect_target_async(
+    server_name, user, password, db_name, connect_timeout=CONNECT_TIMEOUT
+):
+    """
+    Open an asynchronous connection to a target database.
+    The host name is resolved on the event loop, so a slow DNS lookup does not
+    block other collections. Asynchronous connections always autocommit, so
+    the session is made read only through its options instead, along with
+    the default statement and lock timeouts. libpq does not time out
+    asynchronous connection attempts, so the event loop does.
+
+    Args:
+        server_name (str): Name of the PostgreSQL server.
+        user (str): Username for the PostgreSQL server.
+        password (str): Password for the PostgreSQL server.
+        db_name (str): Name of the database to connect to.
+        connect_timeout (int, optional): Seconds to wait for the connection. Defaults to CONNECT_TIMEOUT.
+
+    Returns:
+        connection: An open asynchronous psycopg2 connection.
+
+    Raises:
+        psycopg2.OperationalError: If the connection could not be made in time.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        addresses = await asyncio.wait_for(
+            loop.getaddrinfo(server_name, 5432, type=socket.SOCK_STREAM), connect_timeout
+        )
+    except asyncio.TimeoutError:
+        raise psycopg2.OperationalError(f"timeout expired resolving {server_name}")
+
+    conn = psycopg2.connect(
+        host=server_name,
+        hostaddr=addresses[0][4][0],
+        user=user,
+        password=password,
+        dbname=db_name,
+        options=f"-c default_transaction_read_only=on {timeout_options()}",
+        async_=True,
+    )
+    try:
+        await asyncio.wait_for(wait_ready(conn), connect_timeout)
+    except asyncio.TimeoutError:
+        conn.close()
+        raise psycopg2.OperationalError(f"timeout expired connecting to {server_name}")
+    except BaseException:
+        conn.close()
+        raise
+
+    return conn
+
+
+async def connect_database_async(server_name, user, password, db_name, budget=None, host=None):
+    """
+    Open an asynchronous connection to a target database, timed as a connect span.
+    Failures to reach the host are retried with backoff, and counted by the
+    circuit breaker of the host, see circuit_breaker.
+
+    Args:
+        server_name (str): Name of the PostgreSQL server.
+        user (str): Username for the PostgreSQL server.
+        password (str): Password for the PostgreSQL server.
+        db_name (str): Name of the database to connect to.
+        budget (CollectionBudget, optional): The connect timeout and deadline of the run. Defaults to None.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+
+    Returns:
+        connection: An open asynchronous psycopg2 connection.
+
+    Raises:
+        ServerUnavailable: If the circuit breaker of the host is open.
+    """
+    budget = budget or CollectionBudget()
+    host = host or server_name
+    timer = CollectionTimer(server_name, db_name, None)
+    succeeded = False
+
+    try:
+        with timer.phase("connect"):
+            conn = await connect_with_retry_async(
+                host,
+                lambda: connect_target_async(
+                    host, user, password, db_name, budget.connect_seconds()
+                ),
+                budget=budget,
+            )
+        succeeded = True
+        return conn
+    finally:
+        record_timer(timer, succeeded)
+
+
+async def run_query_async(conn, query, timer=None):
+    """
+    Run a query on an asynchronous connection and return all of its rows.
+    The query phase includes any time spent waiting on other coroutines.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection.
+        query (str): The query to run.
+        timer (CollectionTimer, optional): Times the query and fetch phases. Defaults to None.
+
+    Returns:
+        list: A list of tuples returned by the query.
+    """
+    cursor = conn.cursor()
+    try:
+        with timed_phase(timer, "query"):
+            cursor.execute(query)
+            await wait_ready(conn)
+        with timed_phase(timer, "fetch"):
+            rows = cursor.fetchall()
+        if timer is not None:
+            timer.row_count = len(rows)
+        return rows
+    finally:
+        cursor.close()
+
+
+async def sample_load_async(conn):
+    """
+    Sample the load of a target, see target_throttle.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection.
+
+    Returns:
+        tuple: The row returned by LOAD_QUERY.
+    """
+    return (await run_query_async(conn, LOAD_QUERY))[0]
+
+
+async def set_timeouts_async(conn, budget, collector_name):
+    """
+    Set the timeouts of the next collector on an asynchronous target connection.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection.
+        budget (CollectionBudget): The budget of the run.
+        collector_name (str): Name of the collector.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SET_TIMEOUTS_QUERY, budget.timeout_settings(collector_name))
+        await wait_ready(conn)
+    finally:
+        cursor.close()
+
+
+async def execute_async(conn, query):
+    """
+    Run a statement without results on an asynchronous target connection.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection.
+        query (str): The statement.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+        await wait_ready(conn)
+    finally:
+        cursor.close()
+
+
+async def begin_snapshot_async(conn):
+    """
+    Start the snapshot of a database on an asynchronous target connection,
+    as collect_server.begin_snapshot does on a blocking one.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection, outside a transaction.
+    """
+    await execute_async(conn, SNAPSHOT_BEGIN_QUERY)
+    if conn.server_version >= 150000:
+        await execute_async(conn, STATS_SNAPSHOT_QUERY)
+
+
+async def restore_snapshot_async(conn):
+    """
+    Roll the snapshot back to before the last collector, whether it failed or not.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection.
+    """
+    try:
+        await execute_async(conn, SNAPSHOT_RESTORE_QUERY)
+    except psycopg2.Error:
+        if conn.closed:
+            return
+        # The later collectors get a snapshot of their own
+        try:
+            await execute_async(conn, SNAPSHOT_END_QUERY)
+            await begin_snapshot_async(conn)
+        except psycopg2.Error as e:
+            print(f"    Could not start a new snapshot. The error is  {e}")
+
+
+async def throttle_collectors_async(conn, collectors, budget=None):
+    """
+    Asynchronous version of collect_server.throttle_collectors, run before
+    the snapshot begins so each sample reads the current load.
+
+    Args:
+        conn (connection): An open asynchronous psycopg2 connection, outside a transaction.
+        collectors (list): (name, query, writer) entries.
+        budget (CollectionBudget, optional): Counts the waits of the run, no waiting past its deadline. Defaults to None.
+
+    Returns:
+        list: (collector, error) pairs. The error is the TargetBusy of a postponed collector, or None.
+    """
+    throttled = []
+    for name, query, writer in collectors:
+        try:
+            # The load is that of the host connected to, which may be a standby
+            query = await throttle_query_async(
+                conn.info.host, name, query, lambda: sample_load_async(conn), budget
+            )
+        except TargetBusy as e:
+            throttled.append(((name, query, writer), e))
+            continue
+        throttled.append(((name, query, writer), None))
+
+    return throttled
+
+
+def write_rows(
+    dba_username,
+    dba_password,
+    target_server,
+    database_name,
+    collector,
+    rows,
+    run=None,
+    spool=None,
+):
+    """
+    Write collected rows to the DBA database and commit them.
+    Runs in a worker thread, borrowing a connection from the DBA pool, or
+    appending to the spool if there is one. With a run, the rows are stamped
+    with the start of the run.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector (tuple): A (name, query, writer) entry from SERVER_COLLECTORS or DATABASE_COLLECTORS.
+        rows (list): The rows returned by the collector query.
+        run (CollectionRun, optional): The run to record the unit as complete in. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+    """
+    name, _, writer = collector
+    conn_dba = None
+    cursor_dba = None
+
+    try:
+        conn_dba = open_dba_connection(dba_username, dba_password, spool)
+        cursor_dba = conn_dba.cursor()
+        writer(cursor_dba, target_server, rows, run.started_at if run is not None else None)
+        if run is not None:
+            run.record_progress(cursor_dba, target_server, database_name, name, len(rows))
+        conn_dba.commit()
+    finally:
+        if cursor_dba is not None:
+            cursor_dba.close()
+        if conn_dba is not None:
+            close_dba_connection(conn_dba)
+
+
+async def collect_async(
+    conn,
+    dba_username,
+    dba_password,
+    target_server,
+    database_name,
+    collector,
+    run=None,
+    spool=None,
+    budget=None,
+    snapshot=False,
+):
+    """
+    Run one collector on an asynchronous target connection and write its rows.
+    Once the deadline of the budget has passed, the collector is not started.
+    Heavy collectors wait while the target is busy, see target_throttle.
+    With snapshot set, the collector runs under a savepoint in the snapshot
+    of its database, see begin_snapshot_async, and must have been throttled
+    before the snapshot began.
+
+    Args:
+        conn (connection): An open asynchronous connection to the target database.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector (tuple): A (name, query, writer) entry from SERVER_COLLECTORS or DATABASE_COLLECTORS.
+        run (CollectionRun, optional): The run to record the unit as complete in. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        snapshot (bool, optional): Run in the snapshot of the database instead of on its own. Defaults to False.
+
+    Returns:
+        bool: True if the rows were collected and committed, False otherwise.
+    """
+    name, query, _ = collector
+    if budget is not None and budget.expired():
+        return False
+
+    timer = CollectionTimer(target_server, database_name, name)
+    succeeded = False
+
+    try:
+        if snapshot:
+            await execute_async(conn, SNAPSHOT_SAVEPOINT_QUERY)
+        else:
+            # The load is that of the host connected to, which may be a standby
+            query = await throttle_query_async(
+                conn.info.host, name, query, lambda: sample_load_async(conn), budget
+            )
+        if budget is not None:
+            await set_timeouts_async(conn, budget, name)
+        rows = await run_query_async(conn, query, timer)
+        with timer.phase("write"):
+            await asyncio.to_thread(
+                write_rows,
+                dba_username,
+                dba_password,
+                target_server,
+                database_name,
+                collector,
+                rows,
+                run,
+                spool,
+            )
+        succeeded = True
+        return True
+
+    except TargetBusy as e:
+        # Left for the next run, without a failure report
+        print(f"    {e}")
+        return False
+
+    except Exception as e:
+        await asyncio.to_thread(report_failure, name, target_server, database_name, e)
+        return False
+
+    finally:
+        if snapshot:
+            await restore_snapshot_async(conn)
+        record_timer(timer, succeeded)
+
+
+async def collect_database_async(
+    target_server,
+    target_username,
+    target_password,
+    dba_username,
+    dba_password,
+    current_database,
+    global_limit,
+    server_limit,
+    run=None,
+    spool=None,
+    budget=None,
+    session_limit=None,
+    collectors=DATABASE_COLLECTORS,
+    host=None,
+):
+    """
+    Run every per database collector on one asynchronous connection to a database.
+    Databases whose collectors the run has all completed are not connected to.
+    The collectors are throttled first, then read one REPEATABLE READ
+    snapshot of the database, as in collect_server.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        target_username (str): Username for the target PostgreSQL server.
+        target_password (str): Password for the target PostgreSQL server.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        current_database (str): Name of the target database.
+        global_limit (asyncio.Semaphore): Limit on connections in flight across the fleet.
+        server_limit (asyncio.Semaphore): Limit on connections in flight to this server.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        session_limit (asyncio.Semaphore, optional): Limit on sessions the target can spare, see target_throttle. Defaults to None.
+        collectors (list, optional): The per database collectors to run. Defaults to DATABASE_COLLECTORS.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+
+    Returns:
+        dict: A dict of collector name to True/False success.
+
+    Raises:
+        ServerUnavailable: If the circuit breaker of the host is open.
+    """
+    results = {name: True for name, _, _ in collectors}
+    budget = budget or CollectionBudget()
+    pending = pending_collectors(run, target_server, current_database, prioritized(collectors))
+    if not pending:
+        return results
+
+    async with server_limit, session_limit or nullcontext(), global_limit:
+        if budget.expired():
+            # Out of time while waiting for a slot, leave the database for a resumed run
+            for name, _, _ in pending:
+                results[name] = False
+            return results
+
+        conn = None
+        try:
+            conn = await connect_database_async(
+                target_server,
+                target_username,
+                target_password,
+                current_database,
+                budget,
+                host,
+            )
+            throttled = await throttle_collectors_async(conn, pending, budget)
+            await begin_snapshot_async(conn)
+            for collector, busy in throttled:
+                if busy is not None:
+                    # Left for the next run, without a failure report
+                    print(f"    {busy}")
+                    results[collector[0]] = False
+                    continue
+                results[collector[0]] = await collect_async(
+                    conn,
+                    dba_username,
+                    dba_password,
+                    target_server,
+                    current_database,
+                    collector,
+                    run,
+                    spool,
+                    budget,
+                    snapshot=True,
+                )
+        except ServerUnavailable:
+            # Reported once for the whole server by collect_server_async
+            raise
+        except Exception as e:
+            if conn is None:
+                # The database may have been dropped, read pg_database next time
+                invalidate_database_inventory(target_server)
+            await asyncio.to_thread(
+                report_failure,
+                collect_database_async.__name__,
+                target_server,
+                current_database,
+                e,
+            )
+            results = {name: False for name in results}
+        finally:
+            if conn is not None:
+                conn.close()
+
+    return results
+
+
+async def collect_server_async(
+    target_server,
+    target_username,
+    target_password,
+    dba_username,
+    dba_password,
+    global_limit,
+    server_limit,
+    maintenance_db="postgres",
+    run=None,
+    spool=None,
+    budget=None,
+    collector_names=None,
+    host=None,
+    estimate_sizes=None,
+):
+    """
+    Collect every metric from a target server as coroutines.
+    The same queries and writers as collect_server are used, so the rows
+    written to the DBA database are the same. Databases on the server are
+    collected concurrently, up to the limits of the two semaphores. The server
+    semaphore is always taken first, so one large server cannot tie up the
+    global limit while it waits for its own slots. The load of the server is
+    sampled first, and no more databases are collected at a time than its
+    session limit allows, see target_throttle. Databases that are not
+    connected to because the server's circuit breaker opened are reported
+    once for the server. With host set, every connection goes to that host
+    instead, and with estimate_sizes set, table sizes are estimated, see
+    collect_server.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        target_username (str): Username for the target PostgreSQL server.
+        target_password (str): Password for the target PostgreSQL server.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        global_limit (asyncio.Semaphore): Limit on connections in flight across the fleet.
+        server_limit (asyncio.Semaphore): Limit on connections in flight to this server.
+        maintenance_db (str, optional): Database used for server level queries. Defaults to 'postgres'.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        collector_names (set, optional): Run only these collectors. Defaults to None, every collector.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+        estimate_sizes (int, optional): Estimate table sizes, measuring only this many of the largest tables. Defaults to None, measure every table.
+
+    Returns:
+        dict: A dict of collector name to True/False success, for the collectors that were to run.
+    """
+    server_collectors = prioritized(select_collectors(SERVER_COLLECTORS, collector_names))
+    collectors = select_collectors(database_collectors(estimate_sizes), collector_names)
+    results = {name: True for name, _, _ in server_collectors + collectors}
+    budget = budget or CollectionBudget()
+    throttle = get_throttle(host or target_server)
+
+    # Server level collectors on the maintenance database
+    async with server_limit, global_limit:
+        if budget.expired():
+            print(f"    Run deadline reached, skipping server {target_server}")
+            return {name: False for name in results}
+
+        conn_server = None
+        try:
+            conn_server = await connect_database_async(
+                target_server,
+                target_username,
+                target_password,
+                maintenance_db,
+                budget,
+                host,
+            )
+            try:
+                throttle.record(await sample_load_async(conn_server))
+            except psycopg2.Error as e:
+                print(f"    Could not sample the load of {target_server}. The error is  {e}")
+            databases = [] if not collectors else cached_databases(target_server)
+            if databases is None:
+                databases = update_database_inventory(
+                    target_server,
+                    await run_query_async(conn_server, DATABASE_INVENTORY_QUERY),
+                )
+            for collector in pending_collectors(run, target_server, None, server_collectors):
+                results[collector[0]] = await collect_async(
+                    conn_server,
+                    dba_username,
+                    dba_password,
+                    target_server,
+                    None,
+                    collector,
+                    run,
+                    spool,
+                    budget,
+                )
+        except Exception as e:
+            await asyncio.to_thread(
+                report_failure, collect_server_async.__name__, target_server, None, e
+            )
+            return {name: False for name in results}
+        finally:
+            if conn_server is not None:
+                conn_server.close()
+
+    # Per database collectors, each database on its own connection, no more
+    # at a time than the target can spare
+    session_limit = asyncio.Semaphore(throttle.session_limit(max(1, len(databases))))
+    database_results = await asyncio.gather(
+        *(
+            collect_database_async(
+                target_server,
+                target_username,
+                target_password,
+                dba_username,
+                dba_password,
+                current_database,
+                global_limit,
+                server_limit,
+                run,
+                spool,
+                budget,
+                session_limit,
+                collectors,
+                host,
+            )
+            for current_database in databases
+        ),
+        return_exceptions=True,
+    )
+    server_unavailable = None
+    for database_result in database_results:
+        if isinstance(database_result, ServerUnavailable):
+            server_unavailable = database_result
+            database_result = {name: False for name, _, _ in collectors}
+        elif isinstance(database_result, BaseException):
+            raise database_result
+        for name, succeeded in database_result.items():
+            if not succeeded:
+                results[name] = False
+
+    if server_unavailable is not None:
+        await asyncio.to_thread(
+            report_failure,
+            collect_server_async.__name__,
+            target_server,
+            None,
+            server_unavailable,
+        )
+
+    return results
+
+
+async def process_server_async(
+    server,
+    current_username,
+    current_password,
+    dba_username,
+    dba_password,
+    global_limit,
+    server_concurrency,
+    run=None,
+    spool=None,
+    budget=None,
+    estimate_sizes=None,
+):
+    """
+    Run every collector against a single server and summarise the run.
+    Sizes and catalogs are read from a healthy standby of the server, if it
+    has one, at the same time as the rest is read from the server. The
+    collectors of a database stay together on the server whenever its usage
+    counters are collected, see replica_routing.
+
+    Args:
+        server (str): Name of the target PostgreSQL server.
+        current_username (str): Username for the target PostgreSQL server.
+        current_password (str): Password for the target PostgreSQL server.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        global_limit (asyncio.Semaphore): Limit on connections in flight across the fleet.
+        server_concurrency (int): Maximum connections in flight to this server, and to its standby.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        estimate_sizes (int, optional): Estimate table sizes, measuring only this many of the largest tables. Defaults to None, measure every table.
+
+    Returns:
+        dict: A summary in the same format as process_servers.process_server.
+    """
+    print(f"Processing server: {server}")
+
+    start_time = time.monotonic()
+    results = {}
+    error = None
+
+    try:
+        routes = await asyncio.to_thread(
+            route_collectors,
+            server,
+            current_username,
+            current_password,
+            dba_username,
+            dba_password,
+            None,
+            budget,
+        )
+        for host, collector_names in routes:
+            if host != server:
+                print(f"    Collecting {', '.join(sorted(collector_names))} from standby {host}")
+        for route_results in await asyncio.gather(
+            *(
+                collect_server_async(
+                    server,
+                    current_username,
+                    current_password,
+                    dba_username,
+                    dba_password,
+                    global_limit,
+                    asyncio.Semaphore(server_concurrency),
+                    run=run,
+                    spool=spool,
+                    budget=budget,
+                    collector_names=collector_names,
+                    host=host,
+                    estimate_sizes=estimate_sizes,
+                )
+                for host, collector_names in routes
+            )
+        ):
+            results.update(route_results)
+    except Exception as e:
+        error = str(e)
+        print(f"An error occurred while processing server {server}. The error is  {e}")
+
+    elapsed = time.monotonic() - start_time
+    print(f"    Finished with server: {server} in {elapsed:.1f}s")
+
+    return {
+        "server": server,
+        "collectors": results,
+        "elapsed": elapsed,
+        "error": error,
+    }
+
+
+async def collect_servers_async(
+    servers,
+    current_username,
+    current_password,
+    dba_username,
+    dba_password,
+    concurrency=ASYNC_GLOBAL_CONCURRENCY,
+    server_concurrency=ASYNC_SERVER_CONCURRENCY,
+    run=None,
+    spool=None,
+    budget=None,
+    estimate_sizes=None,
+):
+    """
+    Collect every metric from a list of servers in a single event loop.
+
+    Args:
+        servers (list): Names of the target PostgreSQL servers.
+        current_username (str): Username for the target PostgreSQL servers.
+        current_password (str): Password for the target PostgreSQL servers.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        concurrency (int, optional): Maximum target connections in flight. Defaults to ASYNC_GLOBAL_CONCURRENCY.
+        server_concurrency (int, optional): Maximum connections in flight per server. Defaults to ASYNC_SERVER_CONCURRENCY.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        estimate_sizes (int, optional): Estimate table sizes from relpages, measuring only this many of the largest tables per database. Defaults to None, measure every table.
+
+    Returns:
+        list: A list of per-server summaries.
+    """
+    global_limit = asyncio.Semaphore(concurrency)
+
+    return await asyncio.gather(
+        *(
+            process_server_async(
+                server,
+                current_username,
+                current_password,
+                dba_username,
+                dba_password,
+                global_limit,
+                server_concurrency,
+                run,
+                spool,
+                budget,
+                estimate_sizes,
+            )
+            for server in servers
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Collect every metric from a target server into the DBAAdmin database using asyncio."
+    )
+    parser.add_argument("target_server", help="Name of the target PostgreSQL server")
+    parser.add_argument(
+        "target_username", help="Username for the target PostgreSQL server"
+    )
+    parser.add_argument(
+        "target_password", help="Password for the target PostgreSQL server"
+    )
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+
+    parser.add_argument(
+        "--estimate-sizes",
+        type=int,
+        nargs="?",
+        const=0,
+        metavar="EXACT_TOP",
+        help="Estimate table sizes from relpages, measuring only the EXACT_TOP largest tables exactly (default: 0)",
+    )
+    parser.add_argument(
+        "--resume",
+        type=int,
+        metavar="RUN_ID",
+        help="Resume an earlier run, skipping the collectors it completed",
+    )
+
+    add_budget_arguments(parser)
+
+    args = parser.parse_args()
+
+    collection_budget = budget_from_args(args)
+    collection_run = start_collection_run(args.dba_username, args.dba_password, args.resume)
+    print(f"Collection run {collection_run.run_id}")
+
+    server_summaries = asyncio.run(
+        collect_servers_async(
+            [args.target_server],
+            args.target_username,
+            args.target_password,
+            args.dba_username,
+            args.dba_password,
+            run=collection_run,
+            budget=collection_budget,
+            estimate_sizes=args.estimate_sizes,
+        )
+    )
+    for collector_name, succeeded in server_summaries[0]["collectors"].items():
+        print(f"{collector_name}: {'OK' if succeeded else 'FAILED'}")
+
+    run_succeeded = server_summaries[0]["error"] is None and all(
+        server_summaries[0]["collectors"].values()
+    )
+    finish_collection_run(args.dba_username, args.dba_password, collection_run, run_succeeded)
+    if not run_succeeded:
+        print(f"Resume with --resume {collection_run.run_id}")
+
+    write_collection_timings(args.dba_username, args.dba_password)
+    print_timing_summary()
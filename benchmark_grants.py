@@ -0,0 +1,235 @@
+import argparse
+import time
+import psycopg2
+from get_database_grants import DATABASE_GRANTS_QUERY, INFORMATION_SCHEMA_GRANTS_QUERY
+
+# Schema the synthetic catalog is built in
+BENCHMARK_SCHEMA = "pginfo_grants_benchmark"
+
+# One block per batch of objects: a table, a view, a sequence, a function and
+# a composite type, each with a grant to PUBLIC
+CREATE_OBJECTS_BLOCK = """
+    DO $$
+    BEGIN
+        FOR i IN %(first)s..%(last)s LOOP
+            EXECUTE format('CREATE TABLE {schema}.t%%s (id int PRIMARY KEY, name text)', i);
+            EXECUTE format('CREATE VIEW {schema}.v%%s AS SELECT * FROM {schema}.t%%s', i, i);
+            EXECUTE format('CREATE SEQUENCE {schema}.s%%s', i);
+            EXECUTE format('CREATE FUNCTION {schema}.f%%s() RETURNS int LANGUAGE sql AS ''SELECT 1''', i);
+            EXECUTE format('CREATE TYPE {schema}.ty%%s AS (a int, b text)', i);
+            EXECUTE format('GRANT SELECT, INSERT, UPDATE ON {schema}.t%%s TO PUBLIC', i);
+            EXECUTE format('GRANT SELECT ON {schema}.v%%s TO PUBLIC', i);
+            EXECUTE format('GRANT USAGE ON SEQUENCE {schema}.s%%s TO PUBLIC', i);
+        END LOOP;
+    END
+    $$;
+    """
+
+# Drops a batch of the objects left in the schema, so no one transaction runs
+# out of locks. Views go with their tables.
+DROP_OBJECTS_BLOCK = """
+    DO $$
+    DECLARE
+        object record;
+    BEGIN
+        FOR object IN
+            SELECT CASE relkind WHEN 'S' THEN 'SEQUENCE' WHEN 'c' THEN 'TYPE' ELSE 'TABLE' END AS kind,
+                   oid::regclass::text AS name
+            FROM pg_class
+            WHERE relnamespace = '{schema}'::regnamespace AND relkind IN ('r', 'S', 'c')
+            UNION ALL
+            SELECT 'FUNCTION', oid::regprocedure::text
+            FROM pg_proc
+            WHERE pronamespace = '{schema}'::regnamespace
+            LIMIT %(batch_size)s
+        LOOP
+            EXECUTE format('DROP %%s IF EXISTS %%s CASCADE', object.kind, object.name);
+        END LOOP;
+    END
+    $$;
+    """
+
+# Number of objects still in the schema
+REMAINING_OBJECTS_QUERY = """
+    SELECT (SELECT count(*) FROM pg_class WHERE relnamespace = '{schema}'::regnamespace AND relkind IN ('r', 'S', 'c'))
+         + (SELECT count(*) FROM pg_proc WHERE pronamespace = '{schema}'::regnamespace);
+    """
+
+
+def create_catalog(conn, object_count, batch_size=500):
+    """
+    Build a synthetic catalog of tables, views, sequences, functions and types.
+
+    Args:
+        conn (connection): An open connection to the benchmark database.
+        object_count (int): Number of objects of each kind to create.
+        batch_size (int, optional): Objects of each kind created per transaction. Defaults to 500.
+    """
+    drop_catalog(conn)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+        conn.commit()
+
+        block = CREATE_OBJECTS_BLOCK.format(schema=BENCHMARK_SCHEMA)
+        for first in range(1, object_count + 1, batch_size):
+            last = min(first + batch_size - 1, object_count)
+            cursor.execute(block, {"first": first, "last": last})
+            conn.commit()
+            print(f"    Created objects {first} to {last}")
+
+        # Only the catalogs the queries read, so the planner sees their new sizes
+        cursor.execute(
+            "ANALYZE pg_catalog.pg_class, pg_catalog.pg_proc, pg_catalog.pg_type, pg_catalog.pg_namespace"
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def drop_catalog(conn, batch_size=500):
+    """
+    Drop the synthetic catalog, if there is one.
+
+    Args:
+        conn (connection): An open connection to the benchmark database.
+        batch_size (int, optional): Objects dropped per transaction. Defaults to 500.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regnamespace(%s)", (BENCHMARK_SCHEMA,))
+        if cursor.fetchone()[0] is None:
+            conn.rollback()
+            return
+
+        block = DROP_OBJECTS_BLOCK.format(schema=BENCHMARK_SCHEMA)
+        remaining_query = REMAINING_OBJECTS_QUERY.format(schema=BENCHMARK_SCHEMA)
+        while True:
+            cursor.execute(remaining_query)
+            if cursor.fetchone()[0] == 0:
+                break
+            cursor.execute(block, {"batch_size": batch_size})
+            conn.commit()
+
+        cursor.execute(f"DROP SCHEMA {BENCHMARK_SCHEMA} CASCADE")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def time_query(conn, query, repeat):
+    """
+    Run a query several times and time each run, including the fetch.
+
+    Args:
+        conn (connection): An open connection to the benchmark database.
+        query (str): The query to run.
+        repeat (int): Number of times to run the query.
+
+    Returns:
+        tuple: The list of elapsed seconds per run, and the rows of the last run.
+    """
+    timings = []
+    rows = []
+
+    cursor = conn.cursor()
+    try:
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            timings.append(time.perf_counter() - start_time)
+            conn.rollback()
+    finally:
+        cursor.close()
+
+    return timings, rows
+
+
+def benchmark_grants(server_name, user, password, db_name, object_count, repeat, keep):
+    """
+    Compare DATABASE_GRANTS_QUERY against INFORMATION_SCHEMA_GRANTS_QUERY on a
+    synthetic catalog. Both queries must return the same rows.
+
+    Args:
+        server_name (str): Name or IP address of the PostgreSQL server.
+        user (str): Username for the PostgreSQL server. Needs CREATE on the database.
+        password (str): Password for the PostgreSQL server.
+        db_name (str): Name of a scratch database to build the catalog in.
+        object_count (int): Number of objects of each kind to create, 0 to use the catalog as is.
+        repeat (int): Number of times to run each query.
+        keep (bool): Keep the synthetic catalog after the benchmark.
+
+    Returns:
+        bool: True if both queries returned the same rows, False otherwise.
+    """
+    conn = psycopg2.connect(host=server_name, user=user, password=password, dbname=db_name)
+
+    try:
+        if object_count > 0:
+            print(f"Creating {object_count} objects of each kind in {BENCHMARK_SCHEMA}")
+            create_catalog(conn, object_count)
+
+        results = {}
+        for name, query in (
+            ("information_schema", INFORMATION_SCHEMA_GRANTS_QUERY),
+            ("pg_catalog", DATABASE_GRANTS_QUERY),
+        ):
+            timings, rows = time_query(conn, query, repeat)
+            results[name] = rows
+            print(
+                f"{name}: {len(rows)} rows, "
+                f"best {min(timings):.3f}s, "
+                f"mean {sum(timings) / len(timings):.3f}s over {repeat} runs"
+            )
+
+        same_rows = sorted(results["information_schema"]) == sorted(results["pg_catalog"])
+        print(f"Same rows: {'YES' if same_rows else 'NO'}")
+
+        if object_count > 0 and not keep:
+            drop_catalog(conn)
+
+        return same_rows
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the grants query against the original information_schema query."
+    )
+    parser.add_argument("server_name", help="Name of the PostgreSQL server")
+    parser.add_argument("database_name", help="Scratch database to build the catalog in")
+    parser.add_argument("username", help="Username for the PostgreSQL server")
+    parser.add_argument("password", help="Password for the PostgreSQL server")
+    parser.add_argument(
+        "--objects",
+        type=int,
+        default=5000,
+        help="Objects of each kind to create, 0 to benchmark the existing catalog (default: 5000)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to run each query (default: 3)",
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the synthetic catalog after the benchmark",
+    )
+
+    args = parser.parse_args()
+
+    benchmark_grants(
+        args.server_name,
+        args.username,
+        args.password,
+        args.database_name,
+        args.objects,
+        args.repeat,
+        args.keep,
+    )
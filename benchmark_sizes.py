@@ -0,0 +1,137 @@
+import argparse
+import psycopg2
+from benchmark_grants import BENCHMARK_SCHEMA, create_catalog, drop_catalog, time_query
+from get_database_sizes import DATABASE_SIZES_QUERY
+from get_database_table_sizes import DATABASE_TABLE_SIZES_QUERY
+
+# The database sizes query before sizes were measured once, in MB and GB
+LEGACY_DATABASE_SIZES_QUERY = """
+    SELECT datname,
+           pg_database_size(datname)/1024/1024 AS size_mb,
+           pg_database_size(datname)/1024/1024/1024 AS size_gb
+    FROM pg_database
+    WHERE datistemplate = false;
+    """
+
+# The table sizes query before the total was derived from the table and index sizes
+LEGACY_DATABASE_TABLE_SIZES_QUERY = """
+    SELECT  current_database() as database_name,
+            nspname AS schema_name,
+            relname AS table_name,
+            pg_table_size(C.oid) AS table_size,
+            pg_indexes_size(C.oid) AS index_size,
+            pg_total_relation_size(C.oid) AS total_size,
+            C.reltuples AS row_estimate
+    FROM pg_class C LEFT JOIN pg_namespace N ON (N.oid = C.relnamespace)
+    WHERE nspname NOT IN ('pg_catalog', 'information_schema')
+    AND   relkind = 'r'
+    ORDER BY pg_total_relation_size(C.oid) DESC;
+    """
+
+
+def database_sizes_in_units(rows):
+    """
+    Convert rows of DATABASE_SIZES_QUERY to the MB and GB of the legacy query.
+
+    Args:
+        rows (list): The rows returned by DATABASE_SIZES_QUERY.
+
+    Returns:
+        list: Tuples of database name, size in MB and size in GB.
+    """
+    return [
+        (db_name, size_bytes // 1024 // 1024, size_bytes // 1024 // 1024 // 1024)
+        for db_name, size_bytes in rows
+    ]
+
+
+def benchmark_sizes(server_name, user, password, db_name, object_count, repeat, keep):
+    """
+    Compare DATABASE_SIZES_QUERY and DATABASE_TABLE_SIZES_QUERY against the
+    queries that measured each size more than once. Both versions of each
+    query must return the same rows.
+
+    Args:
+        server_name (str): Name or IP address of the PostgreSQL server.
+        user (str): Username for the PostgreSQL server. Needs CREATE on the database.
+        password (str): Password for the PostgreSQL server.
+        db_name (str): Name of a scratch database to build the catalog in.
+        object_count (int): Number of tables to create, 0 to use the catalog as is.
+        repeat (int): Number of times to run each query.
+        keep (bool): Keep the synthetic catalog after the benchmark.
+
+    Returns:
+        bool: True if both versions of each query returned the same rows, False otherwise.
+    """
+    conn = psycopg2.connect(host=server_name, user=user, password=password, dbname=db_name)
+
+    try:
+        if object_count > 0:
+            print(f"Creating {object_count} objects of each kind in {BENCHMARK_SCHEMA}")
+            create_catalog(conn, object_count)
+
+        same_rows = True
+        for name, legacy_query, query, convert in (
+            ("database sizes", LEGACY_DATABASE_SIZES_QUERY, DATABASE_SIZES_QUERY, database_sizes_in_units),
+            ("table sizes", LEGACY_DATABASE_TABLE_SIZES_QUERY, DATABASE_TABLE_SIZES_QUERY, list),
+        ):
+            results = {}
+            for version, version_query in (("legacy", legacy_query), ("measured once", query)):
+                timings, rows = time_query(conn, version_query, repeat)
+                results[version] = rows
+                print(
+                    f"{name}, {version}: {len(rows)} rows, "
+                    f"best {min(timings):.3f}s, "
+                    f"mean {sum(timings) / len(timings):.3f}s over {repeat} runs"
+                )
+
+            same = sorted(results["legacy"]) == sorted(convert(results["measured once"]))
+            print(f"{name}, same rows: {'YES' if same else 'NO'}")
+            same_rows = same_rows and same
+
+        if object_count > 0 and not keep:
+            drop_catalog(conn)
+
+        return same_rows
+
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the database and table sizes queries against the queries that measured each size twice."
+    )
+    parser.add_argument("server_name", help="Name of the PostgreSQL server")
+    parser.add_argument("database_name", help="Scratch database to build the catalog in")
+    parser.add_argument("username", help="Username for the PostgreSQL server")
+    parser.add_argument("password", help="Password for the PostgreSQL server")
+    parser.add_argument(
+        "--objects",
+        type=int,
+        default=5000,
+        help="Tables to create, with a view, sequence, function and type each, 0 to benchmark the existing catalog (default: 5000)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times to run each query (default: 3)",
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the synthetic catalog after the benchmark",
+    )
+
+    args = parser.parse_args()
+
+    benchmark_sizes(
+        args.server_name,
+        args.username,
+        args.password,
+        args.database_name,
+        args.objects,
+        args.repeat,
+        args.keep,
+    )
@@ -0,0 +1,111 @@
+import io
+from datetime import date, datetime, time
+from itertools import islice
+from psycopg2.extras import execute_values
+
+# Number of rows sent to the DBA database per COPY or INSERT statement
+BULK_INSERT_BATCH_SIZE = 10000
+
+# Timestamp of the open DBA transaction, used to stamp rows
+CURRENT_TIMESTAMP_QUERY = "SELECT CURRENT_TIMESTAMP"
+
+
+def copy_text(value):
+    """
+    Format a single value for COPY ... FROM STDIN in text format.
+
+    Args:
+        value: A value as returned by psycopg2.
+
+    Returns:
+        str: The escaped text representation of the value.
+    """
+    if value is None:
+        return "\\N"
+
+    if isinstance(value, bool):
+        text = "t" if value else "f"
+    elif isinstance(value, (list, tuple)):
+        # Build an array literal such as {"a","b",NULL}
+        elements = []
+        for element in value:
+            if element is None:
+                elements.append("NULL")
+            else:
+                element = str(element).replace("\\", "\\\\").replace('"', '\\"')
+                elements.append('"' + element + '"')
+        text = "{" + ",".join(elements) + "}"
+    elif isinstance(value, (datetime, date, time)):
+        text = value.isoformat()
+    else:
+        text = str(value)
+
+    return (
+        text.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def get_current_timestamp(cursor_dba):
+    """
+    Get CURRENT_TIMESTAMP for the open DBA transaction.
+    This is the same value an INSERT ... CURRENT_TIMESTAMP would have used.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+
+    Returns:
+        datetime: The transaction timestamp.
+    """
+    cursor_dba.execute(CURRENT_TIMESTAMP_QUERY)
+    return cursor_dba.fetchone()[0]
+
+
+def bulk_insert(cursor_dba, table, columns, rows, batch_size=BULK_INSERT_BATCH_SIZE):
+    """
+    Load rows into a DBA table in batches.
+    Each batch is streamed with COPY ... FROM STDIN. If COPY fails, the batch
+    is rolled back to a savepoint and sent again as a multi-row INSERT.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        table (str): Name of the target table, e.g. 'dba.tables'.
+        columns (tuple): Column names, in the same order as the values in each row.
+        rows (iterable): Tuples to load. May be a generator.
+        batch_size (int, optional): Rows per batch. Defaults to BULK_INSERT_BATCH_SIZE.
+
+    Returns:
+        int: The number of rows loaded.
+    """
+    column_list = ", ".join(columns)
+    copy_statement = f"COPY {table} ({column_list}) FROM STDIN"
+    insert_statement = f"INSERT INTO {table} ({column_list}) VALUES %s"
+
+    row_count = 0
+    rows = iter(rows)
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write("\t".join(copy_text(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        cursor_dba.execute("SAVEPOINT bulk_insert")
+        try:
+            cursor_dba.copy_expert(copy_statement, buffer)
+        except Exception as e:
+            print(f"COPY into {table} failed, falling back to INSERT. The error is  {e}")
+            cursor_dba.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+            execute_values(cursor_dba, insert_statement, batch, page_size=1000)
+        cursor_dba.execute("RELEASE SAVEPOINT bulk_insert")
+
+        row_count += len(batch)
+
+    return row_count
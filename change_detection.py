@@ -0,0 +1,148 @@
+import hashlib
+import json
+from bulk_insert import bulk_insert, get_current_timestamp
+from collector_state import load_state, save_state
+
+# Collectors whose objects rarely change, and how many columns at the start
+# of each row identify the object. The remaining columns are its attributes.
+CHANGE_DETECTED_COLLECTORS = {
+    # database, schema, object, object type, grantor, grantee, privilege
+    "insert_database_grants": 7,
+    # database, schema, table, index
+    "insert_database_index_sizes": 4,
+    # role name
+    "insert_database_users": 1,
+}
+
+# Columns of dba.object_removals, in the order the values are written
+OBJECT_REMOVALS_COLUMNS = (
+    "server_name",
+    "database_name",
+    "collector",
+    "object_key",
+    "removed_at",
+)
+
+# Columns of dba.collection_heartbeats, in the order the values are written
+COLLECTION_HEARTBEATS_COLUMNS = (
+    "server_name",
+    "database_name",
+    "collector",
+    "object_count",
+    "changed_count",
+    "removed_count",
+    "snapshot_fingerprint",
+    "last_seen",
+)
+
+
+def fingerprint(values):
+    """
+    Hash a sequence of values.
+
+    Args:
+        values (sequence): The values to hash.
+
+    Returns:
+        str: A hex digest that changes whenever any of the values change.
+    """
+    text = json.dumps(list(values), default=str, separators=(",", ":"))
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class ChangeTracker:
+    """
+    Filter a collector's rows down to the objects that are new or changed
+    since the previous run, and record which objects were removed.
+    Each object is fingerprinted on its full row; the fingerprints are kept in
+    the collector state between runs.
+    """
+
+    def __init__(self, target_server, database_name, collector_name):
+        self.target_server = target_server
+        self.database_name = database_name
+        self.collector_name = collector_name
+        self.key_length = CHANGE_DETECTED_COLLECTORS[collector_name]
+
+        previous = load_state(target_server, database_name, collector_name)
+        self.previous = previous["fingerprints"] if previous is not None else {}
+        self.current = {}
+        self.changed_count = 0
+
+    def filter(self, rows):
+        """
+        Yield only the rows that are new or changed since the previous run.
+
+        Args:
+            rows (iterable): The rows returned by the collector query. May be a generator.
+
+        Yields:
+            tuple: Each new or changed row.
+        """
+        for row in rows:
+            key = json.dumps(list(row[: self.key_length]), default=str)
+            row_fingerprint = fingerprint(row)
+            self.current[key] = row_fingerprint
+
+            if self.previous.get(key) != row_fingerprint:
+                self.changed_count += 1
+                yield row
+
+    def write_removals_and_heartbeat(self, cursor_dba, last_seen=None):
+        """
+        Write the objects that disappeared, and a heartbeat marking every
+        unchanged object as still present. Call after filter has been consumed.
+
+        Args:
+            cursor_dba (cursor): An open cursor on the DBA database.
+            last_seen (datetime, optional): Time of the snapshot, as the rows were stamped. Defaults to None, the time of the DBA transaction.
+        """
+        if last_seen is None:
+            last_seen = get_current_timestamp(cursor_dba)
+        removed_keys = sorted(set(self.previous) - set(self.current))
+
+        bulk_insert(
+            cursor_dba,
+            "dba.object_removals",
+            OBJECT_REMOVALS_COLUMNS,
+            (
+                (
+                    self.target_server,
+                    self.database_name,
+                    self.collector_name,
+                    removed_key,
+                    last_seen,
+                )
+                for removed_key in removed_keys
+            ),
+        )
+
+        bulk_insert(
+            cursor_dba,
+            "dba.collection_heartbeats",
+            COLLECTION_HEARTBEATS_COLUMNS,
+            [
+                (
+                    self.target_server,
+                    self.database_name,
+                    self.collector_name,
+                    len(self.current),
+                    self.changed_count,
+                    len(removed_keys),
+                    fingerprint(sorted(self.current.values())),
+                    last_seen,
+                )
+            ],
+        )
+
+    def save(self):
+        """
+        Save the current fingerprints as the baseline for the next run.
+        Call only once the DBA transaction has been committed.
+        """
+        save_state(
+            self.target_server,
+            self.database_name,
+            self.collector_name,
+            {"fingerprints": self.current},
+        )
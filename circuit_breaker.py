@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import os
+import random
+import threading
+import time
+import psycopg2
+
+# Attempts at one connection before giving up. PGINFO_CONNECT_ATTEMPTS overrides it.
+CONNECT_ATTEMPTS = int(os.environ.get("PGINFO_CONNECT_ATTEMPTS", "3"))
+
+# Seconds before the first retry, doubled for each retry after it up to
+# RETRY_MAX_DELAY. The actual wait is a random fraction of it, so the
+# connections that failed together do not all retry together.
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+# Consecutive connection failures that open the breaker of a server
+BREAKER_THRESHOLD = int(os.environ.get("PGINFO_BREAKER_THRESHOLD", "3"))
+
+# Seconds an open breaker waits before it lets one connection probe the server
+BREAKER_COOLDOWN = float(os.environ.get("PGINFO_BREAKER_COOLDOWN", "60"))
+
+# State of a breaker
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half-open"
+
+# Connection errors the server itself answered with that are worth retrying.
+# Any other error the server answers with, such as a database that does not
+# exist or a bad password, fails the same way on every attempt.
+RETRYABLE_SERVER_ERRORS = (
+    "too many clients",
+    "remaining connection slots are reserved",
+    "the database system is starting up",
+    "the database system is shutting down",
+    "the database system is in recovery mode",
+)
+
+
+class ServerUnavailable(Exception):
+    """
+    Raised instead of connecting while the breaker of a server is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Connection health of one target server. The breaker opens after
+    BREAKER_THRESHOLD consecutive connection failures, and every connection
+    to the server then fails at once with ServerUnavailable instead of
+    waiting for its own timeouts. After the cooldown the breaker is half
+    open and lets a single connection through as a probe. The breaker closes
+    if the probe connects, and opens for another cooldown if it does not.
+    """
+
+    def __init__(self, server_name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.server_name = server_name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns:
+            bool: True if a connection may be attempted now.
+        """
+        with self.lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+
+            # A probe that never reported back does not hold the breaker forever
+            now = time.monotonic()
+            started_at = self.opened_at if self.state == BREAKER_OPEN else self.probe_started_at
+            if now - started_at < self.cooldown:
+                return False
+
+            self.state = BREAKER_HALF_OPEN
+            self.probe_started_at = now
+            return True
+
+    def record_success(self):
+        """
+        Record that the server answered a connection attempt.
+        """
+        with self.lock:
+            if self.state != BREAKER_CLOSED:
+                print(f"    Circuit breaker closed for {self.server_name}")
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def record_failure(self):
+        """
+        Record a connection attempt the server did not answer.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.state == BREAKER_HALF_OPEN or self.failures >= self.threshold:
+                if self.state != BREAKER_OPEN:
+                    print(
+                        f"    Circuit breaker open for {self.server_name} after "
+                        f"{self.failures} failed connections, next probe in {self.cooldown:g}s"
+                    )
+                self.state = BREAKER_OPEN
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        """
+        Returns:
+            bool: True while connections to the server are short-circuited.
+        """
+        with self.lock:
+            return self.state != BREAKER_CLOSED
+
+
+# Breaker of each target server, shared by every thread and coroutine
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(server_name):
+    """
+    Args:
+        server_name (str): Name of the target PostgreSQL server.
+
+    Returns:
+        CircuitBreaker: The breaker of the server, created closed on first use.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(server_name)
+        if breaker is None:
+            breaker = CircuitBreaker(server_name)
+            _breakers[server_name] = breaker
+        return breaker
+
+
+def is_server_failure(e):
+    """
+    Args:
+        e (Exception): The error a connection attempt raised.
+
+    Returns:
+        bool: True if the server could not be reached or was not ready, so a retry may succeed.
+    """
+    if not isinstance(e, psycopg2.OperationalError):
+        return False
+
+    # libpq prefixes the errors the server answers with by FATAL
+    message = str(e)
+    if "FATAL:" not in message:
+        return True
+    return any(error in message for error in RETRYABLE_SERVER_ERRORS)
+
+
+def retry_delay(attempt, budget=None):
+    """
+    Args:
+        attempt (int): Number of attempts made so far, from 1.
+        budget (CollectionBudget, optional): The deadline of the run. Defaults to None.
+
+    Returns:
+        float: Seconds to wait before the next attempt, with full jitter.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+    remaining = budget.remaining() if budget is not None else None
+    return delay if remaining is None else min(delay, remaining)
+
+
+def connection_failed(breaker, e, attempt, attempts, budget):
+    """
+    Record a failed connection attempt and decide whether to retry it.
+
+    Args:
+        breaker (CircuitBreaker): The breaker of the server.
+        e (Exception): The error the attempt raised.
+        attempt (int): Number of attempts made so far, from 1.
+        attempts (int): Maximum number of attempts.
+        budget (CollectionBudget): The deadline of the run, or None.
+
+    Returns:
+        bool: True if the connection should be attempted again.
+    """
+    if not is_server_failure(e):
+        # The server answered, so it is up even though this connection failed
+        if isinstance(e, psycopg2.OperationalError):
+            breaker.record_success()
+        return False
+
+    breaker.record_failure()
+    return attempt < attempts and not (budget is not None and budget.expired())
+
+
+def connect_with_retry(server_name, connect, attempts=CONNECT_ATTEMPTS, budget=None):
+    """
+    Open a connection to a target server through its breaker, retrying
+    failures to reach the server with jittered exponential backoff.
+
+    Args:
+        server_name (str): Name of the target PostgreSQL server.
+        connect (callable): Opens and returns the connection, called once per attempt.
+        attempts (int, optional): Maximum number of attempts. Defaults to CONNECT_ATTEMPTS.
+        budget (CollectionBudget, optional): No retry starts after its deadline. Defaults to None.
+
+    Returns:
+        connection: The connection returned by connect.
+
+    Raises:
+        ServerUnavailable: If the breaker of the server is open.
+        Exception: The error of the last attempt.
+    """
+    breaker = get_breaker(server_name)
+
+    for attempt in range(1, attempts + 1):
+        if not breaker.allow():
+            raise ServerUnavailable(f"Circuit breaker open for {server_name}, not connecting")
+        try:
+            conn = connect()
+        except Exception as e:
+            if not connection_failed(breaker, e, attempt, attempts, budget):
+                raise
+            time.sleep(retry_delay(attempt, budget))
+            continue
+
+        breaker.record_success()
+        return conn
+
+
+async def connect_with_retry_async(server_name, connect, attempts=CONNECT_ATTEMPTS, budget=None):
+    """
+    Asynchronous version of connect_with_retry, waiting on the event loop between attempts.
+
+    Args:
+        server_name (str): Name of the target PostgreSQL server.
+        connect (callable): Returns a coroutine that opens the connection, called once per attempt.
+        attempts (int, optional): Maximum number of attempts. Defaults to CONNECT_ATTEMPTS.
+        budget (CollectionBudget, optional): No retry starts after its deadline. Defaults to None.
+
+    Returns:
+        connection: The connection returned by connect.
+
+    Raises:
+        ServerUnavailable: If the breaker of the server is open.
+        Exception: The error of the last attempt.
+    """
+    breaker = get_breaker(server_name)
+
+    for attempt in range(1, attempts + 1):
+        if not breaker.allow():
+            raise ServerUnavailable(f"Circuit breaker open for {server_name}, not connecting")
+        try:
+            conn = await connect()
+        except Exception as e:
+            if not connection_failed(breaker, e, attempt, attempts, budget):
+                raise
+            await asyncio.sleep(retry_delay(attempt, budget))
+            continue
+
+        breaker.record_success()
+        return conn
+
+
+def print_breakers():
+    """
+    Print the breaker of every server connected to in this process.
+    """
+    with _breakers_lock:
+        breakers = sorted(_breakers.values(), key=lambda breaker: breaker.server_name)
+
+    for breaker in breakers:
+        print(f"{breaker.server_name}: {breaker.state}, {breaker.failures} consecutive failures")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Connect to a PostgreSQL server through its circuit breaker, to check the retry settings."
+    )
+    parser.add_argument("server_name", help="Name of the PostgreSQL server")
+    parser.add_argument("username", help="Username for the PostgreSQL server")
+    parser.add_argument("password", help="Password for the PostgreSQL server")
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=5,
+        help="Number of connections to attempt one after another (default: 5)",
+    )
+
+    args = parser.parse_args()
+
+    for _ in range(args.connections):
+        started = time.monotonic()
+        try:
+            connect_with_retry(
+                args.server_name,
+                lambda: psycopg2.connect(
+                    host=args.server_name,
+                    user=args.username,
+                    password=args.password,
+                    dbname="postgres",
+                ),
+            ).close()
+            outcome = "connected"
+        except Exception as e:
+            outcome = f"{type(e).__name__}: {str(e).strip()}"
+        print(f"{time.monotonic() - started:.2f}s {outcome}")
+
+    print_breakers()
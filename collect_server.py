@@ -0,0 +1,1218 @@
+import argparse
+import queue
+import threading
+import psycopg2
+from psycopg2 import extensions
+from change_detection import CHANGE_DETECTED_COLLECTORS, ChangeTracker
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import (
+    CONNECT_TIMEOUT,
+    CollectionBudget,
+    DeadlineExceeded,
+    add_budget_arguments,
+    budget_from_args,
+    prioritized,
+    set_timeouts,
+    timeout_options,
+)
+from collection_runs import (
+    finish_collection_run,
+    pending_collectors,
+    start_collection_run,
+)
+from collection_timings import (
+    CollectionTimer,
+    print_timing_summary,
+    record_timer,
+    timed_phase,
+    write_collection_timings,
+)
+from collector_state import save_state
+from copy_transfer import COPY_TRANSFER_COLLECTORS, copy_transfer
+from database_inventory import get_database_inventory, invalidate_database_inventory
+from dba_spool import close_dba_connection, open_dba_connection
+from get_database_grants import DATABASE_GRANTS_QUERY
+from get_database_index_usage import DATABASE_INDEX_USAGE_QUERY
+from get_database_indexes import DATABASE_INDEXES_QUERY
+from get_database_sizes import DATABASE_SIZES_QUERY
+from get_database_table_sizes import DATABASE_TABLE_SIZES_QUERY, table_sizes_query
+from get_database_table_usage import DATABASE_TABLE_USAGE_QUERY
+from get_database_users import DATABASE_USERS_QUERY
+from insert_database_grants import write_database_grants
+from insert_database_index_sizes import write_database_index_sizes
+from insert_database_index_usage import write_database_index_usage
+from insert_database_sizes import write_database_sizes
+from insert_database_table_sizes import write_database_table_sizes
+from insert_database_table_usage import write_database_table_usage
+from insert_database_users import write_database_users
+from send_mail import send_mail
+from target_throttle import TargetBusy, get_throttle, sample_load, throttle_query
+from usage_deltas import USAGE_DELTA_COLLECTORS, read_usage_stats, write_usage_deltas
+
+# Collectors that run once per server, on the maintenance database connection
+SERVER_COLLECTORS = [
+    ("insert_database_sizes", DATABASE_SIZES_QUERY, write_database_sizes),
+    ("insert_database_users", DATABASE_USERS_QUERY, write_database_users),
+]
+
+# Collectors that run once per database, all on the same connection
+DATABASE_COLLECTORS = [
+    (
+        "insert_database_table_sizes",
+        DATABASE_TABLE_SIZES_QUERY,
+        write_database_table_sizes,
+    ),
+    (
+        "insert_database_table_usage",
+        DATABASE_TABLE_USAGE_QUERY,
+        write_database_table_usage,
+    ),
+    ("insert_database_index_sizes", DATABASE_INDEXES_QUERY, write_database_index_sizes),
+    (
+        "insert_database_index_usage",
+        DATABASE_INDEX_USAGE_QUERY,
+        write_database_index_usage,
+    ),
+    ("insert_database_grants", DATABASE_GRANTS_QUERY, write_database_grants),
+]
+
+# Collectors whose result sets grow with the catalog and can be streamed
+STREAMED_COLLECTORS = {
+    "insert_database_table_sizes",
+    "insert_database_index_sizes",
+    "insert_database_grants",
+}
+
+# Result sets the pipeline reader may hold ahead of the writer
+PIPELINE_DEPTH = 10
+
+# Target sessions a server run holds at once: the maintenance connection and
+# the connection to the database being collected, or read by the pipeline
+SERVER_RUN_SESSIONS = 2
+
+# Savepoint each collector runs under in the snapshot of its database. Rolled
+# back after every collector, which also undoes its timeouts.
+SNAPSHOT_SAVEPOINT_QUERY = "SAVEPOINT collector"
+SNAPSHOT_RESTORE_QUERY = "ROLLBACK TO SAVEPOINT collector; RELEASE SAVEPOINT collector"
+
+# Undoes a failed attempt of a collector in the snapshot, keeping its savepoint
+SNAPSHOT_RETRY_QUERY = "ROLLBACK TO SAVEPOINT collector"
+
+# Freezes the statistics views at their first read in the transaction,
+# on PostgreSQL 15 and later
+STATS_SNAPSHOT_QUERY = "SET LOCAL stats_fetch_consistency = snapshot"
+
+
+def database_collectors(estimate_sizes=None):
+    """
+    Get the per database collectors for a size mode.
+
+    Args:
+        estimate_sizes (int, optional): None to measure every table exactly, or the number
+                                        of largest tables to measure exactly while the
+                                        rest are estimated from relpages. Defaults to None.
+
+    Returns:
+        list: DATABASE_COLLECTORS, with the estimating table sizes query if asked for.
+    """
+    if estimate_sizes is None:
+        return DATABASE_COLLECTORS
+
+    return [
+        (name, table_sizes_query(estimate_sizes), writer)
+        if name == "insert_database_table_sizes"
+        else (name, query, writer)
+        for name, query, writer in DATABASE_COLLECTORS
+    ]
+
+
+def select_collectors(collectors, collector_names=None):
+    """
+    Args:
+        collectors (list): (name, query, writer) entries.
+        collector_names (set, optional): Names of the collectors to keep. Defaults to None, keep all.
+
+    Returns:
+        list: The collectors to run.
+    """
+    if collector_names is None:
+        return collectors
+
+    return [collector for collector in collectors if collector[0] in collector_names]
+
+
+def report_failure(function_name, target_server, database_name, e):
+    """
+    Print and email a collection failure.
+
+    Args:
+        function_name (str): Name of the collector that failed.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for the whole server.
+        e (Exception): The error that occurred.
+    """
+    location = target_server if database_name is None else f"{target_server}/{database_name}"
+    error_message = (
+        f"An error occurred in {function_name} on {location}. The error is  {e}"
+    )
+    error_subject = f"Failure: {function_name}"
+    error_recipients = "name@example.com"
+    print(error_message)
+    try:
+        send_mail(error_subject, error_message, error_recipients)
+    except Exception as e:
+        print(f"Failed to send email notification: {e}")
+
+
+def connect_target(server_name, user, password, db_name, connect_timeout=CONNECT_TIMEOUT):
+    """
+    Open a read only connection to a target database. Queries on it get the
+    default statement and lock timeouts until a collector sets its own.
+
+    Args:
+        server_name (str): Name of the PostgreSQL server.
+        user (str): Username for the PostgreSQL server.
+        password (str): Password for the PostgreSQL server.
+        db_name (str): Name of the database to connect to.
+        connect_timeout (int, optional): Seconds to wait for the connection. Defaults to CONNECT_TIMEOUT.
+
+    Returns:
+        connection: A read only psycopg2 connection.
+    """
+    conn = psycopg2.connect(
+        host=server_name,
+        user=user,
+        password=password,
+        dbname=db_name,
+        connect_timeout=connect_timeout,
+        options=timeout_options(),
+    )
+    # Each collector runs in its own read only transaction, see collect
+    conn.set_session(readonly=True, autocommit=False)
+
+    return conn
+
+
+def execute_target(conn, query):
+    """
+    Run a statement without results on a target connection.
+
+    Args:
+        conn (connection): An open connection to the target database.
+        query (str): The statement.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+    finally:
+        cursor.close()
+
+
+def begin_snapshot(conn):
+    """
+    Start the snapshot of a database on an idle target connection. Until
+    end_snapshot, the collectors share one REPEATABLE READ read only
+    transaction, so the tables, indexes and counters they read are those of
+    the same moment. Each collector runs under a savepoint, see collect.
+
+    Args:
+        conn (connection): An open connection to the target database.
+    """
+    conn.rollback()
+    conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    if conn.server_version >= 150000:
+        execute_target(conn, STATS_SNAPSHOT_QUERY)
+
+
+def end_snapshot(conn):
+    """
+    End the snapshot of a database, and go back to a transaction per collector.
+
+    Args:
+        conn (connection): An open connection to the target database.
+    """
+    if conn.closed:
+        return
+    conn.rollback()
+    conn.set_session(isolation_level="DEFAULT", readonly=True)
+
+
+def restore_snapshot(conn):
+    """
+    Roll the snapshot back to before the last collector, whether it failed or not.
+
+    Args:
+        conn (connection): An open connection to the target database.
+    """
+    try:
+        execute_target(conn, SNAPSHOT_RESTORE_QUERY)
+    except psycopg2.Error:
+        # The later collectors get a snapshot of their own
+        if not conn.closed:
+            conn.rollback()
+
+
+def retry_collector(conn, collector_name, budget=None, snapshot=False):
+    """
+    Undo a failed attempt of a collector on a target connection, which may
+    have aborted its transaction, so the collector can run again.
+
+    Args:
+        conn (connection): An open connection to the target database.
+        collector_name (str): Name of the collector.
+        budget (CollectionBudget, optional): The timeouts to set again. Defaults to None.
+        snapshot (bool, optional): The collector runs in the snapshot of the database. Defaults to False.
+    """
+    if snapshot:
+        execute_target(conn, SNAPSHOT_RETRY_QUERY)
+    else:
+        conn.rollback()
+    if budget is not None:
+        set_timeouts(conn, budget, collector_name)
+
+
+def throttle_collectors(conn, collectors, budget=None):
+    """
+    Check the collectors of a database against the load of the target before
+    its snapshot begins, as sampling the load ends the transaction it runs in.
+
+    Args:
+        conn (connection): An open connection to the target database, outside a transaction.
+        collectors (list): (name, query, writer) entries.
+        budget (CollectionBudget, optional): No waiting past its deadline. Defaults to None.
+
+    Returns:
+        list: (collector, error) pairs. The error is the TargetBusy of a postponed collector, or None.
+    """
+    throttled = []
+    for name, query, writer in collectors:
+        try:
+            # The load is that of the host connected to, which may be a standby
+            query = throttle_query(conn.info.host, name, query, lambda: sample_load(conn), budget)
+        except TargetBusy as e:
+            throttled.append(((name, query, writer), e))
+            continue
+        throttled.append(((name, query, writer), None))
+
+    return throttled
+
+
+def run_query(conn, query, timer=None):
+    """
+    Run a query on an open connection and return all of its rows.
+
+    Args:
+        conn (connection): An open psycopg2 connection.
+        query (str): The query to run.
+        timer (CollectionTimer, optional): Times the query and fetch phases. Defaults to None.
+
+    Returns:
+        list: A list of tuples returned by the query.
+    """
+    cursor = conn.cursor()
+    try:
+        with timed_phase(timer, "query"):
+            cursor.execute(query)
+        with timed_phase(timer, "fetch"):
+            rows = cursor.fetchall()
+        if timer is not None:
+            timer.row_count = len(rows)
+        return rows
+    finally:
+        cursor.close()
+
+
+def stream_query(conn, query, itersize, timer=None):
+    """
+    Run a query on a server side cursor and yield its rows.
+    Only itersize rows are held in memory at a time, however large the result is.
+
+    Args:
+        conn (connection): An open psycopg2 connection, not in autocommit mode.
+        query (str): The query to run.
+        itersize (int): Number of rows fetched from the server per round trip.
+        timer (CollectionTimer, optional): Times the query and fetch phases. Defaults to None.
+
+    Yields:
+        tuple: Each row returned by the query.
+    """
+    cursor = conn.cursor(name="pginfo_stream")
+    cursor.itersize = itersize
+    try:
+        with timed_phase(timer, "query"):
+            cursor.execute(query)
+        rows = timer.timed_rows(cursor) if timer is not None else cursor
+        for row in rows:
+            yield row
+    finally:
+        cursor.close()
+
+
+def write_collected(
+    conn_dba,
+    cursor_dba,
+    target_server,
+    database_name,
+    collector,
+    rows,
+    timer,
+    usage_stats=None,
+    changes_only=False,
+    run=None,
+):
+    """
+    Write the rows of one collector to the DBA database and commit them.
+    Only once the commit succeeded are the delta and change detection
+    baselines moved forward. With a run, its progress row is committed in
+    the same transaction as the rows, and the rows are stamped with the
+    start of the run.
+
+    Args:
+        conn_dba (connection): An open connection to the DBA database.
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector (tuple): A (name, query, writer) entry from SERVER_COLLECTORS or DATABASE_COLLECTORS.
+        rows (iterable): The rows returned by the collector query. May be a stream.
+        timer (CollectionTimer): Times the write phase.
+        usage_stats (tuple, optional): Stats read with usage_deltas.read_usage_stats, to write usage deltas. Defaults to None.
+        changes_only (bool, optional): Skip unchanged grants, users and indexes. Defaults to False.
+        run (CollectionRun, optional): The run to record the unit as complete in. Defaults to None.
+
+    Raises:
+        Exception: If the rows could not be written. The DBA transaction is left to the caller.
+    """
+    name, _, writer = collector
+    usage_state = None
+    change_tracker = None
+    last_updated = run.started_at if run is not None else None
+
+    # Reading a stream inside the writer is counted as fetch, not write
+    with timer.phase("write"):
+        if changes_only and name in CHANGE_DETECTED_COLLECTORS:
+            change_tracker = ChangeTracker(target_server, database_name, name)
+            writer(cursor_dba, target_server, change_tracker.filter(rows), last_updated)
+            change_tracker.write_removals_and_heartbeat(cursor_dba, last_updated)
+        else:
+            writer(cursor_dba, target_server, rows, last_updated)
+
+        if usage_stats is not None:
+            usage_state = write_usage_deltas(
+                cursor_dba, target_server, database_name, name, rows, usage_stats
+            )
+
+        if run is not None:
+            run.record_progress(
+                cursor_dba, target_server, database_name, name, timer.row_count
+            )
+
+        # Commit each collector on its own so one failure does not lose the rest
+        conn_dba.commit()
+
+    # Only move the baselines forward once the changes are stored
+    if usage_state is not None:
+        save_state(target_server, database_name, name, usage_state)
+    if change_tracker is not None:
+        change_tracker.save()
+
+
+def collect(
+    conn,
+    conn_dba,
+    cursor_dba,
+    target_server,
+    database_name,
+    collector,
+    itersize=None,
+    deltas=False,
+    changes_only=False,
+    use_copy=False,
+    run=None,
+    budget=None,
+    snapshot=False,
+):
+    """
+    Run one collector on an open target connection and write its rows to the DBA database.
+    With itersize set, collectors in STREAMED_COLLECTORS read through a server
+    side cursor and stream their rows straight into the writer. With deltas
+    set, usage collectors also write their changes since the previous run.
+    With changes_only set, collectors in CHANGE_DETECTED_COLLECTORS only write
+    new or changed objects, plus removals and a heartbeat. With use_copy set,
+    collectors in COPY_TRANSFER_COLLECTORS are copied from the target straight
+    into the DBA table, unless their rows are needed for deltas. If the COPY
+    fails, the rows are fetched and written as without use_copy. With a
+    budget, the collector gets its statement and lock timeouts, and is not
+    started at all once the run deadline has passed. Heavy collectors wait
+    while the target is busy, see target_throttle. With snapshot set, the
+    collector runs under a savepoint in the snapshot of its database, see
+    begin_snapshot, and must have been throttled before the snapshot began.
+
+    Args:
+        conn (connection): An open connection to the target database.
+        conn_dba (connection): An open connection to the DBA database.
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector (tuple): A (name, query, writer) entry from SERVER_COLLECTORS or DATABASE_COLLECTORS.
+        itersize (int, optional): Rows per round trip when streaming. Defaults to None, no streaming.
+        deltas (bool, optional): Write usage deltas as well as raw counters. Defaults to False.
+        changes_only (bool, optional): Skip unchanged grants, users and indexes. Defaults to False.
+        use_copy (bool, optional): Copy rows from the target to the DBA table without parsing them. Defaults to False.
+        run (CollectionRun, optional): The run to record the unit as complete in. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        snapshot (bool, optional): Run in the snapshot of the database instead of a transaction of its own. Defaults to False.
+
+    Returns:
+        bool: True if the rows were collected and committed, False otherwise.
+    """
+    name, query, _ = collector
+    if budget is not None and budget.expired():
+        # Left for a resumed run, without a failure report
+        return False
+
+    rows = None
+    usage_stats = None
+    timer = CollectionTimer(target_server, database_name, name)
+    succeeded = False
+
+    try:
+        if snapshot:
+            execute_target(conn, SNAPSHOT_SAVEPOINT_QUERY)
+        else:
+            # Wait for a busy target, before the timeouts as sampling rolls back
+            # The load is that of the host connected to, which may be a standby
+            query = throttle_query(
+                conn.info.host, name, query, lambda: sample_load(conn), budget
+            )
+        if budget is not None:
+            set_timeouts(conn, budget, name)
+
+        if (
+            use_copy
+            and name in COPY_TRANSFER_COLLECTORS
+            and not (deltas and name in USAGE_DELTA_COLLECTORS)
+        ):
+            table, columns = COPY_TRANSFER_COLLECTORS[name]
+            try:
+                timer.row_count = copy_transfer(
+                    conn,
+                    cursor_dba,
+                    target_server,
+                    query,
+                    table,
+                    columns,
+                    timer,
+                    run.started_at if run is not None else None,
+                )
+            except psycopg2.Error as e:
+                # Fetch the rows instead, bulk_insert falls back to INSERT if need be
+                print(
+                    f"    COPY of {name} failed, fetching the rows instead. The error is  {e}"
+                )
+                retry_collector(conn, name, budget, snapshot)
+            else:
+                with timer.phase("write"):
+                    if run is not None:
+                        run.record_progress(
+                            cursor_dba, target_server, database_name, name, timer.row_count
+                        )
+                    conn_dba.commit()
+
+                succeeded = True
+                return True
+
+        if itersize and name in STREAMED_COLLECTORS:
+            rows = stream_query(conn, query, itersize, timer)
+        else:
+            rows = run_query(conn, query, timer)
+        if deltas and name in USAGE_DELTA_COLLECTORS:
+            usage_stats = read_usage_stats(conn)
+
+        write_collected(
+            conn_dba,
+            cursor_dba,
+            target_server,
+            database_name,
+            collector,
+            rows,
+            timer,
+            usage_stats,
+            changes_only,
+            run,
+        )
+
+        succeeded = True
+        return True
+
+    except TargetBusy as e:
+        # Left for the next run, without a failure report
+        print(f"    {e}")
+
+        return False
+
+    except Exception as e:
+        conn_dba.rollback()
+        report_failure(name, target_server, database_name, e)
+
+        return False
+
+    finally:
+        # Close any half read stream, then end the read only transaction,
+        # or only the part of the snapshot the collector used
+        if rows is not None and not isinstance(rows, list):
+            rows.close()
+        if snapshot:
+            restore_snapshot(conn)
+        elif not conn.closed:
+            conn.rollback()
+        record_timer(timer, succeeded)
+
+
+def connect_database(server_name, user, password, db_name, budget=None, host=None):
+    """
+    Open a read only connection to a target database, timed as a connect span.
+    Failures to reach the host are retried with backoff, and counted by the
+    circuit breaker of the host, see circuit_breaker.
+
+    Args:
+        server_name (str): Name of the PostgreSQL server.
+        user (str): Username for the PostgreSQL server.
+        password (str): Password for the PostgreSQL server.
+        db_name (str): Name of the database to connect to.
+        budget (CollectionBudget, optional): The connect timeout and deadline of the run. Defaults to None.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+
+    Returns:
+        connection: A read only psycopg2 connection.
+
+    Raises:
+        ServerUnavailable: If the circuit breaker of the host is open.
+    """
+    budget = budget or CollectionBudget()
+    host = host or server_name
+    timer = CollectionTimer(server_name, db_name, None)
+    succeeded = False
+
+    try:
+        with timer.phase("connect"):
+            conn = connect_with_retry(
+                host,
+                lambda: connect_target(host, user, password, db_name, budget.connect_seconds()),
+                budget=budget,
+            )
+        succeeded = True
+        return conn
+    finally:
+        record_timer(timer, succeeded)
+
+
+def queue_item(work_queue, stop, item):
+    """
+    Put an item on the pipeline queue, waiting for room unless the writer has stopped.
+
+    Args:
+        work_queue (queue.Queue): The bounded pipeline queue.
+        stop (threading.Event): Set by the writer when it stops reading the queue.
+        item (tuple): The item to queue.
+
+    Returns:
+        bool: True if the item was queued, False if the writer stopped.
+    """
+    while not stop.is_set():
+        try:
+            work_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def read_databases(
+    target_server,
+    target_username,
+    target_password,
+    conn_server,
+    maintenance_db,
+    databases,
+    collectors,
+    deltas,
+    work_queue,
+    stop,
+    run=None,
+    budget=None,
+    host=None,
+):
+    """
+    Reader stage of the pipeline. Run every per database collector, one
+    database after another, and queue the rows for the writer. The queue is
+    bounded, so the reader waits once it is PIPELINE_DEPTH result sets ahead.
+    Each item is a (database name, collector, rows, usage stats, timer, error)
+    tuple. The collector is None if the database could not be read at all,
+    and a final None item marks the end. Databases whose collectors the run
+    has all completed are not connected to. The collectors of a database
+    read one snapshot of it, see begin_snapshot. Once the run deadline passes,
+    a DeadlineExceeded error item is queued and reading stops, and the same
+    goes for a ServerUnavailable error once the server's breaker opens.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        target_username (str): Username for the target PostgreSQL server.
+        target_password (str): Password for the target PostgreSQL server.
+        conn_server (connection): The open connection to the maintenance database.
+        maintenance_db (str): Name of the maintenance database.
+        databases (list): Names of the databases to read.
+        collectors (list): The per database collectors to run.
+        deltas (bool): Read the statistics reset time for usage deltas.
+        work_queue (queue.Queue): The bounded pipeline queue.
+        stop (threading.Event): Set by the writer when it stops reading the queue.
+        run (CollectionRun, optional): The run whose completed units are skipped. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+    """
+    budget = budget or CollectionBudget()
+
+    try:
+        for current_database in databases:
+            pending = pending_collectors(run, target_server, current_database, collectors)
+            if not pending:
+                continue
+            if budget.expired():
+                queue_item(
+                    work_queue,
+                    stop,
+                    (None, None, None, None, None, DeadlineExceeded("Run deadline reached")),
+                )
+                return
+
+            if current_database == maintenance_db:
+                conn = conn_server
+            else:
+                try:
+                    conn = connect_database(
+                        target_server,
+                        target_username,
+                        target_password,
+                        current_database,
+                        budget,
+                        host,
+                    )
+                except ServerUnavailable as e:
+                    # The other databases are on the same server, stop reading
+                    queue_item(work_queue, stop, (None, None, None, None, None, e))
+                    return
+                except Exception as e:
+                    # The database may have been dropped, read pg_database next time
+                    invalidate_database_inventory(target_server)
+                    if not queue_item(
+                        work_queue, stop, (current_database, None, None, None, None, e)
+                    ):
+                        return
+                    continue
+
+            try:
+                throttled = throttle_collectors(conn, pending, budget)
+                try:
+                    begin_snapshot(conn)
+                except Exception as e:
+                    if not queue_item(
+                        work_queue, stop, (current_database, None, None, None, None, e)
+                    ):
+                        return
+                    continue
+
+                for collector, busy in throttled:
+                    name, query, _ = collector
+                    timer = CollectionTimer(target_server, current_database, name)
+                    rows = None
+                    usage_stats = None
+                    error = busy
+
+                    if error is None:
+                        try:
+                            if budget.expired():
+                                raise DeadlineExceeded("Run deadline reached")
+                            execute_target(conn, SNAPSHOT_SAVEPOINT_QUERY)
+                            set_timeouts(conn, budget, name)
+                            rows = run_query(conn, query, timer)
+                            if deltas and name in USAGE_DELTA_COLLECTORS:
+                                usage_stats = read_usage_stats(conn)
+                        except Exception as e:
+                            error = e
+                        finally:
+                            restore_snapshot(conn)
+
+                    if not queue_item(
+                        work_queue,
+                        stop,
+                        (current_database, collector, rows, usage_stats, timer, error),
+                    ):
+                        return
+            finally:
+                if conn is not conn_server:
+                    conn.close()
+                else:
+                    end_snapshot(conn)
+
+    except Exception as e:
+        queue_item(work_queue, stop, (None, None, None, None, None, e))
+
+    finally:
+        queue_item(work_queue, stop, None)
+
+
+def collect_databases_pipelined(
+    conn_server,
+    conn_dba,
+    cursor_dba,
+    target_server,
+    target_username,
+    target_password,
+    maintenance_db,
+    databases,
+    collectors=DATABASE_COLLECTORS,
+    deltas=False,
+    changes_only=False,
+    run=None,
+    budget=None,
+    host=None,
+):
+    """
+    Run every per database collector with reads and writes overlapped.
+    A reader thread fetches the next result sets from the target while this
+    thread writes the previous ones to the DBA database, so a server takes
+    about as long as the slower of the two instead of their sum. Result sets
+    are read in full, so itersize does not apply.
+
+    Args:
+        conn_server (connection): The open connection to the maintenance database.
+        conn_dba (connection): An open connection to the DBA database.
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        target_username (str): Username for the target PostgreSQL server.
+        target_password (str): Password for the target PostgreSQL server.
+        maintenance_db (str): Name of the maintenance database.
+        databases (list): Names of the databases to collect.
+        collectors (list, optional): The per database collectors to run. Defaults to DATABASE_COLLECTORS.
+        deltas (bool, optional): Write usage deltas since the previous run. Defaults to False.
+        changes_only (bool, optional): Only write grants, users and indexes that changed. Defaults to False.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+
+    Returns:
+        set: The names of the collectors that failed on any database.
+    """
+    failed = set()
+    work_queue = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+
+    reader = threading.Thread(
+        target=read_databases,
+        args=(
+            target_server,
+            target_username,
+            target_password,
+            conn_server,
+            maintenance_db,
+            databases,
+            collectors,
+            deltas,
+            work_queue,
+            stop,
+            run,
+            budget,
+            host,
+        ),
+        name=f"pginfo-reader-{target_server}",
+        daemon=True,
+    )
+    reader.start()
+
+    try:
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+
+            database_name, collector, rows, usage_stats, timer, error = item
+            if collector is None:
+                if not isinstance(error, DeadlineExceeded):
+                    report_failure(
+                        collect_databases_pipelined.__name__, target_server, database_name, error
+                    )
+                failed.update(name for name, _, _ in collectors)
+                continue
+
+            succeeded = False
+            try:
+                if isinstance(error, TargetBusy):
+                    print(f"    {error}")
+                elif error is not None:
+                    if not isinstance(error, DeadlineExceeded):
+                        report_failure(collector[0], target_server, database_name, error)
+                else:
+                    write_collected(
+                        conn_dba,
+                        cursor_dba,
+                        target_server,
+                        database_name,
+                        collector,
+                        rows,
+                        timer,
+                        usage_stats,
+                        changes_only,
+                        run,
+                    )
+                    succeeded = True
+            except Exception as e:
+                conn_dba.rollback()
+                report_failure(collector[0], target_server, database_name, e)
+            finally:
+                record_timer(timer, succeeded)
+
+            if not succeeded:
+                failed.add(collector[0])
+
+    finally:
+        stop.set()
+        reader.join()
+
+    return failed
+
+
+def collect_server(
+    target_server,
+    target_username,
+    target_password,
+    dba_username,
+    dba_password,
+    maintenance_db="postgres",
+    itersize=None,
+    deltas=False,
+    changes_only=False,
+    pipeline=False,
+    use_copy=False,
+    estimate_sizes=None,
+    run=None,
+    spool=None,
+    budget=None,
+    collector_names=None,
+    host=None,
+):
+    """
+    Collect every metric from a target server, connecting once per database.
+    Server level information (database sizes and users) is read on the
+    maintenance database connection. Every per database collector then runs on
+    a single connection to that database, in one REPEATABLE READ snapshot of
+    it, and the rows are handed to the writers of the insert scripts. With pipeline set, the next database is
+    read while the previous one is written, see collect_databases_pipelined.
+    With use_copy set, table sizes, table usage and index usage are copied
+    from the target straight into the DBA tables, see copy_transfer, or
+    fetched as usual if the COPY fails. The
+    pipeline reads every result set into Python, so it does not use COPY.
+    With estimate_sizes set, table sizes are estimated from relpages except
+    for the largest tables, see database_collectors.
+    Each collector commits on its own. With a run, the commit also records the
+    unit in dba.collection_progress, and units the run already completed are
+    skipped, see collection_runs. With a spool, every commit is appended to
+    the local spool instead of DBA001, see dba_spool.
+    Collectors run most important first, each with the statement and lock
+    timeouts of the budget. Once its deadline passes nothing new starts, and
+    the collectors left over are reported as failed so they can be resumed.
+    Connections are retried with backoff. Once the circuit breaker of the
+    server opens, the databases left are skipped with a single report.
+    With host set, every connection goes to that host instead, such as a
+    standby of the server, and the rows are still written for the server,
+    see replica_routing.
+    A run holds SERVER_RUN_SESSIONS target sessions at once. They are
+    reserved before connecting, so threads collecting from the same host
+    stay within its session limit, see target_throttle.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        target_username (str): Username for the target PostgreSQL server.
+        target_password (str): Password for the target PostgreSQL server.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        maintenance_db (str, optional): Database used for server level queries. Defaults to 'postgres'.
+        itersize (int, optional): Stream large collectors, fetching this many rows per round trip. Defaults to None.
+        deltas (bool, optional): Write usage deltas since the previous run. Defaults to False.
+        changes_only (bool, optional): Only write grants, users and indexes that changed. Defaults to False.
+        pipeline (bool, optional): Overlap reading from the target with writing to the DBA database. Defaults to False.
+        use_copy (bool, optional): Copy table sizes and usage rows without parsing them. Defaults to False.
+        estimate_sizes (int, optional): Estimate table sizes, measuring only this many of the largest tables. Defaults to None, measure every table.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None, the default timeouts.
+        collector_names (set, optional): Run only these collectors. Defaults to None, every collector.
+        host (str, optional): Host to connect to, such as a standby of the server. Defaults to None, the server itself.
+
+    Returns:
+        dict: A dict of collector name to True/False success, for the collectors that were to run.
+    """
+    server_collectors = prioritized(select_collectors(SERVER_COLLECTORS, collector_names))
+    collectors = prioritized(select_collectors(database_collectors(estimate_sizes), collector_names))
+    results = {name: True for name, _, _ in server_collectors + collectors}
+    budget = budget or CollectionBudget()
+
+    if budget.expired():
+        print(f"    Run deadline reached, skipping server {target_server}")
+        return {name: False for name in results}
+
+    # Wait for the sessions of the run, while other threads use the session limit of the host
+    throttle = get_throttle(host or target_server)
+    if not throttle.acquire_sessions(SERVER_RUN_SESSIONS, budget.remaining()):
+        print(f"    Run deadline reached waiting for sessions, skipping server {target_server}")
+        return {name: False for name in results}
+
+    # Initialize connections and cursor
+    conn_dba = None
+    cursor_dba = None
+    conn_server = None
+
+    try:
+        # Borrow a connection to the DBA001 server, or write to the spool
+        conn_dba = open_dba_connection(dba_username, dba_password, spool)
+        cursor_dba = conn_dba.cursor()
+
+        # Get databases from the target server on the maintenance connection,
+        # unless the cached inventory is recent enough
+        conn_server = connect_database(
+            target_server,
+            target_username,
+            target_password,
+            maintenance_db,
+            budget,
+            host,
+        )
+        databases = []
+        if collectors:
+            databases = get_database_inventory(
+                target_server, target_username, target_password, conn=conn_server
+            )
+            conn_server.rollback()
+
+        # Server level collectors
+        for collector in pending_collectors(run, target_server, None, server_collectors):
+            if not collect(
+                conn_server,
+                conn_dba,
+                cursor_dba,
+                target_server,
+                None,
+                collector,
+                changes_only=changes_only,
+                run=run,
+                budget=budget,
+            ):
+                results[collector[0]] = False
+
+        if pipeline:
+            for name in collect_databases_pipelined(
+                conn_server,
+                conn_dba,
+                cursor_dba,
+                target_server,
+                target_username,
+                target_password,
+                maintenance_db,
+                databases,
+                collectors,
+                deltas,
+                changes_only,
+                run,
+                budget,
+                host,
+            ):
+                results[name] = False
+        else:
+            # Foreach database, run every collector in one snapshot on one connection
+            server_unavailable = None
+            for current_database in databases:
+                pending = pending_collectors(run, target_server, current_database, collectors)
+                if not pending:
+                    continue
+                if budget.expired() or server_unavailable is not None:
+                    for name, _, _ in pending:
+                        results[name] = False
+                    continue
+
+                if current_database == maintenance_db:
+                    conn = conn_server
+                else:
+                    try:
+                        conn = connect_database(
+                            target_server,
+                            target_username,
+                            target_password,
+                            current_database,
+                            budget,
+                            host,
+                        )
+                    except ServerUnavailable as e:
+                        # Skip the rest of the server, and report it once
+                        server_unavailable = e
+                        report_failure(collect_server.__name__, target_server, None, e)
+                        for name, _, _ in pending:
+                            results[name] = False
+                        continue
+                    except Exception as e:
+                        # The database may have been dropped, read pg_database next time
+                        invalidate_database_inventory(target_server)
+                        report_failure(
+                            collect_server.__name__, target_server, current_database, e
+                        )
+                        for name, _, _ in pending:
+                            results[name] = False
+                        continue
+
+                try:
+                    throttled = throttle_collectors(conn, pending, budget)
+                    try:
+                        begin_snapshot(conn)
+                    except Exception as e:
+                        report_failure(
+                            collect_server.__name__, target_server, current_database, e
+                        )
+                        throttled = []
+                        for name, _, _ in pending:
+                            results[name] = False
+
+                    for collector, busy in throttled:
+                        if busy is not None:
+                            # Left for the next run, without a failure report
+                            print(f"    {busy}")
+                            results[collector[0]] = False
+                        elif not collect(
+                            conn,
+                            conn_dba,
+                            cursor_dba,
+                            target_server,
+                            current_database,
+                            collector,
+                            itersize,
+                            deltas,
+                            changes_only,
+                            use_copy,
+                            run,
+                            budget,
+                            snapshot=True,
+                        ):
+                            results[collector[0]] = False
+                finally:
+                    if conn is not conn_server:
+                        conn.close()
+                    else:
+                        end_snapshot(conn)
+
+    except Exception as e:
+        report_failure(collect_server.__name__, target_server, None, e)
+
+        # The server could not be processed, so nothing can be trusted as complete
+        results = {name: False for name in results}
+
+        if conn_dba is not None:
+            conn_dba.rollback()
+
+    finally:
+        if conn_server is not None:
+            conn_server.close()
+        if cursor_dba is not None:
+            cursor_dba.close()
+        if conn_dba is not None:
+            close_dba_connection(conn_dba)
+        throttle.release_sessions(SERVER_RUN_SESSIONS)
+
+    if budget.expired():
+        print(f"    Run deadline reached on {target_server}, the collectors left were skipped")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Collect every metric from a target server into the DBAAdmin database."
+    )
+    parser.add_argument("target_server", help="Name of the target PostgreSQL server")
+    parser.add_argument(
+        "target_username", help="Username for the target PostgreSQL server"
+    )
+    parser.add_argument(
+        "target_password", help="Password for the target PostgreSQL server"
+    )
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+    parser.add_argument(
+        "--itersize",
+        type=int,
+        help="Stream large result sets, fetching this many rows per round trip",
+    )
+    parser.add_argument(
+        "--deltas",
+        action="store_true",
+        help="Also write table and index usage deltas since the previous run",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="Only write grants, users and indexes that changed since the previous run",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Read the next database while the previous one is written",
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Copy table sizes and table and index usage from the target with COPY, without parsing the rows",
+    )
+    parser.add_argument(
+        "--estimate-sizes",
+        type=int,
+        nargs="?",
+        const=0,
+        metavar="EXACT_TOP",
+        help="Estimate table sizes from relpages, measuring only the EXACT_TOP largest tables exactly (default: 0)",
+    )
+    parser.add_argument(
+        "--resume",
+        type=int,
+        metavar="RUN_ID",
+        help="Resume an earlier run, skipping the collectors it completed",
+    )
+
+    add_budget_arguments(parser)
+
+    args = parser.parse_args()
+
+    collection_budget = budget_from_args(args)
+    collection_run = start_collection_run(args.dba_username, args.dba_password, args.resume)
+    print(f"Collection run {collection_run.run_id}")
+
+    collector_results = collect_server(
+        args.target_server,
+        args.target_username,
+        args.target_password,
+        args.dba_username,
+        args.dba_password,
+        itersize=args.itersize,
+        deltas=args.deltas,
+        changes_only=args.changes_only,
+        pipeline=args.pipeline,
+        use_copy=args.copy,
+        estimate_sizes=args.estimate_sizes,
+        run=collection_run,
+        budget=collection_budget,
+    )
+    for collector_name, succeeded in collector_results.items():
+        print(f"{collector_name}: {'OK' if succeeded else 'FAILED'}")
+
+    run_succeeded = all(collector_results.values())
+    finish_collection_run(args.dba_username, args.dba_password, collection_run, run_succeeded)
+    if not run_succeeded:
+        print(f"Resume with --resume {collection_run.run_id}")
+
+    write_collection_timings(args.dba_username, args.dba_password)
+    print_timing_summary()
@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+
+# Seconds to wait for a target or DBA connection. PGINFO_CONNECT_TIMEOUT overrides it.
+CONNECT_TIMEOUT = int(os.environ.get("PGINFO_CONNECT_TIMEOUT", "10"))
+
+# Seconds a collector query may run, unless COLLECTOR_TIMEOUTS says otherwise
+STATEMENT_TIMEOUT = float(os.environ.get("PGINFO_STATEMENT_TIMEOUT", "300"))
+
+# Seconds a collector query may wait for a lock, e.g. on a catalog behind an
+# ACCESS EXCLUSIVE lock, before it gives up
+LOCK_TIMEOUT = float(os.environ.get("PGINFO_LOCK_TIMEOUT", "5"))
+
+# Statement timeout of each collector in seconds
+COLLECTOR_TIMEOUTS = {
+    "insert_database_sizes": 120,
+    "insert_database_users": 60,
+    "insert_database_table_sizes": 600,
+    "insert_database_table_usage": 120,
+    "insert_database_index_sizes": 300,
+    "insert_database_index_usage": 120,
+    "insert_database_grants": 300,
+}
+
+# Order collectors run in, most important first. Usage counters are lost if
+# an interval is missed, sizes and grants change slowly.
+COLLECTOR_PRIORITIES = {
+    "insert_database_sizes": 1,
+    "insert_database_table_usage": 1,
+    "insert_database_index_usage": 1,
+    "insert_database_users": 2,
+    "insert_database_table_sizes": 2,
+    "insert_database_index_sizes": 3,
+    "insert_database_grants": 3,
+}
+
+# Sets the timeouts of the next collector on a target connection. Works in
+# and out of a transaction, and is undone by a rollback.
+SET_TIMEOUTS_QUERY = """
+    SELECT set_config('statement_timeout', %s, false),
+           set_config('lock_timeout', %s, false);
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised for collectors that were not started because the run deadline passed.
+    """
+
+
+class CollectionBudget:
+    """
+    The time a run may take. Each collector query gets a statement timeout,
+    its own or the time left before the run deadline, whichever is shorter,
+    and a lock timeout. Once the deadline has passed no collector starts, so
+    a run stops at the deadline with its completed collectors committed.
+    The time the run spends waiting for each busy target is also counted,
+    see target_throttle.
+    """
+
+    def __init__(
+        self,
+        deadline=None,
+        statement_timeout=STATEMENT_TIMEOUT,
+        lock_timeout=LOCK_TIMEOUT,
+        collector_timeouts=None,
+        connect_timeout=CONNECT_TIMEOUT,
+    ):
+        self.expires_at = time.monotonic() + deadline if deadline is not None else None
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.collector_timeouts = {**COLLECTOR_TIMEOUTS, **(collector_timeouts or {})}
+        self.connect_timeout = connect_timeout
+        self.throttle_waits = {}
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left before the deadline, or None if there is no deadline.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        """
+        Returns:
+            bool: True once the deadline has passed.
+        """
+        return self.expires_at is not None and self.remaining() <= 0
+
+    def throttle_wait_seconds(self, host, max_wait):
+        """
+        Args:
+            host (str): The target host.
+            max_wait (float): Seconds the run may wait for the host in all.
+
+        Returns:
+            float: Seconds the run may still wait for the host to quiet down, 0 once spent or past the deadline.
+        """
+        with self.lock:
+            left = max_wait - self.throttle_waits.get(host, 0.0)
+        remaining = self.remaining()
+        if remaining is not None:
+            left = min(left, remaining)
+        return max(0.0, left)
+
+    def record_throttle_wait(self, host, seconds):
+        """
+        Args:
+            host (str): The target host.
+            seconds (float): Seconds spent waiting for the host to quiet down.
+        """
+        with self.lock:
+            self.throttle_waits[host] = self.throttle_waits.get(host, 0.0) + seconds
+
+    def connect_seconds(self):
+        """
+        Returns:
+            int: Seconds to wait for a connection, at least 1.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return self.connect_timeout
+        return max(1, min(self.connect_timeout, int(remaining)))
+
+    def statement_seconds(self, collector_name):
+        """
+        Args:
+            collector_name (str): Name of the collector, or None for other queries.
+
+        Returns:
+            float: Seconds the next query of the collector may run.
+        """
+        timeout = self.collector_timeouts.get(collector_name, self.statement_timeout)
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def timeout_settings(self, collector_name):
+        """
+        Args:
+            collector_name (str): Name of the collector, or None for other queries.
+
+        Returns:
+            tuple: The statement_timeout and lock_timeout settings, for SET_TIMEOUTS_QUERY.
+        """
+        return (
+            f"{max(1, int(self.statement_seconds(collector_name) * 1000))}ms",
+            f"{max(1, int(self.lock_timeout * 1000))}ms",
+        )
+
+
+def prioritized(collectors):
+    """
+    Args:
+        collectors (list): (name, query, writer) entries.
+
+    Returns:
+        list: The collectors, most important first, otherwise in their original order.
+    """
+    return sorted(collectors, key=lambda collector: COLLECTOR_PRIORITIES.get(collector[0], 9))
+
+
+def timeout_options(collector_name=None):
+    """
+    Get libpq options that set the default timeouts of a collector for a whole session,
+    for scripts that run one collector per connection.
+
+    Args:
+        collector_name (str, optional): Name of the collector. Defaults to None, the default timeouts.
+
+    Returns:
+        str: The value for the options connection parameter.
+    """
+    statement_timeout, lock_timeout = CollectionBudget().timeout_settings(collector_name)
+    return f"-c statement_timeout={statement_timeout} -c lock_timeout={lock_timeout}"
+
+
+def set_timeouts(conn, budget, collector_name):
+    """
+    Set the timeouts of the next collector on a target connection.
+
+    Args:
+        conn (connection): An open psycopg2 connection to the target database.
+        budget (CollectionBudget): The budget of the run.
+        collector_name (str): Name of the collector.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SET_TIMEOUTS_QUERY, budget.timeout_settings(collector_name))
+    finally:
+        cursor.close()
+
+
+def add_budget_arguments(parser):
+    """
+    Add the timeout and deadline options to a command line parser.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser.
+    """
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        metavar="SECONDS",
+        help="Stop starting collectors this many seconds after the run starts",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=int,
+        default=CONNECT_TIMEOUT,
+        help=f"Seconds to wait for a connection (default: {CONNECT_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--statement-timeout",
+        type=float,
+        default=STATEMENT_TIMEOUT,
+        help=f"Seconds a query may run, for collectors without their own timeout (default: {STATEMENT_TIMEOUT:g})",
+    )
+    parser.add_argument(
+        "--lock-timeout",
+        type=float,
+        default=LOCK_TIMEOUT,
+        help=f"Seconds a query may wait for a lock (default: {LOCK_TIMEOUT:g})",
+    )
+    parser.add_argument(
+        "--collector-timeout",
+        action="append",
+        default=[],
+        metavar="COLLECTOR=SECONDS",
+        help="Statement timeout of one collector, e.g. insert_database_grants=60. May be repeated.",
+    )
+
+
+def budget_from_args(args):
+    """
+    Build the budget of a run from the options added by add_budget_arguments.
+    The deadline starts counting now.
+
+    Args:
+        args (argparse.Namespace): The parsed options.
+
+    Returns:
+        CollectionBudget: The budget.
+
+    Raises:
+        ValueError: If a --collector-timeout is not COLLECTOR=SECONDS.
+    """
+    collector_timeouts = {}
+    for setting in args.collector_timeout:
+        name, separator, seconds = setting.partition("=")
+        if not separator:
+            raise ValueError(f"Expected COLLECTOR=SECONDS, got {setting}")
+        collector_timeouts[name] = float(seconds)
+
+    return CollectionBudget(
+        deadline=args.deadline,
+        statement_timeout=args.statement_timeout,
+        lock_timeout=args.lock_timeout,
+        collector_timeouts=collector_timeouts,
+        connect_timeout=args.connect_timeout,
+    )
@@ -0,0 +1,304 @@
+import argparse
+from dba_pool import get_dba_connection, release_dba_connection
+from send_mail import send_mail
+
+# Status of a run in dba.collection_runs
+RUN_RUNNING = "running"
+RUN_COMPLETED = "completed"
+RUN_FAILED = "failed"
+
+# Records that one collector finished on one database. Written in the same
+# transaction as the rows it collected, so both are committed or neither is.
+RECORD_PROGRESS_STATEMENT = """
+    INSERT INTO dba.collection_progress
+        (run_id, server_name, database_name, collector, row_count, completed_at)
+    VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (run_id, server_name, coalesce(database_name, ''), collector) DO NOTHING;
+    """
+
+# Every (server, database, collector) unit a run has completed
+COMPLETED_UNITS_QUERY = """
+    SELECT server_name, database_name, collector
+    FROM dba.collection_progress
+    WHERE run_id = %s;
+    """
+
+
+class CollectionRun:
+    """
+    One run of the collectors, as recorded in dba.collection_runs.
+    Each collector that finishes on a database adds a row to
+    dba.collection_progress. A resumed run keeps its run id and skips the
+    units that already have one. Every row the run collects is stamped with
+    the time it started, so the tables of one run join on last_updated.
+    """
+
+    def __init__(self, run_id, completed=(), started_at=None):
+        self.run_id = run_id
+        self.completed = set(completed)
+        self.started_at = started_at
+
+    def is_complete(self, target_server, database_name, collector_name):
+        """
+        Args:
+            target_server (str): Name of the target PostgreSQL server.
+            database_name (str): Name of the target database, or None for server collectors.
+            collector_name (str): Name of the collector.
+
+        Returns:
+            bool: True if an earlier attempt of this run already committed the unit.
+        """
+        return (target_server, database_name, collector_name) in self.completed
+
+    def record_progress(self, cursor_dba, target_server, database_name, collector_name, row_count):
+        """
+        Record a finished unit in the current DBA transaction. The caller commits it
+        together with the rows of the collector.
+
+        Args:
+            cursor_dba (cursor): An open cursor on the DBA database.
+            target_server (str): Name of the target PostgreSQL server.
+            database_name (str): Name of the target database, or None for server collectors.
+            collector_name (str): Name of the collector.
+            row_count (int): Number of rows collected, or None if unknown.
+        """
+        cursor_dba.execute(
+            RECORD_PROGRESS_STATEMENT,
+            (self.run_id, target_server, database_name, collector_name, row_count),
+        )
+
+
+def pending_collectors(run, target_server, database_name, collectors):
+    """
+    Get the collectors still to run on a database.
+
+    Args:
+        run (CollectionRun): The current run, or None to run everything.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collectors (list): (name, query, writer) entries.
+
+    Returns:
+        list: The collectors the run has not completed on the database.
+    """
+    if run is None:
+        return collectors
+
+    return [
+        collector
+        for collector in collectors
+        if not run.is_complete(target_server, database_name, collector[0])
+    ]
+
+
+def start_collection_run(dba_username, dba_password, resume_run_id=None):
+    """
+    Start a new run in dba.collection_runs, or resume an earlier one.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        resume_run_id (int, optional): Run to resume, skipping the units it completed. Defaults to None, a new run.
+
+    Returns:
+        CollectionRun: The run.
+
+    Raises:
+        ValueError: If the run to resume does not exist.
+        Exception: If the DBA database cannot be reached. Collection should not start without its ledger.
+    """
+    conn_dba = None
+    cursor_dba = None
+
+    try:
+        conn_dba = get_dba_connection(dba_username, dba_password)
+        cursor_dba = conn_dba.cursor()
+
+        if resume_run_id is None:
+            cursor_dba.execute(
+                """
+                INSERT INTO dba.collection_runs (status) VALUES (%s)
+                RETURNING run_id, started_at;
+                """,
+                (RUN_RUNNING,),
+            )
+            run_id, started_at = cursor_dba.fetchone()
+            run = CollectionRun(run_id, started_at=started_at)
+        else:
+            cursor_dba.execute(
+                """
+                UPDATE dba.collection_runs
+                SET status = %s, resumed_at = CURRENT_TIMESTAMP, finished_at = NULL
+                WHERE run_id = %s
+                RETURNING started_at;
+                """,
+                (RUN_RUNNING, resume_run_id),
+            )
+            resumed = cursor_dba.fetchone()
+            if resumed is None:
+                raise ValueError(f"Collection run {resume_run_id} does not exist")
+
+            # The rows collected now join those of the first attempt
+            cursor_dba.execute(COMPLETED_UNITS_QUERY, (resume_run_id,))
+            run = CollectionRun(resume_run_id, cursor_dba.fetchall(), resumed[0])
+
+        conn_dba.commit()
+        return run
+
+    except Exception:
+        if conn_dba is not None:
+            conn_dba.rollback()
+        raise
+
+    finally:
+        if cursor_dba is not None:
+            cursor_dba.close()
+        if conn_dba is not None:
+            release_dba_connection(conn_dba)
+
+
+def load_collection_run(dba_username, dba_password, run_id, target_server):
+    """
+    Load the units a run has completed on one server, for a worker picking up
+    that server, see collection_workers. Unlike start_collection_run, the run
+    itself is left as it is.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        run_id (int): The run.
+        target_server (str): Name of the target PostgreSQL server.
+
+    Returns:
+        CollectionRun: The run, with the units completed on the server.
+    """
+    conn_dba = get_dba_connection(dba_username, dba_password)
+    cursor_dba = conn_dba.cursor()
+
+    try:
+        cursor_dba.execute(
+            "SELECT started_at FROM dba.collection_runs WHERE run_id = %s;", (run_id,)
+        )
+        started_at = cursor_dba.fetchone()[0]
+        cursor_dba.execute(
+            """
+            SELECT server_name, database_name, collector
+            FROM dba.collection_progress
+            WHERE run_id = %s AND server_name = %s;
+            """,
+            (run_id, target_server),
+        )
+        run = CollectionRun(run_id, cursor_dba.fetchall(), started_at)
+        conn_dba.rollback()
+        return run
+    finally:
+        cursor_dba.close()
+        release_dba_connection(conn_dba)
+
+
+def finish_collection_run(dba_username, dba_password, run, succeeded):
+    """
+    Mark a run as finished in dba.collection_runs.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        run (CollectionRun): The run.
+        succeeded (bool): Whether every unit attempted this time completed.
+
+    Returns:
+        bool: True if the run was updated, False otherwise.
+    """
+    conn_dba = None
+    cursor_dba = None
+
+    try:
+        conn_dba = get_dba_connection(dba_username, dba_password)
+        cursor_dba = conn_dba.cursor()
+        cursor_dba.execute(
+            """
+            UPDATE dba.collection_runs
+            SET status = %s, finished_at = CURRENT_TIMESTAMP
+            WHERE run_id = %s;
+            """,
+            (RUN_COMPLETED if succeeded else RUN_FAILED, run.run_id),
+        )
+        conn_dba.commit()
+
+        return True
+
+    except Exception as e:
+        if conn_dba is not None:
+            conn_dba.rollback()
+
+        function_name = finish_collection_run.__name__
+        error_message = f"An error occurred in {function_name}. The error is  {e}"
+        error_subject = f"Failure: {function_name}"
+        error_recipients = "name@example.com"
+        print(error_message)
+        try:
+            send_mail(error_subject, error_message, error_recipients)
+        except Exception as e:
+            print(f"Failed to send email notification: {e}")
+
+        return False
+
+    finally:
+        if cursor_dba is not None:
+            cursor_dba.close()
+        if conn_dba is not None:
+            release_dba_connection(conn_dba)
+
+
+def print_collection_runs(dba_username, dba_password, limit=10):
+    """
+    Print the latest runs with the number of units each completed.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        limit (int, optional): Number of runs to print. Defaults to 10.
+    """
+    conn_dba = get_dba_connection(dba_username, dba_password)
+    cursor_dba = conn_dba.cursor()
+
+    try:
+        cursor_dba.execute(
+            """
+            SELECT r.run_id, r.status, r.started_at, r.resumed_at, r.finished_at,
+                   (SELECT count(*) FROM dba.collection_progress p WHERE p.run_id = r.run_id)
+            FROM dba.collection_runs r
+            ORDER BY r.run_id DESC
+            LIMIT %s;
+            """,
+            (limit,),
+        )
+        for run_id, status, started_at, resumed_at, finished_at, units in cursor_dba.fetchall():
+            resumed = f", resumed {resumed_at:%Y-%m-%d %H:%M}" if resumed_at is not None else ""
+            finished = f", finished {finished_at:%Y-%m-%d %H:%M}" if finished_at is not None else ""
+            print(
+                f"{run_id}: {status}, {units} units, "
+                f"started {started_at:%Y-%m-%d %H:%M}{resumed}{finished}"
+            )
+        conn_dba.rollback()
+    finally:
+        cursor_dba.close()
+        release_dba_connection(conn_dba)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List the latest collection runs, to find one to resume."
+    )
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=10,
+        help="Number of runs to list (default: 10)",
+    )
+
+    args = parser.parse_args()
+
+    print_collection_runs(args.dba_username, args.dba_password, args.limit)
@@ -0,0 +1,419 @@
+from dotenv import dotenv_values
+import argparse
+import random
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collection_budget import (
+    COLLECTOR_PRIORITIES,
+    CollectionBudget,
+    add_budget_arguments,
+    budget_from_args,
+)
+from collection_timings import TIMINGS_LOG, start_timings, write_collection_timings
+from collector_state import load_state, save_state
+from dba_pool import DBA_POOL_MIN_CONNECTIONS, close_dba_pools, init_dba_pool
+from dba_spool import Spool, start_spool_drainer
+from get_servers import cached_servers, get_servers
+from process_servers import process_server
+from send_mail import flush_notifications
+
+# Seconds between two collections of each collector on a server. Usage
+# counters and database sizes move all the time, users, index definitions
+# and grants hardly ever.
+COLLECTOR_INTERVALS = {
+    "insert_database_sizes": 900,
+    "insert_database_table_usage": 300,
+    "insert_database_index_usage": 300,
+    "insert_database_table_sizes": 3600,
+    "insert_database_users": 21600,
+    "insert_database_index_sizes": 21600,
+    "insert_database_grants": 86400,
+}
+
+# Each collection is moved by up to this fraction of its interval at random,
+# so collections that were due together drift apart
+SCHEDULE_JITTER = 0.1
+
+# Seconds a collector that has never run on a server, or is overdue, is
+# spread over when the scheduler starts
+STARTUP_SPREAD = 300
+
+# Seconds between two looks at what is due
+SCHEDULER_TICK = 5
+
+# Seconds before a failed collection is tried again, unless its interval is shorter
+RETRY_INTERVAL = 300
+
+# Seconds between two reads of the active servers from dba.servers
+SERVER_REFRESH_INTERVAL = 600
+
+# Seconds between two writes of the recorded spans to dba.collection_timings
+TIMINGS_WRITE_INTERVAL = 300
+
+# Name the last collection times are saved under in the collector state of each server
+SCHEDULE_STATE_NAME = "schedule"
+
+
+def spread_offset(target_server, collector_name, window):
+    """
+    Get a fixed offset for a collector on a server, spread evenly over a window.
+    The same server and collector always get the same offset, so a restarted
+    scheduler keeps the same spread.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        collector_name (str): Name of the collector.
+        window (float): Seconds to spread over.
+
+    Returns:
+        float: Seconds from the start of the window.
+    """
+    phase = zlib.crc32(f"{target_server}/{collector_name}".encode("utf-8")) / 2**32
+    return phase * window
+
+
+def jittered(interval, jitter=SCHEDULE_JITTER):
+    """
+    Args:
+        interval (float): Seconds between two collections.
+        jitter (float, optional): Fraction of the interval to move by at most. Defaults to SCHEDULE_JITTER.
+
+    Returns:
+        float: The interval, moved by a random amount.
+    """
+    return interval * (1 + random.uniform(-jitter, jitter))
+
+
+class CollectionScheduler:
+    """
+    Runs each collector on each active server at its own interval, in one
+    long running process. Every tick, the collectors that are due are
+    grouped by server and handed to a pool of workers, the most important
+    servers first, one job per server at a time. Servers that do not fit in
+    the free workers stay due for the next tick. The DBA connection pool,
+    the database inventories, the circuit breakers and the collector states
+    stay in memory between ticks. The last collection time of each collector
+    is saved in the collector state of its server, so a restart carries on
+    where the scheduler stopped.
+    """
+
+    def __init__(
+        self,
+        dba_username,
+        dba_password,
+        target_username,
+        target_password,
+        workers=1,
+        intervals=None,
+        budget_factory=CollectionBudget,
+        collect_options=None,
+        spool=None,
+    ):
+        self.dba_username = dba_username
+        self.dba_password = dba_password
+        self.target_username = target_username
+        self.target_password = target_password
+        self.workers = max(1, workers)
+        self.intervals = {**COLLECTOR_INTERVALS, **(intervals or {})}
+        self.budget_factory = budget_factory
+        self.collect_options = collect_options or {}
+        self.spool = spool
+        # Server to {collector name: monotonic time it is due}
+        self.due = {}
+        # Server to the future of its running job
+        self.running = {}
+        self.servers_read_at = None
+        self.timings_written_at = time.monotonic()
+        self.stop = threading.Event()
+
+    def refresh_servers(self):
+        """
+        Read the active servers again, scheduling new servers and dropping removed ones.
+        The servers already scheduled are kept if dba.servers cannot be read.
+        """
+        self.servers_read_at = time.monotonic()
+        servers = get_servers(self.dba_username, self.dba_password)
+        if not servers:
+            servers = list(self.due) or cached_servers()
+
+        for server in servers:
+            if server not in self.due:
+                self.due[server] = self.initial_due_times(server)
+        for server in set(self.due) - set(servers):
+            print(f"No longer collecting from {server}")
+            del self.due[server]
+
+    def initial_due_times(self, target_server):
+        """
+        Args:
+            target_server (str): Name of the target PostgreSQL server.
+
+        Returns:
+            dict: Collector name to the monotonic time it is first due on the server.
+        """
+        now = time.monotonic()
+        collected_at = (load_state(target_server, None, SCHEDULE_STATE_NAME) or {}).get(
+            "collected_at", {}
+        )
+
+        due = {}
+        for name, interval in self.intervals.items():
+            offset = spread_offset(target_server, name, min(interval, STARTUP_SPREAD))
+            if name in collected_at:
+                # Wall clock time of the last collection, from before a restart
+                next_due = now + collected_at[name] + interval - time.time()
+                due[name] = max(next_due, now + offset)
+            else:
+                due[name] = now + offset
+
+        return due
+
+    def due_jobs(self):
+        """
+        Returns:
+            list: (server, collector names) of the servers with collectors due and no job
+                  running, most important first.
+        """
+        now = time.monotonic()
+        jobs = []
+        for server, due in self.due.items():
+            if server in self.running:
+                continue
+            names = {name for name, due_at in due.items() if due_at <= now}
+            if names:
+                jobs.append((server, names))
+
+        return sorted(
+            jobs,
+            key=lambda job: (
+                min(COLLECTOR_PRIORITIES.get(name, 9) for name in job[1]),
+                min(self.due[job[0]][name] for name in job[1]),
+            ),
+        )
+
+    def submit_due(self, executor):
+        """
+        Start a job on each server with collectors due, as long as workers are free.
+
+        Args:
+            executor (ThreadPoolExecutor): The workers.
+        """
+        for server, names in self.due_jobs()[: self.workers - len(self.running)]:
+            self.running[server] = executor.submit(
+                process_server,
+                server,
+                self.target_username,
+                self.target_password,
+                self.dba_username,
+                self.dba_password,
+                spool=self.spool,
+                budget=self.budget_factory(),
+                collector_names=names,
+                **self.collect_options,
+            )
+
+    def finish_done(self):
+        """
+        Schedule the next collections of every job that has finished. A
+        collector that failed is tried again after RETRY_INTERVAL at the latest.
+        """
+        for server, future in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[server]
+
+            summary = future.result()
+            if server not in self.due:
+                continue
+
+            now = time.monotonic()
+            state = load_state(server, None, SCHEDULE_STATE_NAME) or {"collected_at": {}}
+            for name, succeeded in summary["collectors"].items():
+                interval = self.intervals[name]
+                if succeeded:
+                    self.due[server][name] = now + jittered(interval)
+                    state["collected_at"][name] = time.time()
+                else:
+                    self.due[server][name] = now + jittered(min(interval, RETRY_INTERVAL))
+            if summary["error"] is not None:
+                # Nothing ran, so try every collector that was due again
+                for name, due_at in self.due[server].items():
+                    if due_at <= now:
+                        self.due[server][name] = now + jittered(
+                            min(self.intervals[name], RETRY_INTERVAL)
+                        )
+
+            save_state(server, None, SCHEDULE_STATE_NAME, state)
+
+    def run(self):
+        """
+        Tick until stopped, then wait for the running jobs to finish.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self.stop.is_set():
+                self.finish_done()
+
+                now = time.monotonic()
+                if (
+                    self.servers_read_at is None
+                    or now - self.servers_read_at >= SERVER_REFRESH_INTERVAL
+                ):
+                    self.refresh_servers()
+                if now - self.timings_written_at >= TIMINGS_WRITE_INTERVAL:
+                    self.timings_written_at = now
+                    write_collection_timings(
+                        self.dba_username, self.dba_password, self.spool, clear=True
+                    )
+
+                self.submit_due(executor)
+                self.stop.wait(SCHEDULER_TICK)
+
+            print(f"Stopping, waiting for {len(self.running)} running servers")
+
+        self.finish_done()
+        write_collection_timings(self.dba_username, self.dba_password, self.spool, clear=True)
+
+
+def parse_intervals(settings):
+    """
+    Args:
+        settings (list): COLLECTOR=SECONDS strings.
+
+    Returns:
+        dict: Collector name to interval in seconds.
+
+    Raises:
+        ValueError: If a setting is not COLLECTOR=SECONDS for a known collector.
+    """
+    intervals = {}
+    for setting in settings:
+        name, separator, seconds = setting.partition("=")
+        if not separator:
+            raise ValueError(f"Expected COLLECTOR=SECONDS, got {setting}")
+        if name not in COLLECTOR_INTERVALS:
+            raise ValueError(f"Unknown collector {name}")
+        intervals[name] = float(seconds)
+
+    return intervals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Collect from the servers in the DBA database continuously, each collector at its own interval."
+    )
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of servers to collect from at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--interval",
+        action="append",
+        default=[],
+        metavar="COLLECTOR=SECONDS",
+        help="Interval of one collector, e.g. insert_database_grants=43200. May be repeated.",
+    )
+    parser.add_argument(
+        "--itersize",
+        type=int,
+        help="Stream large result sets, fetching this many rows per round trip",
+    )
+    parser.add_argument(
+        "--deltas",
+        action="store_true",
+        help="Also write table and index usage deltas since the previous collection",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="Only write grants, users and indexes that changed since the previous collection",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Read the next database of a server while the previous one is written",
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Copy table sizes and table and index usage from the targets with COPY, without parsing the rows",
+    )
+    parser.add_argument(
+        "--estimate-sizes",
+        type=int,
+        nargs="?",
+        const=0,
+        metavar="EXACT_TOP",
+        help="Estimate table sizes from relpages, measuring only the EXACT_TOP largest tables per database exactly (default: 0)",
+    )
+    parser.add_argument(
+        "--timings-log",
+        default=TIMINGS_LOG,
+        help=f"JSON lines file to append collection timings to (default: {TIMINGS_LOG})",
+    )
+    parser.add_argument(
+        "--spool",
+        action="store_true",
+        help="Write collected rows to a local spool, drained into the DBA database in the background",
+    )
+    add_budget_arguments(parser)
+
+    args = parser.parse_args()
+
+    # Load the .env file
+    env_values = dotenv_values(".env")
+
+    init_dba_pool(
+        args.dba_username,
+        args.dba_password,
+        minconn=0 if args.spool else DBA_POOL_MIN_CONNECTIONS,
+        maxconn=max(1, args.workers),
+    )
+    start_timings(args.timings_log)
+
+    collection_spool = None
+    if args.spool:
+        collection_spool = Spool()
+        drainer, stop_drainer = start_spool_drainer(
+            args.dba_username, args.dba_password, collection_spool
+        )
+
+    scheduler = CollectionScheduler(
+        args.dba_username,
+        args.dba_password,
+        env_values["DB_USERNAME"],
+        env_values["DB_PASSWORD"],
+        workers=args.workers,
+        intervals=parse_intervals(args.interval),
+        # Each job gets the timeouts, and the deadline counts from its start
+        budget_factory=lambda: budget_from_args(args),
+        collect_options={
+            "itersize": args.itersize,
+            "deltas": args.deltas,
+            "changes_only": args.changes_only,
+            "pipeline": args.pipeline,
+            "use_copy": args.copy,
+            "estimate_sizes": args.estimate_sizes,
+        },
+        spool=collection_spool,
+    )
+
+    # Stop after the running jobs on SIGTERM or Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop.set())
+
+    print(f"Scheduling {len(scheduler.intervals)} collectors with {scheduler.workers} workers")
+    scheduler.run()
+
+    if collection_spool is not None:
+        stop_drainer.set()
+        drainer.join()
+
+    close_dba_pools()
+    flush_notifications()
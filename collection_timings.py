@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from bulk_insert import bulk_insert
+from dba_spool import close_dba_connection, open_dba_connection
+from send_mail import send_mail
+
+# JSON lines file every timing span is appended to as soon as it finishes
+TIMINGS_LOG = os.environ.get("PGINFO_TIMINGS_LOG", "collection_timings.jsonl")
+
+# Phases timed for each span, in the order they happen
+TIMING_PHASES = ("connect", "query", "fetch", "write")
+
+# Columns of dba.collection_timings, in the order the values are written
+COLLECTION_TIMINGS_COLUMNS = (
+    "run_started",
+    "server_name",
+    "database_name",
+    "collector",
+    "started_at",
+    "connect_seconds",
+    "query_seconds",
+    "fetch_seconds",
+    "write_seconds",
+    "total_seconds",
+    "row_count",
+    "succeeded",
+)
+
+# Spans recorded in this run, shared by every worker thread
+_lock = threading.Lock()
+_run_started = None
+_log_path = TIMINGS_LOG
+_records = []
+
+
+class CollectionTimer:
+    """
+    Time the phases of one span of a collection: a collector on a database,
+    or opening a connection when the collector is None.
+    Phases may nest, for example fetching rows from a stream while the writer
+    consumes them. Time spent in a nested phase is only counted there, so the
+    phases of a span add up to its wall clock time.
+    """
+
+    def __init__(self, target_server, database_name, collector_name):
+        self.target_server = target_server
+        self.database_name = database_name
+        self.collector_name = collector_name
+        self.started_at = datetime.now(timezone.utc)
+        self.phases = {phase: 0.0 for phase in TIMING_PHASES}
+        self.row_count = None
+        self._start = time.perf_counter()
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a block of code as one of TIMING_PHASES.
+
+        Args:
+            name (str): The phase the block belongs to.
+        """
+        now = time.perf_counter()
+        if self._stack:
+            # Pause the enclosing phase
+            outer = self._stack[-1]
+            self.phases[outer[0]] += now - outer[1]
+        self._stack.append([name, now])
+
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            name, start = self._stack.pop()
+            self.phases[name] += now - start
+            if self._stack:
+                # Resume the enclosing phase
+                self._stack[-1][1] = now
+
+    def timed_rows(self, rows):
+        """
+        Yield rows from an iterator, timing each step as the fetch phase.
+
+        Args:
+            rows (iterable): The rows to time. May be a generator.
+
+        Yields:
+            tuple: Each row.
+        """
+        rows = iter(rows)
+        row_count = 0
+
+        while True:
+            with self.phase("fetch"):
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+            row_count += 1
+            yield row
+
+        self.row_count = row_count
+
+    def elapsed(self):
+        """
+        Returns:
+            float: Seconds since the span started.
+        """
+        return time.perf_counter() - self._start
+
+
+def timed_phase(timer, phase):
+    """
+    Time a block as a phase of a timer, if there is one.
+
+    Args:
+        timer (CollectionTimer): The timer of the span, or None.
+        phase (str): One of TIMING_PHASES.
+
+    Returns:
+        context manager: The phase of the timer, or a no-op.
+    """
+    return timer.phase(phase) if timer is not None else nullcontext()
+
+
+def start_timings(log_path=TIMINGS_LOG):
+    """
+    Start recording the timings of a new run.
+
+    Args:
+        log_path (str, optional): The JSON lines file to append spans to. Defaults to TIMINGS_LOG.
+    """
+    global _run_started, _log_path
+
+    with _lock:
+        _run_started = datetime.now(timezone.utc)
+        _log_path = log_path
+        _records.clear()
+
+
+def record_timer(timer, succeeded):
+    """
+    Record a finished span and append it to the JSON lines log.
+
+    Args:
+        timer (CollectionTimer): The timer of the span.
+        succeeded (bool): Whether the span completed without error.
+    """
+    global _run_started
+
+    record = {
+        "server_name": timer.target_server,
+        "database_name": timer.database_name,
+        "collector": timer.collector_name,
+        "started_at": timer.started_at.isoformat(),
+        **{f"{phase}_seconds": round(timer.phases[phase], 6) for phase in TIMING_PHASES},
+        "total_seconds": round(timer.elapsed(), 6),
+        "row_count": timer.row_count,
+        "succeeded": succeeded,
+    }
+
+    with _lock:
+        if _run_started is None:
+            _run_started = timer.started_at
+        record["run_started"] = _run_started.isoformat()
+        _records.append(record)
+
+        if _log_path:
+            try:
+                with open(_log_path, "a") as log_file:
+                    log_file.write(json.dumps(record) + "\n")
+            except OSError as e:
+                print(f"Failed to write timing log {_log_path}: {e}")
+
+
+def write_collection_timings(dba_username, dba_password, spool=None, clear=False):
+    """
+    Write the spans recorded in this run to dba.collection_timings.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        clear (bool, optional): Forget the spans once written, for processes that keep collecting. Defaults to False.
+
+    Returns:
+        bool: True if the spans were written, False otherwise.
+    """
+    with _lock:
+        records = list(_records)
+
+    # Initialize connection and cursor
+    conn_dba = None
+    cursor_dba = None
+
+    try:
+        conn_dba = open_dba_connection(dba_username, dba_password, spool)
+        cursor_dba = conn_dba.cursor()
+
+        bulk_insert(
+            cursor_dba,
+            "dba.collection_timings",
+            COLLECTION_TIMINGS_COLUMNS,
+            (
+                tuple(record[column] for column in COLLECTION_TIMINGS_COLUMNS)
+                for record in records
+            ),
+        )
+        conn_dba.commit()
+
+        if clear:
+            # Spans are only ever appended, so the written ones are still first
+            with _lock:
+                del _records[: len(records)]
+
+        return True
+
+    except Exception as e:
+        if conn_dba is not None:
+            conn_dba.rollback()
+
+        function_name = write_collection_timings.__name__
+        error_message = f"An error occurred in {function_name}. The error is  {e}"
+        error_subject = f"Failure: {function_name}"
+        error_recipients = "name@example.com"
+        print(error_message)
+        try:
+            send_mail(error_subject, error_message, error_recipients)
+        except Exception as e:
+            print(f"Failed to send email notification: {e}")
+
+        return False
+
+    finally:
+        if cursor_dba is not None:
+            cursor_dba.close()
+        if conn_dba is not None:
+            close_dba_connection(conn_dba)
+
+
+def print_timing_summary(top=10):
+    """
+    Print where the time of this run went: per phase, per collector, and the slowest spans.
+
+    Args:
+        top (int, optional): Number of slowest spans to list. Defaults to 10.
+    """
+    with _lock:
+        records = list(_records)
+
+    if not records:
+        return
+
+    print("Timings:")
+    phase_totals = ", ".join(
+        f"{phase} {sum(record[f'{phase}_seconds'] for record in records):.1f}s"
+        for phase in TIMING_PHASES
+    )
+    print(f"    All spans: {phase_totals}")
+
+    collectors = {}
+    for record in records:
+        name = record["collector"] or "(connect)"
+        collectors.setdefault(name, []).append(record["total_seconds"])
+    for name, totals in sorted(collectors.items(), key=lambda item: -sum(item[1])):
+        print(
+            f"    {name}: {sum(totals):.1f}s total, "
+            f"{max(totals):.1f}s slowest over {len(totals)} spans"
+        )
+
+    print(f"Slowest {min(top, len(records))} spans:")
+    for record in sorted(records, key=lambda r: -r["total_seconds"])[:top]:
+        location = record["server_name"]
+        if record["database_name"] is not None:
+            location = f"{location}/{record['database_name']}"
+        phases = ", ".join(
+            f"{phase} {record[f'{phase}_seconds']:.2f}s" for phase in TIMING_PHASES
+        )
+        print(
+            f"    {location} {record['collector'] or '(connect)'}: "
+            f"{record['total_seconds']:.2f}s ({phases})"
+        )
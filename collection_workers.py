@@ -0,0 +1,495 @@
+from dotenv import dotenv_values
+import argparse
+import os
+import socket
+import threading
+from collect_server import report_failure
+from collection_budget import CollectionBudget, add_budget_arguments, budget_from_args
+from collection_runs import (
+    CollectionRun,
+    finish_collection_run,
+    load_collection_run,
+    start_collection_run,
+)
+from collection_timings import TIMINGS_LOG, start_timings, write_collection_timings
+from dba_pool import close_dba_pools, get_dba_connection, init_dba_pool, release_dba_connection
+from process_servers import process_server
+from send_mail import flush_notifications
+
+# Seconds a claimed server stays leased without a heartbeat. A worker that
+# dies loses its servers to the other workers this long after its last
+# heartbeat. PGINFO_LEASE_SECONDS overrides it.
+LEASE_SECONDS = int(os.environ.get("PGINFO_LEASE_SECONDS", "120"))
+
+# Seconds between two heartbeats, each renewing the leases of the worker
+HEARTBEAT_INTERVAL = max(1, LEASE_SECONDS // 4)
+
+# Claims of one server in a run before it is given up on
+MAX_ATTEMPTS = 3
+
+# Seconds between two looks at the queue for a worker with nothing to do
+POLL_INTERVAL = 10
+
+# Status of a server in dba.collection_queue
+UNIT_PENDING = "pending"
+UNIT_LEASED = "leased"
+UNIT_DONE = "done"
+UNIT_FAILED = "failed"
+
+# Queues every active server for a run
+ENQUEUE_STATEMENT = """
+    INSERT INTO dba.collection_queue (run_id, server_name, status)
+    SELECT %s, server_name, 'pending'
+    FROM dba.servers
+    WHERE server_status = 1
+    ON CONFLICT (run_id, server_name) DO NOTHING;
+    """
+
+# Leases the next server that is pending, or whose lease has expired. Workers
+# skip the rows other workers are claiming instead of waiting for them.
+CLAIM_STATEMENT = """
+    UPDATE dba.collection_queue
+    SET status = 'leased',
+        worker_id = %s,
+        attempts = attempts + 1,
+        leased_until = clock_timestamp() + make_interval(secs => %s)
+    WHERE work_id = (
+        SELECT work_id
+        FROM dba.collection_queue
+        WHERE (status = 'pending' OR (status = 'leased' AND leased_until < clock_timestamp()))
+        AND   attempts < %s
+        AND   (%s::bigint IS NULL OR run_id = %s)
+        ORDER BY run_id, work_id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING work_id, run_id, server_name, attempts;
+    """
+
+# Gives up on abandoned servers that have been claimed MAX_ATTEMPTS times
+GIVE_UP_STATEMENT = """
+    UPDATE dba.collection_queue
+    SET status = 'failed', leased_until = NULL, finished_at = clock_timestamp()
+    WHERE status = 'leased'
+    AND   leased_until < clock_timestamp()
+    AND   attempts >= %s
+    RETURNING run_id, server_name;
+    """
+
+# Renews every lease a worker holds
+RENEW_STATEMENT = """
+    UPDATE dba.collection_queue
+    SET leased_until = clock_timestamp() + make_interval(secs => %s)
+    WHERE worker_id = %s AND status = 'leased';
+    """
+
+HEARTBEAT_STATEMENT = """
+    INSERT INTO dba.collection_workers (worker_id, started_at, heartbeat_at)
+    VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = EXCLUDED.heartbeat_at;
+    """
+
+# Ends the lease of a server. Nothing changes if another worker has taken it over.
+COMPLETE_STATEMENT = """
+    UPDATE dba.collection_queue
+    SET status = %s,
+        leased_until = NULL,
+        finished_at = CASE WHEN %s = 'pending' THEN NULL ELSE clock_timestamp() END
+    WHERE work_id = %s AND worker_id = %s AND status = 'leased'
+    RETURNING work_id;
+    """
+
+# Servers of a run still to collect, and servers given up on
+RUN_STATUS_QUERY = """
+    SELECT count(*) FILTER (WHERE status IN ('pending', 'leased')),
+           count(*) FILTER (WHERE status = 'failed')
+    FROM dba.collection_queue
+    WHERE run_id = %s;
+    """
+
+
+def execute_dba(dba_username, dba_password, statement, params):
+    """
+    Run one statement on the DBA database in its own transaction.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        statement (str): The statement.
+        params (tuple): Its parameters.
+
+    Returns:
+        list: The rows it returned, or an empty list.
+    """
+    conn_dba = get_dba_connection(dba_username, dba_password)
+    cursor_dba = conn_dba.cursor()
+
+    try:
+        cursor_dba.execute(statement, params)
+        rows = cursor_dba.fetchall() if cursor_dba.description is not None else []
+        conn_dba.commit()
+        return rows
+    except Exception:
+        conn_dba.rollback()
+        raise
+    finally:
+        cursor_dba.close()
+        release_dba_connection(conn_dba)
+
+
+def enqueue_collection_pass(dba_username, dba_password):
+    """
+    Start a run and queue every active server for the workers.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+
+    Returns:
+        CollectionRun: The new run.
+    """
+    run = start_collection_run(dba_username, dba_password)
+    execute_dba(dba_username, dba_password, ENQUEUE_STATEMENT, (run.run_id,))
+
+    return run
+
+
+class CollectionWorker:
+    """
+    One worker process of a distributed collection. Its threads lease
+    servers from dba.collection_queue one at a time and collect them with
+    process_server. A heartbeat thread keeps the leases of the worker alive
+    and records it in dba.collection_workers. If a worker dies, its leases
+    expire and other workers take its servers over. The run ledger makes
+    them skip the collectors the dead worker had already committed.
+    Each claim gets a budget from budget_factory, and no server is claimed
+    once that budget has expired.
+    """
+
+    def __init__(
+        self,
+        dba_username,
+        dba_password,
+        target_username,
+        target_password,
+        lease_seconds=LEASE_SECONDS,
+        budget_factory=CollectionBudget,
+        collect_options=None,
+    ):
+        self.dba_username = dba_username
+        self.dba_password = dba_password
+        self.target_username = target_username
+        self.target_password = target_password
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.budget_factory = budget_factory
+        self.collect_options = collect_options or {}
+        self.stop = threading.Event()
+
+    def heartbeat(self):
+        """
+        Record that the worker is alive and renew its leases.
+        """
+        execute_dba(self.dba_username, self.dba_password, HEARTBEAT_STATEMENT, (self.worker_id,))
+        execute_dba(
+            self.dba_username,
+            self.dba_password,
+            RENEW_STATEMENT,
+            (self.lease_seconds, self.worker_id),
+        )
+
+    def beat(self):
+        """
+        Heartbeat thread. Beat every HEARTBEAT_INTERVAL seconds until stopped.
+        """
+        while not self.stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"Heartbeat of {self.worker_id} failed. The error is  {e}")
+
+    def claim(self, run_id=None):
+        """
+        Lease the next server to collect, giving up on abandoned servers first.
+
+        Args:
+            run_id (int, optional): Only claim servers of this run. Defaults to None, any run.
+
+        Returns:
+            tuple: (work id, run id, server name, attempts), or None if nothing is left.
+        """
+        for given_up_run_id, server in execute_dba(
+            self.dba_username, self.dba_password, GIVE_UP_STATEMENT, (MAX_ATTEMPTS,)
+        ):
+            report_failure(
+                CollectionWorker.claim.__name__,
+                server,
+                None,
+                Exception(
+                    f"Gave up on the server in run {given_up_run_id} after {MAX_ATTEMPTS} attempts"
+                ),
+            )
+            self.finish_run_if_done(given_up_run_id)
+
+        rows = execute_dba(
+            self.dba_username,
+            self.dba_password,
+            CLAIM_STATEMENT,
+            (self.worker_id, self.lease_seconds, MAX_ATTEMPTS, run_id, run_id),
+        )
+        return rows[0] if rows else None
+
+    def complete(self, work_id, run_id, summary, attempts):
+        """
+        End the lease of a server. A server with failed collectors goes back
+        to the queue until it has been tried MAX_ATTEMPTS times.
+
+        Args:
+            work_id (int): The queue row of the server.
+            run_id (int): The run.
+            summary (dict): The summary returned by process_server.
+            attempts (int): Times the server has been claimed in the run.
+        """
+        succeeded = summary["error"] is None and all(summary["collectors"].values())
+        if succeeded:
+            status = UNIT_DONE
+        elif attempts < MAX_ATTEMPTS:
+            status = UNIT_PENDING
+        else:
+            status = UNIT_FAILED
+
+        if not execute_dba(
+            self.dba_username,
+            self.dba_password,
+            COMPLETE_STATEMENT,
+            (status, status, work_id, self.worker_id),
+        ):
+            print(f"    Lease on {summary['server']} was lost to another worker")
+            return
+
+        execute_dba(
+            self.dba_username,
+            self.dba_password,
+            "UPDATE dba.collection_workers SET units_done = units_done + 1 WHERE worker_id = %s;",
+            (self.worker_id,),
+        )
+        if status != UNIT_PENDING:
+            self.finish_run_if_done(run_id)
+
+    def finish_run_if_done(self, run_id):
+        """
+        Mark a run finished once no server of it is left to collect.
+
+        Args:
+            run_id (int): The run.
+        """
+        open_count, failed_count = execute_dba(
+            self.dba_username, self.dba_password, RUN_STATUS_QUERY, (run_id,)
+        )[0]
+        if open_count == 0:
+            finish_collection_run(
+                self.dba_username,
+                self.dba_password,
+                CollectionRun(run_id),
+                failed_count == 0,
+            )
+            print(f"Collection run {run_id} finished, {failed_count} servers failed")
+
+    def work_loop(self, run_id, wait):
+        """
+        Worker thread. Claim and collect servers until none are left, or until stopped with wait,
+        or until the budget of the next claim has expired.
+
+        Args:
+            run_id (int): Only claim servers of this run, or None for any run.
+            wait (bool): Keep polling for new servers instead of stopping when none are left.
+        """
+        while not self.stop.is_set():
+            budget = self.budget_factory()
+            if budget.expired():
+                # The servers left are claimed by other workers or a later run
+                print(f"Worker {self.worker_id} reached its deadline, claiming no more servers")
+                return
+
+            try:
+                unit = self.claim(run_id)
+            except Exception as e:
+                print(f"Failed to claim a server. The error is  {e}")
+                unit = None
+
+            if unit is None:
+                if not wait:
+                    return
+                self.stop.wait(POLL_INTERVAL)
+                continue
+
+            work_id, unit_run_id, server, attempts = unit
+            if attempts > 1:
+                print(f"Claimed {server} in run {unit_run_id} again, attempt {attempts}")
+
+            try:
+                run = load_collection_run(
+                    self.dba_username, self.dba_password, unit_run_id, server
+                )
+                summary = process_server(
+                    server,
+                    self.target_username,
+                    self.target_password,
+                    self.dba_username,
+                    self.dba_password,
+                    run=run,
+                    budget=budget,
+                    **self.collect_options,
+                )
+                self.complete(work_id, unit_run_id, summary, attempts)
+            except Exception as e:
+                # The lease expires and the server is claimed again
+                print(f"Failed to collect {server} in run {unit_run_id}. The error is  {e}")
+
+    def work(self, run_id=None, threads=1, wait=False):
+        """
+        Collect servers on a number of threads, with a heartbeat.
+
+        Args:
+            run_id (int, optional): Only claim servers of this run. Defaults to None, any run.
+            threads (int, optional): Servers to collect at the same time. Defaults to 1.
+            wait (bool, optional): Keep polling for new servers until stopped. Defaults to False.
+        """
+        self.heartbeat()
+        beater = threading.Thread(target=self.beat, name="pginfo-heartbeat", daemon=True)
+        beater.start()
+
+        workers = [
+            threading.Thread(
+                target=self.work_loop,
+                args=(run_id, wait),
+                name=f"pginfo-worker-{number}",
+                daemon=True,
+            )
+            for number in range(max(1, threads))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.stop.set()
+        beater.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Collect servers leased from the queue in the DBA database, alongside workers on other hosts."
+    )
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Start a new run, queue every active server for it, and work on it",
+    )
+    parser.add_argument(
+        "--run",
+        type=int,
+        metavar="RUN_ID",
+        help="Only work on servers of this run",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Servers this worker collects at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Keep polling for queued servers instead of stopping when none are left",
+    )
+    parser.add_argument(
+        "--itersize",
+        type=int,
+        help="Stream large result sets, fetching this many rows per round trip",
+    )
+    parser.add_argument(
+        "--deltas",
+        action="store_true",
+        help="Also write table and index usage deltas since the previous run",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="Only write grants, users and indexes that changed since the previous run",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Read the next database of a server while the previous one is written",
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Copy table sizes and table and index usage from the targets with COPY, without parsing the rows",
+    )
+    parser.add_argument(
+        "--estimate-sizes",
+        type=int,
+        nargs="?",
+        const=0,
+        metavar="EXACT_TOP",
+        help="Estimate table sizes from relpages, measuring only the EXACT_TOP largest tables per database exactly (default: 0)",
+    )
+    parser.add_argument(
+        "--timings-log",
+        default=TIMINGS_LOG,
+        help=f"JSON lines file to append collection timings to (default: {TIMINGS_LOG})",
+    )
+    add_budget_arguments(parser)
+
+    args = parser.parse_args()
+
+    # Load the .env file
+    env_values = dotenv_values(".env")
+
+    # One connection per thread, and one for the heartbeat
+    init_dba_pool(args.dba_username, args.dba_password, maxconn=max(1, args.threads) + 1)
+    start_timings(args.timings_log)
+
+    work_run_id = args.run
+    if args.enqueue:
+        work_run_id = enqueue_collection_pass(args.dba_username, args.dba_password).run_id
+        print(f"Queued collection run {work_run_id}")
+
+    # The deadline counts from the start of the worker, shared by every server
+    # it collects. A worker that waits for new servers runs indefinitely, so
+    # there each server gets the deadline from its claim instead.
+    if args.wait:
+        budget_factory = lambda: budget_from_args(args)
+    else:
+        worker_budget = budget_from_args(args)
+        budget_factory = lambda: worker_budget
+
+    worker = CollectionWorker(
+        args.dba_username,
+        args.dba_password,
+        env_values["DB_USERNAME"],
+        env_values["DB_PASSWORD"],
+        budget_factory=budget_factory,
+        collect_options={
+            "itersize": args.itersize,
+            "deltas": args.deltas,
+            "changes_only": args.changes_only,
+            "pipeline": args.pipeline,
+            "use_copy": args.copy,
+            "estimate_sizes": args.estimate_sizes,
+        },
+    )
+    print(f"Worker {worker.worker_id} with {args.threads} threads")
+    try:
+        worker.work(work_run_id, args.threads, args.wait)
+    except KeyboardInterrupt:
+        # Leases left behind expire and are taken over by the other workers
+        worker.stop.set()
+
+    write_collection_timings(args.dba_username, args.dba_password, clear=True)
+    close_dba_pools()
+    flush_notifications()
@@ -0,0 +1,66 @@
+import json
+import os
+from urllib.parse import quote
+
+# Directory holding what each collector remembers between runs
+STATE_DIR = os.environ.get("PGINFO_STATE_DIR", "state")
+
+
+def state_path(target_server, database_name, collector_name):
+    """
+    Get the path of the state file for one collector on one database.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector_name (str): Name of the collector.
+
+    Returns:
+        str: The path of the state file.
+    """
+    return os.path.join(
+        STATE_DIR,
+        quote(target_server, safe=""),
+        quote(database_name or "", safe=""),
+        f"{collector_name}.json",
+    )
+
+
+def load_state(target_server, database_name, collector_name):
+    """
+    Load the state saved by the previous run of a collector.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector_name (str): Name of the collector.
+
+    Returns:
+        dict: The saved state, or None if there is none.
+    """
+    path = state_path(target_server, database_name, collector_name)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as state_file:
+        return json.load(state_file)
+
+
+def save_state(target_server, database_name, collector_name, state):
+    """
+    Save the state of a collector for the next run.
+    The file is replaced atomically so a crash never leaves half a state.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database, or None for server collectors.
+        collector_name (str): Name of the collector.
+        state (dict): The state to save. Must be JSON serializable.
+    """
+    path = state_path(target_server, database_name, collector_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as state_file:
+        json.dump(state, state_file)
+    os.replace(temporary_path, path)
@@ -0,0 +1,109 @@
+import tempfile
+import psycopg2
+from psycopg2 import sql
+from bulk_insert import get_current_timestamp
+from collection_timings import timed_phase
+from insert_database_index_usage import INDEX_USAGE_COLUMNS
+from insert_database_table_sizes import TABLES_COLUMNS
+from insert_database_table_usage import TABLE_USAGE_COLUMNS
+
+# Collectors whose query columns map one to one onto their DBA table, between
+# the server name and last_updated, so the rows can be copied as they are
+COPY_TRANSFER_COLLECTORS = {
+    "insert_database_table_sizes": ("dba.tables", TABLES_COLUMNS),
+    "insert_database_table_usage": ("dba.table_usage", TABLE_USAGE_COLUMNS),
+    "insert_database_index_usage": ("dba.index_usage", INDEX_USAGE_COLUMNS),
+}
+
+# Bytes of COPY data held in memory before the rest goes to a temporary file
+COPY_TRANSFER_MEMORY_BYTES = 8 * 1024 * 1024
+
+# Bytes read at a time when counting the rows of the COPY data
+COPY_TRANSFER_CHUNK_BYTES = 1024 * 1024
+
+# Undoes a COPY into the DBA table that failed, keeping the rest of the transaction
+COPY_IN_SAVEPOINT_QUERY = "SAVEPOINT copy_transfer"
+COPY_IN_ROLLBACK_QUERY = "ROLLBACK TO SAVEPOINT copy_transfer"
+COPY_IN_RELEASE_QUERY = "RELEASE SAVEPOINT copy_transfer"
+
+# Wraps a collector query so the target adds the server name and last_updated
+COPY_OUT_STATEMENT = sql.SQL(
+    "COPY (SELECT {target_server}::text, collected.*, {last_updated}::text "
+    "FROM ({query}) AS collected) TO STDOUT"
+)
+
+
+def copy_transfer(
+    conn, cursor_dba, target_server, query, table, columns, timer=None, last_updated=None
+):
+    """
+    Copy the rows of a collector query from a target database into a DBA table.
+    The target runs the query as COPY ... TO STDOUT and the bytes it sends are
+    loaded unchanged with COPY ... FROM STDIN, so the rows are never parsed
+    into Python values. Like the writers, every row is stamped with the time
+    given, or else the time of the DBA transaction. Only the first
+    COPY_TRANSFER_MEMORY_BYTES of the data are held in memory, the rest
+    goes to a temporary file. A failed COPY into the DBA table is rolled back
+    to a savepoint, so the caller can write the rows another way in the same
+    transaction.
+
+    Args:
+        conn (connection): An open connection to the target database.
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        query (str): The collector query. Its columns must match columns, without the first and last.
+        table (str): Name of the DBA table, e.g. 'dba.tables'.
+        columns (tuple): Column names of the DBA table, server name first and last_updated last.
+        timer (CollectionTimer, optional): Times the query and write phases. Defaults to None.
+        last_updated (datetime, optional): Time to stamp the rows with, such as the start of the run. Defaults to None.
+
+    Returns:
+        int: The number of rows copied.
+
+    Raises:
+        psycopg2.Error: If either COPY failed. The target transaction may be aborted.
+    """
+    if last_updated is None:
+        last_updated = get_current_timestamp(cursor_dba)
+
+    copy_out = COPY_OUT_STATEMENT.format(
+        target_server=sql.Literal(target_server),
+        last_updated=sql.Literal(last_updated.isoformat()),
+        query=sql.SQL(query.strip().rstrip(";")),
+    )
+
+    # The target sends the rows in its client encoding, so tell DBA001 which one
+    encoding = conn.get_parameter_status("client_encoding")
+    copy_in = sql.SQL("COPY {table} ({columns}) FROM STDIN WITH (ENCODING {encoding})").format(
+        table=sql.SQL(table),
+        columns=sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        encoding=sql.Literal(encoding),
+    )
+
+    with tempfile.SpooledTemporaryFile(max_size=COPY_TRANSFER_MEMORY_BYTES) as buffer:
+        cursor = conn.cursor()
+        try:
+            with timed_phase(timer, "query"):
+                cursor.copy_expert(copy_out, buffer)
+        finally:
+            cursor.close()
+
+        # Newlines inside values are escaped, so there is one per row
+        row_count = 0
+        buffer.seek(0)
+        for chunk in iter(lambda: buffer.read(COPY_TRANSFER_CHUNK_BYTES), b""):
+            row_count += chunk.count(b"\n")
+        buffer.seek(0)
+
+        # Rendered on the target connection, as cursor_dba may be a spool cursor
+        with timed_phase(timer, "write"):
+            cursor_dba.execute(COPY_IN_SAVEPOINT_QUERY)
+            try:
+                cursor_dba.copy_expert(copy_in.as_string(conn), buffer)
+            except psycopg2.Error:
+                cursor_dba.execute(COPY_IN_ROLLBACK_QUERY)
+                cursor_dba.execute(COPY_IN_RELEASE_QUERY)
+                raise
+            cursor_dba.execute(COPY_IN_RELEASE_QUERY)
+
+    return row_count
@@ -0,0 +1,218 @@
+import argparse
+import os
+import threading
+import time
+import psycopg2
+from circuit_breaker import connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
+from collector_state import load_state, save_state
+
+# Seconds a server's database list is trusted before pg_database is read again
+INVENTORY_TTL = int(os.environ.get("PGINFO_INVENTORY_TTL", "3600"))
+
+# Name the inventory is saved under in the collector state of each server
+INVENTORY_STATE_NAME = "database_inventory"
+
+# Non template databases, and whether they accept connections
+DATABASE_INVENTORY_QUERY = """
+    SELECT datname, datallowconn
+    FROM pg_database
+    WHERE datistemplate = false
+    ORDER BY datname;
+    """
+
+# Inventories read in this process, shared by every collector and worker
+_lock = threading.Lock()
+_inventories = {}
+
+
+def _load_inventory(target_server):
+    """
+    Get the inventory of a server from memory, or from the previous run.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+
+    Returns:
+        dict: The inventory, or None if there is none.
+    """
+    with _lock:
+        inventory = _inventories.get(target_server)
+    if inventory is not None:
+        return inventory
+
+    inventory = load_state(target_server, None, INVENTORY_STATE_NAME)
+    if inventory is not None:
+        with _lock:
+            _inventories.setdefault(target_server, inventory)
+    return inventory
+
+
+def connectable_databases(inventory):
+    """
+    Args:
+        inventory (dict): An inventory as saved by update_database_inventory.
+
+    Returns:
+        list: The names of the databases that accept connections.
+    """
+    return [name for name, allow_connections in inventory["databases"].items() if allow_connections]
+
+
+def cached_databases(target_server, ttl=INVENTORY_TTL):
+    """
+    Get the connectable databases of a server without touching the server,
+    if the inventory was refreshed within the last ttl seconds.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        ttl (int, optional): Maximum age of the inventory in seconds. Defaults to INVENTORY_TTL.
+
+    Returns:
+        list: The names of the connectable databases, or None if the inventory is missing or stale.
+    """
+    inventory = _load_inventory(target_server)
+    if inventory is None or time.time() - inventory["refreshed_at"] >= ttl:
+        return None
+
+    return connectable_databases(inventory)
+
+
+def update_database_inventory(target_server, rows):
+    """
+    Replace the inventory of a server with freshly read rows and save it.
+    Databases that were added, dropped or do not accept connections are printed.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        rows (list): The rows returned by DATABASE_INVENTORY_QUERY.
+
+    Returns:
+        list: The names of the connectable databases.
+    """
+    previous = _load_inventory(target_server)
+    inventory = {
+        "refreshed_at": time.time(),
+        "databases": {name: allow_connections for name, allow_connections in rows},
+    }
+
+    if previous is not None:
+        added = sorted(set(inventory["databases"]) - set(previous["databases"]))
+        dropped = sorted(set(previous["databases"]) - set(inventory["databases"]))
+        if added:
+            print(f"    New databases on {target_server}: {', '.join(added)}")
+        if dropped:
+            print(f"    Dropped databases on {target_server}: {', '.join(dropped)}")
+
+    skipped = [name for name, allow_connections in rows if not allow_connections]
+    if skipped:
+        print(f"    Skipping databases that do not allow connections on {target_server}: {', '.join(skipped)}")
+
+    save_state(target_server, None, INVENTORY_STATE_NAME, inventory)
+    with _lock:
+        _inventories[target_server] = inventory
+
+    return connectable_databases(inventory)
+
+
+def invalidate_database_inventory(target_server):
+    """
+    Mark the inventory of a server as stale, so the next lookup reads
+    pg_database again. The old list is kept to report additions and drops.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+    """
+    inventory = _load_inventory(target_server)
+    if inventory is None:
+        return
+
+    inventory = {**inventory, "refreshed_at": 0}
+    save_state(target_server, None, INVENTORY_STATE_NAME, inventory)
+    with _lock:
+        _inventories[target_server] = inventory
+
+
+def get_database_inventory(
+    target_server,
+    target_username,
+    target_password,
+    conn=None,
+    maintenance_db="postgres",
+    ttl=INVENTORY_TTL,
+):
+    """
+    Get the databases to collect from a server.
+    The list is cached in memory and in the collector state, and pg_database is
+    only read again once it is older than ttl seconds. Databases that do not
+    allow connections are left out.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        target_username (str): Username for the target PostgreSQL server.
+        target_password (str): Password for the target PostgreSQL server.
+        conn (connection, optional): An open connection to the server to read pg_database on. Defaults to None, connect to maintenance_db.
+        maintenance_db (str, optional): Database to connect to when conn is None. Defaults to 'postgres'.
+        ttl (int, optional): Maximum age of the cached inventory in seconds. Defaults to INVENTORY_TTL.
+
+    Returns:
+        list: The names of the connectable databases.
+
+    Raises:
+        Exception: If the inventory is stale and pg_database cannot be read.
+    """
+    databases = cached_databases(target_server, ttl)
+    if databases is not None:
+        return databases
+
+    own_conn = None
+    cursor = None
+
+    try:
+        if conn is None:
+            own_conn = connect_with_retry(
+                target_server,
+                lambda: psycopg2.connect(
+                    host=target_server,
+                    user=target_username,
+                    password=target_password,
+                    dbname=maintenance_db,
+                    connect_timeout=CONNECT_TIMEOUT,
+                    options=timeout_options(),
+                ),
+            )
+            conn = own_conn
+
+        cursor = conn.cursor()
+        cursor.execute(DATABASE_INVENTORY_QUERY)
+        rows = cursor.fetchall()
+
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if own_conn is not None:
+            own_conn.close()
+
+    return update_database_inventory(target_server, rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the cached list of databases for a PostgreSQL server."
+    )
+    parser.add_argument("server_name", help="Name of the PostgreSQL server")
+    parser.add_argument("username", help="Username for the PostgreSQL server")
+    parser.add_argument("password", help="Password for the PostgreSQL server")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Read pg_database again, whatever the age of the cached list",
+    )
+
+    args = parser.parse_args()
+
+    if args.refresh:
+        invalidate_database_inventory(args.server_name)
+
+    for database in get_database_inventory(args.server_name, args.username, args.password):
+        print(database)
@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import pool
+from collection_budget import CONNECT_TIMEOUT
+
+# Location of the DBA repository. PGINFO_DBA_HOST overrides the host, e.g. for testing.
+DBA_HOST = os.environ.get("PGINFO_DBA_HOST", "DBA001")
+DBA_DATABASE = "dbaadmin"
+
+# Default pool size when a pool is created on first use
+DBA_POOL_MIN_CONNECTIONS = 1
+DBA_POOL_MAX_CONNECTIONS = 10
+
+# Connections idle longer than this are checked with a round trip before reuse
+DBA_POOL_CHECK_INTERVAL = 30
+
+# Connections tried when borrowing before giving up, e.g. after a DBA restart
+# left every pooled connection broken
+DBA_POOL_BORROW_ATTEMPTS = 3
+
+# One pool per set of DBA credentials, and the pool each borrowed connection came from
+_pools = {}
+_borrowed = {}
+_pools_lock = threading.Lock()
+
+
+class DBAPool:
+    """
+    A thread safe pool of connections to the DBA database.
+    Borrowing blocks while every connection is in use, so the pool size is a
+    hard cap on the number of connections opened against DBA001.
+    """
+
+    def __init__(self, dba_username, dba_password, minconn, maxconn):
+        self.pool = pool.ThreadedConnectionPool(
+            minconn,
+            maxconn,
+            host=DBA_HOST,
+            user=dba_username,
+            password=dba_password,
+            dbname=DBA_DATABASE,
+            connect_timeout=CONNECT_TIMEOUT,
+        )
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.last_used = {}
+
+    def getconn(self):
+        """
+        Borrow a healthy connection, replacing any that have gone bad.
+        Broken connections are closed and the next one is checked, until one
+        passes or DBA_POOL_BORROW_ATTEMPTS connections have been tried.
+
+        Returns:
+            connection: An open psycopg2 connection to the DBA database.
+
+        Raises:
+            psycopg2.OperationalError: If no healthy connection could be borrowed.
+        """
+        self.slots.acquire()
+        try:
+            for _ in range(DBA_POOL_BORROW_ATTEMPTS):
+                conn = self.pool.getconn()
+                if self.is_healthy(conn):
+                    return conn
+                # Drop the broken connection and let the pool open a new one
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+
+            raise psycopg2.OperationalError(
+                f"No healthy connection to {DBA_HOST} after {DBA_POOL_BORROW_ATTEMPTS} attempts"
+            )
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn):
+        """
+        Return a connection to the pool, rolling back any open transaction.
+
+        Args:
+            conn (connection): A connection borrowed with getconn.
+        """
+        try:
+            close = bool(conn.closed)
+            if not close:
+                try:
+                    if (
+                        conn.get_transaction_status()
+                        != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                    ):
+                        conn.rollback()
+                except Exception:
+                    close = True
+            if close:
+                self.last_used.pop(id(conn), None)
+            else:
+                self.last_used[id(conn)] = time.monotonic()
+            self.pool.putconn(conn, close=close)
+        finally:
+            self.slots.release()
+
+    def is_healthy(self, conn):
+        """
+        Check that a connection is still usable. Any message the server sent
+        while the connection was idle is read first, so a connection the
+        server closed, e.g. on a restart, fails the check however recently it
+        was used. Connections idle longer than DBA_POOL_CHECK_INTERVAL also
+        get a round trip, for connections dropped without notice.
+
+        Args:
+            conn (connection): A connection taken from the pool.
+
+        Returns:
+            bool: True if the connection can be used, False otherwise.
+        """
+        if conn.closed:
+            return False
+
+        try:
+            conn.poll()
+        except psycopg2.Error:
+            return False
+
+        last_used = self.last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < DBA_POOL_CHECK_INTERVAL:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def closeall(self):
+        """
+        Close every connection in the pool.
+        """
+        self.pool.closeall()
+
+
+def init_dba_pool(
+    dba_username,
+    dba_password,
+    minconn=DBA_POOL_MIN_CONNECTIONS,
+    maxconn=DBA_POOL_MAX_CONNECTIONS,
+):
+    """
+    Create the connection pool for a set of DBA credentials, replacing any existing pool.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        minconn (int, optional): Connections opened up front. Defaults to DBA_POOL_MIN_CONNECTIONS.
+        maxconn (int, optional): Maximum open connections. Defaults to DBA_POOL_MAX_CONNECTIONS.
+
+    Returns:
+        DBAPool: The new pool.
+    """
+    with _pools_lock:
+        old_pool = _pools.pop((dba_username, dba_password), None)
+        if old_pool is not None:
+            old_pool.closeall()
+
+        dba_pool = DBAPool(dba_username, dba_password, minconn, maxconn)
+        _pools[(dba_username, dba_password)] = dba_pool
+
+    return dba_pool
+
+
+def get_dba_connection(dba_username, dba_password):
+    """
+    Borrow a connection to the DBA database from the shared pool.
+    The pool is created with default settings on first use.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+
+    Returns:
+        connection: An open psycopg2 connection to the DBA database.
+    """
+    with _pools_lock:
+        dba_pool = _pools.get((dba_username, dba_password))
+        if dba_pool is None:
+            dba_pool = DBAPool(
+                dba_username,
+                dba_password,
+                DBA_POOL_MIN_CONNECTIONS,
+                DBA_POOL_MAX_CONNECTIONS,
+            )
+            _pools[(dba_username, dba_password)] = dba_pool
+
+    conn = dba_pool.getconn()
+    with _pools_lock:
+        _borrowed[id(conn)] = dba_pool
+
+    return conn
+
+
+def release_dba_connection(conn):
+    """
+    Return a connection borrowed with get_dba_connection to its pool.
+
+    Args:
+        conn (connection): The connection to return.
+    """
+    with _pools_lock:
+        dba_pool = _borrowed.pop(id(conn))
+
+    dba_pool.putconn(conn)
+
+
+def close_dba_pools():
+    """
+    Close every pooled connection to the DBA database.
+    """
+    with _pools_lock:
+        for dba_pool in _pools.values():
+            dba_pool.closeall()
+        _pools.clear()
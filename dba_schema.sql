@@ -0,0 +1,153 @@
+-- Tables in the dbaadmin database that pginfo writes to, beyond the
+-- original dba.databases, dba.tables, dba.table_usage, dba.indexes,
+-- dba.index_usage, dba.grants, dba.users and dba.servers tables.
+
+-- Per-interval changes in dba.table_usage counters, written with --deltas
+CREATE TABLE IF NOT EXISTS dba.table_usage_deltas (
+    server_name text NOT NULL,
+    database_name text NOT NULL,
+    schema_name text NOT NULL,
+    table_name text NOT NULL,
+    interval_start timestamptz NOT NULL,
+    interval_end timestamptz NOT NULL,
+    interval_seconds double precision NOT NULL,
+    sequential_scans bigint,
+    sequential_tuple_scans bigint,
+    index_scans bigint,
+    index_tuple_fetches bigint,
+    sequential_scans_per_second double precision,
+    sequential_tuple_scans_per_second double precision,
+    index_scans_per_second double precision,
+    index_tuple_fetches_per_second double precision,
+    counters_reset boolean NOT NULL
+);
+
+-- Per-interval changes in dba.index_usage counters, written with --deltas
+CREATE TABLE IF NOT EXISTS dba.index_usage_deltas (
+    server_name text NOT NULL,
+    database_name text NOT NULL,
+    schema_name text NOT NULL,
+    table_name text NOT NULL,
+    index_name text NOT NULL,
+    interval_start timestamptz NOT NULL,
+    interval_end timestamptz NOT NULL,
+    interval_seconds double precision NOT NULL,
+    index_scans bigint,
+    index_tuples_read bigint,
+    index_tuples_fetched bigint,
+    index_scans_per_second double precision,
+    index_tuples_read_per_second double precision,
+    index_tuples_fetched_per_second double precision,
+    counters_reset boolean NOT NULL
+);
+
+-- Grants, users and indexes that disappeared, written with --changes-only.
+-- object_key is a JSON array of the identifying columns of the object.
+CREATE TABLE IF NOT EXISTS dba.object_removals (
+    server_name text NOT NULL,
+    database_name text,
+    collector text NOT NULL,
+    object_key text NOT NULL,
+    removed_at timestamptz NOT NULL
+);
+
+-- One row per collector per snapshot with --changes-only. Every object that
+-- was not written as changed is still present as of last_seen.
+CREATE TABLE IF NOT EXISTS dba.collection_heartbeats (
+    server_name text NOT NULL,
+    database_name text,
+    collector text NOT NULL,
+    object_count integer NOT NULL,
+    changed_count integer NOT NULL,
+    removed_count integer NOT NULL,
+    snapshot_fingerprint text NOT NULL,
+    last_seen timestamptz NOT NULL
+);
+
+-- Time spent connecting, querying, fetching and writing, one row per server,
+-- database and collector. Connection spans have a NULL collector.
+CREATE TABLE IF NOT EXISTS dba.collection_timings (
+    run_started timestamptz NOT NULL,
+    server_name text NOT NULL,
+    database_name text,
+    collector text,
+    started_at timestamptz NOT NULL,
+    connect_seconds double precision NOT NULL,
+    query_seconds double precision NOT NULL,
+    fetch_seconds double precision NOT NULL,
+    write_seconds double precision NOT NULL,
+    total_seconds double precision NOT NULL,
+    row_count bigint,
+    succeeded boolean NOT NULL
+);
+
+-- One row per run of process_servers or collect_server. A run resumed with
+-- --resume keeps its run_id.
+CREATE TABLE IF NOT EXISTS dba.collection_runs (
+    run_id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    status text NOT NULL,
+    started_at timestamptz NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    resumed_at timestamptz,
+    finished_at timestamptz
+);
+
+-- One row per collector that finished on a database in a run, committed with
+-- its rows. Server collectors have a NULL database_name.
+CREATE TABLE IF NOT EXISTS dba.collection_progress (
+    run_id bigint NOT NULL REFERENCES dba.collection_runs (run_id),
+    server_name text NOT NULL,
+    database_name text,
+    collector text NOT NULL,
+    row_count bigint,
+    completed_at timestamptz NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS collection_progress_unit
+    ON dba.collection_progress (run_id, server_name, coalesce(database_name, ''), collector);
+
+-- Spooled batches already replayed by dba_spool, so a batch is applied once
+-- however often its segment is drained
+CREATE TABLE IF NOT EXISTS dba.spool_batches (
+    batch_id uuid PRIMARY KEY,
+    spooled_at timestamptz NOT NULL,
+    applied_at timestamptz NOT NULL
+);
+
+-- Servers to collect in a run, claimed by collection_workers with
+-- FOR UPDATE SKIP LOCKED. A leased unit whose lease has expired was
+-- abandoned by its worker and can be claimed by another.
+CREATE TABLE IF NOT EXISTS dba.collection_queue (
+    work_id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    run_id bigint NOT NULL REFERENCES dba.collection_runs (run_id),
+    server_name text NOT NULL,
+    status text NOT NULL,
+    worker_id text,
+    attempts integer NOT NULL DEFAULT 0,
+    leased_until timestamptz,
+    finished_at timestamptz,
+    UNIQUE (run_id, server_name)
+);
+
+CREATE INDEX IF NOT EXISTS collection_queue_claimable
+    ON dba.collection_queue (run_id, work_id)
+    WHERE status IN ('pending', 'leased');
+
+-- One row per collection worker process, with its last heartbeat
+CREATE TABLE IF NOT EXISTS dba.collection_workers (
+    worker_id text PRIMARY KEY,
+    started_at timestamptz NOT NULL,
+    heartbeat_at timestamptz NOT NULL,
+    units_done integer NOT NULL DEFAULT 0
+);
+
+-- Physical standbys of the servers in dba.servers. Sizes and catalogs are
+-- collected from the active standby with the lowest priority that is in
+-- recovery and not lagging, see replica_routing. Usage counters are always
+-- collected from the server itself.
+CREATE TABLE IF NOT EXISTS dba.server_replicas (
+    server_name text NOT NULL,
+    replica_host text NOT NULL,
+    replica_status integer NOT NULL DEFAULT 1,
+    priority integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (server_name, replica_host)
+);
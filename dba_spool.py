@@ -0,0 +1,547 @@
+import argparse
+import base64
+import glob
+import io
+import json
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extensions import encodings
+from psycopg2.extras import execute_values
+from bulk_insert import CURRENT_TIMESTAMP_QUERY
+from dba_pool import get_dba_connection, release_dba_connection
+from send_mail import send_mail
+
+# Directory holding the spool segments. PGINFO_SPOOL_DIR overrides it.
+SPOOL_DIR = os.environ.get("PGINFO_SPOOL_DIR", "spool")
+
+# A segment is sealed and a new one started once it reaches this size
+SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+
+# Seconds between drain passes of the background drainer
+SPOOL_DRAIN_INTERVAL = 5
+
+# Each batch is a big endian length followed by a zlib compressed JSON document
+FRAME_HEADER = struct.Struct(">I")
+
+# Each spooled COPY is replayed under this savepoint, so a COPY DBA001 refuses
+# can be sent again as INSERT statements, as bulk_insert would have
+REPLAY_COPY_SAVEPOINT_QUERY = "SAVEPOINT spool_copy"
+REPLAY_COPY_ROLLBACK_QUERY = "ROLLBACK TO SAVEPOINT spool_copy"
+REPLAY_COPY_RELEASE_QUERY = "RELEASE SAVEPOINT spool_copy"
+
+# The table, column list and optional encoding of a spooled COPY ... FROM STDIN
+COPY_STATEMENT_PATTERN = re.compile(
+    r"COPY\s+(?P<table>\S+)\s*\((?P<columns>[^)]*)\)\s+FROM\s+STDIN"
+    r"(?:\s+WITH\s*\(\s*ENCODING\s+'(?P<encoding>[^']+)'\s*\))?\s*$",
+    re.IGNORECASE,
+)
+
+# Backslash escapes of the COPY text format
+COPY_TEXT_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+# Claims a batch in the DBA transaction that replays it, so a batch that was
+# already applied, by this or any other drainer, is skipped
+CLAIM_BATCH_STATEMENT = """
+    INSERT INTO dba.spool_batches (batch_id, spooled_at, applied_at)
+    VALUES (%s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (batch_id) DO NOTHING
+    RETURNING batch_id;
+    """
+
+
+def _process_running(pid):
+    """
+    Args:
+        pid (int): A process id.
+
+    Returns:
+        bool: True if a process with that id is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Spool:
+    """
+    An append only spool of DBA transactions in compressed segment files.
+    Each committed transaction becomes one batch, written and fsynced before
+    the commit returns. Batches are appended to an open segment, which is
+    sealed once it is large enough or when the drainer asks for it. Only
+    sealed segments are drained.
+    """
+
+    def __init__(self, spool_dir=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES):
+        self.spool_dir = spool_dir
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.segment = None
+        self.segment_path = None
+        os.makedirs(spool_dir, exist_ok=True)
+
+        # Seal the segments of spools that crashed, so they are drained too
+        for path in glob.glob(os.path.join(spool_dir, "*.open")):
+            pid = int(os.path.basename(path).split("-")[1].split(".")[0])
+            if not _process_running(pid):
+                os.replace(path, path[: -len(".open")] + ".spool")
+
+    def append(self, operations):
+        """
+        Append one DBA transaction to the spool.
+
+        Args:
+            operations (list): The statements of the transaction, as recorded by SpoolCursor.
+        """
+        document = {
+            "batch_id": str(uuid.uuid4()),
+            "spooled_at": datetime.now(timezone.utc).isoformat(),
+            "operations": operations,
+        }
+        frame = zlib.compress(json.dumps(document).encode("utf-8"))
+
+        with self.lock:
+            if self.segment is None:
+                self.segment_path = os.path.join(
+                    self.spool_dir, f"{time.time_ns():020d}-{os.getpid()}.open"
+                )
+                self.segment = open(self.segment_path, "ab")
+
+            self.segment.write(FRAME_HEADER.pack(len(frame)) + frame)
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+
+            if self.segment.tell() >= self.segment_bytes:
+                self._seal()
+
+    def _seal(self):
+        """
+        Close the open segment and rename it so it can be drained. Call with the lock held.
+        """
+        if self.segment is None:
+            return
+
+        self.segment.close()
+        os.replace(self.segment_path, self.segment_path[: -len(".open")] + ".spool")
+        self.segment = None
+        self.segment_path = None
+
+    def seal(self):
+        """
+        Seal the open segment, if there is one.
+        """
+        with self.lock:
+            self._seal()
+
+
+class SpoolCursor:
+    """
+    Stands in for a cursor on the DBA database. Statements and COPY data are
+    recorded for the transaction of its SpoolConnection instead of being sent.
+    A recorded COPY always succeeds, its INSERT fallback is left to replay_copy.
+    CURRENT_TIMESTAMP is answered locally and stays the same until the
+    transaction ends, as it would on DBA001.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._row = None
+
+    def execute(self, query, params=None):
+        """
+        Record a statement, or answer CURRENT_TIMESTAMP_QUERY.
+
+        Args:
+            query (str): The statement.
+            params (tuple, optional): Its parameters. Must be JSON serializable. Defaults to None.
+        """
+        if query == CURRENT_TIMESTAMP_QUERY:
+            self._row = (self.connection.transaction_timestamp(),)
+            return
+
+        self.connection.operations.append(
+            {"execute": query, "params": list(params) if params is not None else None}
+        )
+
+    def fetchone(self):
+        """
+        Returns:
+            tuple: The result of the last CURRENT_TIMESTAMP_QUERY.
+        """
+        return self._row
+
+    def copy_expert(self, statement, buffer):
+        """
+        Record a COPY ... FROM STDIN statement with all of its data.
+
+        Args:
+            statement (str): The COPY statement.
+            buffer (file): A text or binary file holding the data.
+        """
+        data = buffer.read()
+        if isinstance(data, bytes):
+            operation = {"copy": statement, "data_base64": base64.b64encode(data).decode("ascii")}
+        else:
+            operation = {"copy": statement, "data": data}
+        self.connection.operations.append(operation)
+
+    def close(self):
+        pass
+
+
+class SpoolConnection:
+    """
+    Stands in for a connection to the DBA database. Each commit appends the
+    recorded transaction to the spool as one batch, and a rollback drops it.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.operations = []
+        self._timestamp = None
+
+    def cursor(self):
+        return SpoolCursor(self)
+
+    def transaction_timestamp(self):
+        """
+        Returns:
+            datetime: The local time the current transaction first asked for CURRENT_TIMESTAMP.
+        """
+        if self._timestamp is None:
+            self._timestamp = datetime.now(timezone.utc)
+        return self._timestamp
+
+    def commit(self):
+        if self.operations:
+            self.spool.append(self.operations)
+        self.operations = []
+        self._timestamp = None
+
+    def rollback(self):
+        self.operations = []
+        self._timestamp = None
+
+
+def open_dba_connection(dba_username, dba_password, spool=None):
+    """
+    Get a connection to write to the DBA database with: a spool connection if
+    there is a spool, else a connection borrowed from the DBA pool.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        spool (Spool, optional): The spool to write to instead of DBA001. Defaults to None.
+
+    Returns:
+        connection: A SpoolConnection or a psycopg2 connection.
+    """
+    if spool is not None:
+        return SpoolConnection(spool)
+
+    return get_dba_connection(dba_username, dba_password)
+
+
+def close_dba_connection(conn_dba):
+    """
+    Release a connection opened with open_dba_connection.
+
+    Args:
+        conn_dba (connection): The connection.
+    """
+    if isinstance(conn_dba, SpoolConnection):
+        conn_dba.rollback()
+    else:
+        release_dba_connection(conn_dba)
+
+
+def read_segment(path):
+    """
+    Read the batches of a segment. A batch cut short by a crash while it was
+    appended ends the segment, as its commit never returned.
+
+    Args:
+        path (str): The path of the segment.
+
+    Yields:
+        dict: Each batch, with batch_id, spooled_at and operations.
+    """
+    with open(path, "rb") as segment:
+        while True:
+            header = segment.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            (length,) = FRAME_HEADER.unpack(header)
+            frame = segment.read(length)
+            if len(frame) < length:
+                print(f"Ignoring a batch cut short at the end of {path}")
+                return
+            yield json.loads(zlib.decompress(frame))
+
+
+def parse_copy_text(data):
+    """
+    Parse COPY data in text format back into rows.
+
+    Args:
+        data (str): The COPY data, one row per line.
+
+    Returns:
+        list: A tuple of str or None values per row.
+    """
+    rows = []
+    for line in data.split("\n"):
+        if not line:
+            continue
+        rows.append(
+            tuple(
+                None
+                if field == "\\N"
+                else re.sub(
+                    r"\\(.)",
+                    lambda match: COPY_TEXT_ESCAPES.get(match.group(1), match.group(1)),
+                    field,
+                )
+                for field in line.split("\t")
+            )
+        )
+
+    return rows
+
+
+def replay_copy(cursor_dba, operation):
+    """
+    Run a spooled COPY on the DBA database under a savepoint. If DBA001
+    refuses the data, the COPY is rolled back and its rows are inserted with
+    INSERT statements instead, the fallback of bulk_insert. The values are
+    sent as text and cast to the column types by DBA001.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        operation (dict): A COPY operation as recorded by SpoolCursor.
+
+    Raises:
+        psycopg2.Error: If the rows could not be inserted either, or the connection was lost.
+    """
+    if "data_base64" in operation:
+        data = base64.b64decode(operation["data_base64"])
+        buffer = io.BytesIO(data)
+    else:
+        data = operation["data"]
+        buffer = io.StringIO(data)
+
+    cursor_dba.execute(REPLAY_COPY_SAVEPOINT_QUERY)
+    try:
+        cursor_dba.copy_expert(operation["copy"], buffer)
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error as e:
+        match = COPY_STATEMENT_PATTERN.match(operation["copy"].strip())
+        if match is None:
+            raise
+        print(f"COPY into {match['table']} failed, falling back to INSERT. The error is  {e}")
+        cursor_dba.execute(REPLAY_COPY_ROLLBACK_QUERY)
+        if isinstance(data, bytes):
+            data = data.decode(encodings.get(match["encoding"] or "UTF8", "utf_8"))
+        execute_values(
+            cursor_dba,
+            f"INSERT INTO {match['table']} ({match['columns']}) VALUES %s",
+            parse_copy_text(data),
+            page_size=1000,
+        )
+    cursor_dba.execute(REPLAY_COPY_RELEASE_QUERY)
+
+
+def replay_batch(cursor_dba, batch):
+    """
+    Run the statements of a batch on the DBA database, unless it was applied before.
+    COPY statements fall back to INSERT, see replay_copy. The caller commits the transaction.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        batch (dict): A batch as read by read_segment.
+
+    Returns:
+        bool: True if the batch was applied now, False if it had been applied before.
+    """
+    cursor_dba.execute(CLAIM_BATCH_STATEMENT, (batch["batch_id"], batch["spooled_at"]))
+    if cursor_dba.fetchone() is None:
+        return False
+
+    for operation in batch["operations"]:
+        if "execute" in operation:
+            cursor_dba.execute(operation["execute"], operation["params"])
+        else:
+            replay_copy(cursor_dba, operation)
+
+    return True
+
+
+def reject_batch(spool_dir, batch, e):
+    """
+    Set aside a batch DBA001 refuses, so it does not hold up the rest of the spool.
+
+    Args:
+        spool_dir (str): The spool directory.
+        batch (dict): The batch.
+        e (Exception): The error DBA001 returned.
+    """
+    frame = zlib.compress(json.dumps(batch).encode("utf-8"))
+    with open(os.path.join(spool_dir, "rejected.batches"), "ab") as rejected:
+        rejected.write(FRAME_HEADER.pack(len(frame)) + frame)
+
+    function_name = replay_batch.__name__
+    error_message = (
+        f"An error occurred in {function_name} on spooled batch {batch['batch_id']}. "
+        f"The batch was moved to rejected.batches. The error is  {e}"
+    )
+    error_subject = f"Failure: {function_name}"
+    error_recipients = "name@example.com"
+    print(error_message)
+    try:
+        send_mail(error_subject, error_message, error_recipients)
+    except Exception as e:
+        print(f"Failed to send email notification: {e}")
+
+
+def pending_segments(spool_dir=SPOOL_DIR):
+    """
+    Args:
+        spool_dir (str, optional): The spool directory. Defaults to SPOOL_DIR.
+
+    Returns:
+        list: The paths of the sealed segments, oldest first.
+    """
+    return sorted(glob.glob(os.path.join(spool_dir, "*.spool")))
+
+
+def drain_spool(dba_username, dba_password, spool_dir=SPOOL_DIR):
+    """
+    Replay the sealed segments of the spool into the DBA database, oldest
+    first, one transaction per batch. Batches applied before are skipped, so
+    a segment that was partly drained can be replayed as a whole. A segment
+    is deleted once every batch in it is stored. Draining stops at the first
+    connection error and resumes from there on the next call.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        spool_dir (str, optional): The spool directory. Defaults to SPOOL_DIR.
+
+    Returns:
+        int: The number of batches applied.
+    """
+    applied = 0
+
+    for path in pending_segments(spool_dir):
+        conn_dba = None
+        cursor_dba = None
+
+        try:
+            conn_dba = get_dba_connection(dba_username, dba_password)
+            cursor_dba = conn_dba.cursor()
+
+            for batch in read_segment(path):
+                try:
+                    if replay_batch(cursor_dba, batch):
+                        applied += 1
+                    conn_dba.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    raise
+                except Exception as e:
+                    conn_dba.rollback()
+                    reject_batch(spool_dir, batch, e)
+
+            os.remove(path)
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"DBA database unavailable, {len(pending_segments(spool_dir))} spool segments left. The error is  {e}")
+            break
+
+        finally:
+            if cursor_dba is not None:
+                cursor_dba.close()
+            if conn_dba is not None:
+                release_dba_connection(conn_dba)
+
+    return applied
+
+
+def drain_in_background(dba_username, dba_password, spool, stop, interval=SPOOL_DRAIN_INTERVAL):
+    """
+    Drain a spool every interval seconds until stop is set, then once more.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        spool (Spool): The spool collectors append to.
+        stop (threading.Event): Set when collection has finished.
+        interval (int, optional): Seconds between drain passes. Defaults to SPOOL_DRAIN_INTERVAL.
+    """
+    while True:
+        stopping = stop.wait(interval)
+        spool.seal()
+        try:
+            drain_spool(dba_username, dba_password, spool.spool_dir)
+        except Exception as e:
+            print(f"Spool drain failed, retrying in {interval}s. The error is  {e}")
+        if stopping:
+            return
+
+
+def start_spool_drainer(dba_username, dba_password, spool, interval=SPOOL_DRAIN_INTERVAL):
+    """
+    Start draining a spool on a background thread.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        spool (Spool): The spool collectors append to.
+        interval (int, optional): Seconds between drain passes. Defaults to SPOOL_DRAIN_INTERVAL.
+
+    Returns:
+        tuple: The drainer thread and the threading.Event that stops it after a final pass.
+    """
+    stop = threading.Event()
+    drainer = threading.Thread(
+        target=drain_in_background,
+        args=(dba_username, dba_password, spool, stop, interval),
+        name="pginfo-spool-drainer",
+        daemon=True,
+    )
+    drainer.start()
+
+    return drainer, stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay spooled collections into the DBAAdmin database."
+    )
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+    parser.add_argument(
+        "--spool-dir",
+        default=SPOOL_DIR,
+        help=f"Directory holding the spool segments (default: {SPOOL_DIR})",
+    )
+
+    args = parser.parse_args()
+
+    # Seal segments left open by collections that stopped
+    Spool(args.spool_dir).seal()
+    batch_count = drain_spool(args.dba_username, args.dba_password, args.spool_dir)
+    print(
+        f"Applied {batch_count} batches, "
+        f"{len(pending_segments(args.spool_dir))} spool segments left"
+    )
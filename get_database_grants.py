@@ -1,8 +1,160 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+# Grants on objects in the current database, read straight from the ACLs in
+# pg_catalog. The output matches INFORMATION_SCHEMA_GRANTS_QUERY, which builds
+# the same rows from the information_schema role_*_grants views.
+DATABASE_GRANTS_QUERY = """
+    WITH grantees AS (
+        SELECT oid, rolname FROM pg_catalog.pg_roles
+        UNION ALL
+        SELECT 0::oid, 'PUBLIC'::name
+    ),
+    privileges AS (
+        -- Tables, views, foreign tables and partitioned tables
+        SELECT c.relnamespace AS namespace_oid,
+               c.relname AS object_name,
+               CASE
+                   WHEN c.relkind = 'v' THEN 'VIEW'
+                   WHEN c.relkind = 'f' THEN 'FOREIGN'
+                   WHEN c.relpersistence = 't' THEN 'LOCAL TEMPORARY'
+                   ELSE 'BASE TABLE'
+               END AS object_type,
+               c.relowner AS owner_oid,
+               acl.grantor, acl.grantee, acl.privilege_type, acl.is_grantable,
+               CASE WHEN acl.privilege_type = 'SELECT' THEN 'YES' ELSE 'NO' END AS with_hierarchy,
+               true AS allow_pg_schemas
+        FROM pg_catalog.pg_class c
+        CROSS JOIN LATERAL aclexplode(COALESCE(c.relacl, acldefault('r', c.relowner))) acl
+        WHERE c.relkind IN ('r', 'v', 'f', 'p')
+        AND acl.privilege_type IN ('INSERT', 'SELECT', 'UPDATE', 'DELETE', 'TRUNCATE', 'REFERENCES', 'TRIGGER')
+        UNION ALL
+        -- Sequences
+        SELECT c.relnamespace, c.relname, 'SEQUENCE', c.relowner,
+               acl.grantor, acl.grantee, acl.privilege_type, acl.is_grantable, NULL, true
+        FROM pg_catalog.pg_class c
+        CROSS JOIN LATERAL aclexplode(COALESCE(c.relacl, acldefault('s', c.relowner))) acl
+        WHERE c.relkind = 'S'
+        AND acl.privilege_type = 'USAGE'
+        UNION ALL
+        -- Functions and procedures
+        SELECT p.pronamespace, p.proname,
+               CASE p.prokind WHEN 'f' THEN 'FUNCTION' WHEN 'p' THEN 'PROCEDURE' END,
+               p.proowner,
+               acl.grantor, acl.grantee, acl.privilege_type, acl.is_grantable, NULL, true
+        FROM pg_catalog.pg_proc p
+        CROSS JOIN LATERAL aclexplode(COALESCE(p.proacl, acldefault('f', p.proowner))) acl
+        WHERE acl.privilege_type = 'EXECUTE'
+        UNION ALL
+        -- Domains
+        SELECT t.typnamespace, t.typname, 'DOMAIN', t.typowner,
+               acl.grantor, acl.grantee, acl.privilege_type, acl.is_grantable, NULL, true
+        FROM pg_catalog.pg_type t
+        CROSS JOIN LATERAL aclexplode(COALESCE(t.typacl, acldefault('T', t.typowner))) acl
+        WHERE t.typtype = 'd'
+        AND acl.privilege_type = 'USAGE'
+        UNION ALL
+        -- Composite types, including the row types of tables
+        SELECT t.typnamespace, t.typname, '', t.typowner,
+               acl.grantor, acl.grantee, 'TYPE USAGE', acl.is_grantable, NULL, false
+        FROM pg_catalog.pg_type t
+        CROSS JOIN LATERAL aclexplode(COALESCE(t.typacl, acldefault('T', t.typowner))) acl
+        WHERE t.typtype = 'c'
+        AND acl.privilege_type = 'USAGE'
+        UNION ALL
+        -- Collations have no ACL, everyone may use them
+        SELECT c.collnamespace, c.collname, 'COLLATION', c.collowner,
+               c.collowner, 0::oid, 'USAGE', false, NULL, true
+        FROM pg_catalog.pg_collation c
+        WHERE c.collencoding IN (-1, (SELECT encoding FROM pg_catalog.pg_database WHERE datname = current_database()))
+        UNION ALL
+        -- Foreign data wrappers and foreign servers, which have no schema
+        SELECT NULL, w.fdwname, 'FOREIGN DATA WRAPPER', w.fdwowner,
+               acl.grantor, acl.grantee, acl.privilege_type, acl.is_grantable, NULL, true
+        FROM pg_catalog.pg_foreign_data_wrapper w
+        CROSS JOIN LATERAL aclexplode(COALESCE(w.fdwacl, acldefault('F', w.fdwowner))) acl
+        WHERE acl.privilege_type = 'USAGE'
+        UNION ALL
+        SELECT NULL, s.srvname, 'FOREIGN SERVER', s.srvowner,
+               acl.grantor, acl.grantee, acl.privilege_type, acl.is_grantable, NULL, true
+        FROM pg_catalog.pg_foreign_server s
+        CROSS JOIN LATERAL aclexplode(COALESCE(s.srvacl, acldefault('S', s.srvowner))) acl
+        WHERE acl.privilege_type = 'USAGE'
+    )
+    SELECT DISTINCT current_database()::text AS database_name
+    , COALESCE(n.nspname, '')::text AS schema_name
+    , p.object_name::text AS object_name
+    , p.object_type::text AS object_type
+    , grantor.rolname::text AS grantor
+    , grantee.rolname::text AS grantee
+    , p.privilege_type::text AS privilege_type
+    , CASE
+          WHEN p.is_grantable THEN 'YES'
+          WHEN p.grantee <> 0 AND pg_has_role(p.grantee, p.owner_oid, 'USAGE') THEN 'YES'
+          ELSE 'NO'
+      END AS is_grantable
+    , p.with_hierarchy::text AS with_hierarchy
+    FROM privileges p
+    JOIN pg_catalog.pg_roles grantor ON grantor.oid = p.grantor
+    JOIN grantees grantee ON grantee.oid = p.grantee
+    LEFT JOIN pg_catalog.pg_namespace n ON n.oid = p.namespace_oid
+    WHERE COALESCE(n.nspname, '') NOT IN ('pg_catalog', 'information_schema')
+    AND (p.allow_pg_schemas OR substr(n.nspname, 1, 3) <> 'pg_')
+    AND p.grantor <> p.grantee
+    AND (
+        pg_has_role(p.grantor, 'USAGE')
+        OR (p.grantee <> 0 AND pg_has_role(p.grantee, 'USAGE'))
+    )
+    ORDER BY database_name, schema_name, object_name, object_type;
+    """
+
+# The original grants query over the information_schema views. Kept to check
+# and benchmark DATABASE_GRANTS_QUERY against, see benchmark_grants.py.
+INFORMATION_SCHEMA_GRANTS_QUERY = """
+    with results as (
+    SELECT rug.grantor, rug.grantee, rug.object_catalog, rug.object_schema, rug.object_name, rug.object_type, rug.privilege_type, rug.is_grantable, null::text AS with_hierarchy
+    FROM information_schema.role_usage_grants rug
+    WHERE rug.object_schema NOT IN ('pg_catalog', 'information_schema')
+    AND grantor <> grantee
+    UNION
+    SELECT rtg.grantor, rtg.grantee, rtg.table_catalog, rtg.table_schema, rtg.table_name, tab.table_type, rtg.privilege_type, rtg.is_grantable, rtg.with_hierarchy
+    FROM information_schema.role_table_grants rtg
+    LEFT JOIN information_schema.tables tab
+    ON (tab.table_catalog = rtg.table_catalog AND tab.table_schema = rtg.table_schema AND tab.table_name = rtg.table_name)
+    WHERE rtg.table_schema NOT IN ('pg_catalog', 'information_schema')
+    AND grantor <> grantee
+    UNION
+    SELECT rrg.grantor, rrg.grantee, rrg.routine_catalog, rrg.routine_schema, rrg.routine_name, fcn.routine_type, rrg.privilege_type, rrg.is_grantable, null::text AS with_hierarchy
+    FROM information_schema.role_routine_grants rrg
+    LEFT JOIN information_schema.routines fcn
+    ON (fcn.routine_catalog = rrg.routine_catalog AND fcn.routine_schema = rrg.routine_schema AND fcn.routine_name = rrg.routine_name)
+    WHERE rrg.specific_schema NOT IN ('pg_catalog', 'information_schema')
+    AND grantor <> grantee
+    UNION
+    SELECT rug.grantor, rug.grantee, rug.udt_catalog, rug.udt_schema, rug.udt_name, ''::text AS udt_type, rug.privilege_type, rug.is_grantable, null::text AS with_hierarchy
+    FROM information_schema.role_udt_grants rug
+    WHERE rug.udt_schema NOT IN ('pg_catalog', 'information_schema')
+    AND substr (rug.udt_schema, 1, 3) <> 'pg_'
+    AND grantor <> grantee
+    )
+    SELECT results.object_catalog as database_name
+    , results.object_schema as schema_name
+    , results.object_name
+    , results.object_type
+    , results.grantor
+    , results.grantee
+    , results.privilege_type
+    , results.is_grantable
+    , results.with_hierarchy
+    from results
+    order by object_catalog, object_schema, object_name, object_type;
+    """
+
+
 def get_database_grants(server_name, user, password, db_name="postgres"):
     """
     Retrieve the grants for objects in a PostgreSQL database.
@@ -28,6 +180,7 @@ def get_database_grants(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the database or executing the query.
+        ServerUnavailable: If the circuit breaker of the server is open.
     """
 
     # Initialize connection and cursor
@@ -35,56 +188,28 @@ def get_database_grants(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_grants"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        with results as (
-        SELECT rug.grantor, rug.grantee, rug.object_catalog, rug.object_schema, rug.object_name, rug.object_type, rug.privilege_type, rug.is_grantable, null::text AS with_hierarchy
-        FROM information_schema.role_usage_grants rug
-        WHERE rug.object_schema NOT IN ('pg_catalog', 'information_schema')
-        AND grantor <> grantee
-        UNION
-        SELECT rtg.grantor, rtg.grantee, rtg.table_catalog, rtg.table_schema, rtg.table_name, tab.table_type, rtg.privilege_type, rtg.is_grantable, rtg.with_hierarchy
-        FROM information_schema.role_table_grants rtg
-        LEFT JOIN information_schema.tables tab
-        ON (tab.table_catalog = rtg.table_catalog AND tab.table_schema = rtg.table_schema AND tab.table_name = rtg.table_name)
-        WHERE rtg.table_schema NOT IN ('pg_catalog', 'information_schema')
-        AND grantor <> grantee
-        UNION
-        SELECT rrg.grantor, rrg.grantee, rrg.routine_catalog, rrg.routine_schema, rrg.routine_name, fcn.routine_type, rrg.privilege_type, rrg.is_grantable, null::text AS with_hierarchy
-        FROM information_schema.role_routine_grants rrg
-        LEFT JOIN information_schema.routines fcn
-        ON (fcn.routine_catalog = rrg.routine_catalog AND fcn.routine_schema = rrg.routine_schema AND fcn.routine_name = rrg.routine_name)
-        WHERE rrg.specific_schema NOT IN ('pg_catalog', 'information_schema')
-        AND grantor <> grantee
-        UNION
-        SELECT rug.grantor, rug.grantee, rug.udt_catalog, rug.udt_schema, rug.udt_name, ''::text AS udt_type, rug.privilege_type, rug.is_grantable, null::text AS with_hierarchy
-        FROM information_schema.role_udt_grants rug
-        WHERE rug.udt_schema NOT IN ('pg_catalog', 'information_schema')
-        AND substr (rug.udt_schema, 1, 3) <> 'pg_'
-        AND grantor <> grantee
-        )
-        SELECT results.object_catalog as database_name
-        , results.object_schema as schema_name
-        , results.object_name
-        , results.object_type
-        , results.grantor
-        , results.grantee
-        , results.privilege_type
-        , results.is_grantable
-        , results.with_hierarchy
-        from results
-        order by object_catalog, object_schema, object_name, object_type;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_GRANTS_QUERY)
         database_grants = cursor.fetchall()
 
         return database_grants
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_grants.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -1,8 +1,23 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+DATABASE_INDEX_USAGE_QUERY = """
+    SELECT current_database() as database_name,
+           i.schemaname AS schema_name,
+           i.relname AS table_name,
+           i.indexrelname AS index_name,    
+           i.idx_scan AS index_scans,
+           i.idx_tup_read as index_tuples_read,
+           i.idx_tup_fetch as index_tuples_fetched
+    FROM   pg_stat_user_indexes as i
+    ORDER BY i.schemaname, i.relname, i.indexrelname;
+    """
+
+
 def get_database_index_usage(server_name, user, password, db_name="postgres"):
     """
     Retrieves the usage statistics for indexes in a PostgreSQL database.
@@ -26,6 +41,7 @@ def get_database_index_usage(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the PostgreSQL server or executing the query.
+        ServerUnavailable: If the circuit breaker of the server is open.
     """
 
     # Initialize connection and cursor
@@ -33,28 +49,28 @@ def get_database_index_usage(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_index_usage"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        SELECT current_database() as database_name,
-               i.schemaname AS schema_name,
-               i.relname AS table_name,
-               i.indexrelname AS index_name,    
-               i.idx_scan AS index_scans,
-               i.idx_tup_read as index_tuples_read,
-               i.idx_tup_fetch as index_tuples_fetched
-        FROM   pg_stat_user_indexes as i
-        ORDER BY i.schemaname, i.relname, i.indexrelname;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_INDEX_USAGE_QUERY)
         table_usage = cursor.fetchall()
 
         return table_usage
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_index_usage.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -1,8 +1,27 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+DATABASE_INDEXES_QUERY = """
+    SELECT current_database() as database_name,
+        n.nspname AS schema_name,
+        t.relname AS table_name,
+        i.relname AS index_name,
+        pg_relation_size(i.oid) AS index_size_bytes,
+        LEFT(pg_get_indexdef(i.oid), 255) AS index_definition
+    FROM pg_class t
+    JOIN pg_index x ON t.oid = x.indrelid
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE t.relkind = 'r' AND i.relkind = 'i'
+    and  n.nspname NOT IN ('pg_catalog', 'information_schema')
+    ORDER BY n.nspname, t.relname, i.relname;
+    """
+
+
 def get_database_indexes(server_name, user, password, db_name="postgres"):
     """
     Retrieves a list of indexes from a PostgreSQL database.
@@ -18,6 +37,7 @@ def get_database_indexes(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the database.
+        ServerUnavailable: If the circuit breaker of the server is open.
 
     """
 
@@ -26,32 +46,28 @@ def get_database_indexes(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_index_sizes"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        SELECT current_database() as database_name,
-            n.nspname AS schema_name,
-            t.relname AS table_name,
-            i.relname AS index_name,
-            pg_relation_size(i.oid) AS index_size_bytes,
-            LEFT(pg_get_indexdef(i.oid), 255) AS index_definition
-        FROM pg_class t
-        JOIN pg_index x ON t.oid = x.indrelid
-        JOIN pg_class i ON i.oid = x.indexrelid
-        JOIN pg_namespace n ON n.oid = t.relnamespace
-        WHERE t.relkind = 'r' AND i.relkind = 'i'
-        and  n.nspname NOT IN ('pg_catalog', 'information_schema')
-        ORDER BY n.nspname, t.relname, i.relname;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_INDEXES_QUERY)
         index_list = cursor.fetchall()
 
         return index_list
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_indexes.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
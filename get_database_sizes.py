@@ -1,8 +1,19 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+# Each database is measured once, in bytes. Units are derived by the writer.
+DATABASE_SIZES_QUERY = """
+    SELECT datname,
+           pg_database_size(datname) AS size_bytes
+    FROM pg_database
+    WHERE datistemplate = false;
+    """
+
+
 def get_database_sizes(server_name, user, password, db_name="postgres"):
     """
     Retrieves the sizes of all non-template databases on a PostgreSQL server.
@@ -14,10 +25,11 @@ def get_database_sizes(server_name, user, password, db_name="postgres"):
         db_name (str, optional): The name of the database to connect to. Defaults to 'postgres'.
 
     Returns:
-        list: A list of tuples containing the database name, size in MB, and size in GB.
+        list: A list of tuples containing the database name and size in bytes.
 
     Raises:
         Exception: If an error occurs while connecting to the server or executing the query.
+        ServerUnavailable: If the circuit breaker of the server is open.
     """
 
     # Initialize connection and cursor
@@ -25,25 +37,29 @@ def get_database_sizes(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_sizes"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        SELECT datname,
-               pg_database_size(datname)/1024/1024 AS size_mb,
-               pg_database_size(datname)/1024/1024/1024 AS size_gb
-        FROM pg_database
-        WHERE datistemplate = false;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_SIZES_QUERY)
 
         databases = cursor.fetchall()
 
         return databases
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_sizes.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
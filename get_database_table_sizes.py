@@ -1,9 +1,114 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
-def get_database_table_sizes(server_name, user, password, db_name="postgres"):
+# Each table and its indexes are measured once. The total is their sum, which
+# is what pg_total_relation_size would measure again. The size functions are
+# volatile, so the planner keeps the subquery and calls them once per table.
+# reltuples is a float4, which COPY writes as e.g. 1e+06, so it is cast to
+# the integer type of dba.tables.row_count.
+DATABASE_TABLE_SIZES_QUERY = """
+    SELECT  database_name,
+            schema_name,
+            table_name,
+            table_size,
+            index_size,
+            table_size + index_size AS total_size,
+            row_estimate
+    FROM (
+        SELECT  current_database() as database_name,
+                nspname AS schema_name,
+                relname AS table_name,
+                pg_table_size(C.oid) AS table_size,
+                pg_indexes_size(C.oid) AS index_size,
+                C.reltuples::bigint AS row_estimate
+        FROM pg_class C LEFT JOIN pg_namespace N ON (N.oid = C.relnamespace)
+        WHERE nspname NOT IN ('pg_catalog', 'information_schema')
+        AND   relkind = 'r'
+    ) sizes
+    ORDER BY total_size DESC;
+    """
+
+# The same columns, estimated from the page counts in pg_class as of the last
+# VACUUM or ANALYZE instead of measuring every file. The TOAST table and its
+# index count towards the table size like in pg_table_size; the free space
+# and visibility maps are left out. The {exact_top} largest tables by estimate
+# are still measured exactly.
+DATABASE_TABLE_SIZES_ESTIMATE_QUERY = """
+    WITH estimates AS (
+        SELECT  C.oid,
+                N.nspname AS schema_name,
+                C.relname AS table_name,
+                (C.relpages + COALESCE(T.relpages, 0) + COALESCE(TI.relpages, 0))::bigint
+                    * B.block_size AS table_size,
+                COALESCE(I.relpages, 0) * B.block_size AS index_size,
+                C.reltuples::bigint AS row_estimate
+        FROM pg_class C
+        LEFT JOIN pg_namespace N ON (N.oid = C.relnamespace)
+        LEFT JOIN pg_class T ON (T.oid = C.reltoastrelid)
+        LEFT JOIN pg_index TX ON (TX.indrelid = T.oid)
+        LEFT JOIN pg_class TI ON (TI.oid = TX.indexrelid)
+        LEFT JOIN LATERAL (
+            SELECT sum(IC.relpages)::bigint AS relpages
+            FROM pg_index X
+            JOIN pg_class IC ON (IC.oid = X.indexrelid)
+            WHERE X.indrelid = C.oid
+        ) I ON true
+        CROSS JOIN (SELECT current_setting('block_size')::bigint AS block_size) B
+        WHERE nspname NOT IN ('pg_catalog', 'information_schema')
+        AND   C.relkind = 'r'
+    ),
+    ranked AS (
+        SELECT  estimates.*,
+                table_size + index_size AS total_size,
+                row_number() OVER (ORDER BY table_size + index_size DESC) AS size_rank
+        FROM estimates
+    )
+    SELECT  database_name,
+            schema_name,
+            table_name,
+            table_size,
+            index_size,
+            table_size + index_size AS total_size,
+            row_estimate
+    FROM (
+        SELECT  current_database() as database_name,
+                schema_name,
+                table_name,
+                CASE WHEN size_rank <= {exact_top} THEN pg_table_size(oid) ELSE table_size END AS table_size,
+                CASE WHEN size_rank <= {exact_top} THEN pg_indexes_size(oid) ELSE index_size END AS index_size,
+                row_estimate,
+                size_rank
+        FROM ranked
+    ) sizes
+    ORDER BY size_rank;
+    """
+
+
+def table_sizes_query(estimate_sizes=None):
+    """
+    Get the table sizes query for a size mode.
+
+    Args:
+        estimate_sizes (int, optional): None to measure every table exactly, or the number
+                                        of largest tables to measure exactly while the
+                                        rest are estimated. Defaults to None.
+
+    Returns:
+        str: The table sizes query.
+    """
+    if estimate_sizes is None:
+        return DATABASE_TABLE_SIZES_QUERY
+
+    return DATABASE_TABLE_SIZES_ESTIMATE_QUERY.format(exact_top=int(estimate_sizes))
+
+
+def get_database_table_sizes(
+    server_name, user, password, db_name="postgres", estimate_sizes=None
+):
     """
     Retrieves the sizes of tables in a PostgreSQL database.
 
@@ -12,6 +117,7 @@ def get_database_table_sizes(server_name, user, password, db_name="postgres"):
         user (str): The username to connect to the server.
         password (str): The password to authenticate the user.
         db_name (str, optional): The name of the database. Defaults to 'postgres'.
+        estimate_sizes (int, optional): Estimate sizes from relpages, measuring only this many of the largest tables. Defaults to None, measure every table.
 
     Returns:
         list: A list of tuples containing the following information for each table:
@@ -25,6 +131,7 @@ def get_database_table_sizes(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the database or executing the query.
+        ServerUnavailable: If the circuit breaker of the server is open.
 
     """
 
@@ -33,30 +140,28 @@ def get_database_table_sizes(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_table_sizes"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        SELECT  current_database() as database_name,
-                nspname AS schema_name,
-                relname AS table_name,
-                pg_table_size(C.oid) AS table_size,
-                pg_indexes_size(C.oid) AS index_size,
-                pg_total_relation_size(C.oid) AS total_size,
-                C.reltuples AS row_estimate
-        FROM pg_class C LEFT JOIN pg_namespace N ON (N.oid = C.relnamespace)
-        WHERE nspname NOT IN ('pg_catalog', 'information_schema')
-        AND   relkind = 'r'
-        ORDER BY pg_total_relation_size(C.oid) DESC;
-        """
-
-        cursor.execute(query)
+        cursor.execute(table_sizes_query(estimate_sizes))
         table_sizes = cursor.fetchall()
 
         return table_sizes
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_table_sizes.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -87,11 +192,23 @@ if __name__ == "__main__":
     )
     parser.add_argument("username", help="Username for the PostgreSQL server")
     parser.add_argument("password", help="Password for the PostgreSQL server")
+    parser.add_argument(
+        "--estimate-sizes",
+        type=int,
+        nargs="?",
+        const=0,
+        metavar="EXACT_TOP",
+        help="Estimate sizes from relpages, measuring only the EXACT_TOP largest tables exactly (default: 0)",
+    )
 
     args = parser.parse_args()
 
     tables = get_database_table_sizes(
-        args.server_name, args.username, args.password, args.database_name
+        args.server_name,
+        args.username,
+        args.password,
+        args.database_name,
+        args.estimate_sizes,
     )
     for table in tables:
         print(table)
@@ -1,8 +1,23 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+DATABASE_TABLE_USAGE_QUERY = """
+    select  current_database() as database_name,
+            schemaname as schema_name,
+            relname as table_name,
+            seq_scan as sequential_scans,
+            seq_tup_read as sequential_tuples_read,
+            idx_scan as index_scans,
+            idx_tup_fetch as index_tuples_fetched    
+    from   pg_stat_user_tables
+    order by schemaname, relname;
+    """
+
+
 def get_database_table_usage(server_name, user, password, db_name="postgres"):
     """
     Retrieves the usage statistics for tables in a PostgreSQL database.
@@ -26,6 +41,7 @@ def get_database_table_usage(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the PostgreSQL server or executing the query.
+        ServerUnavailable: If the circuit breaker of the server is open.
     """
 
     # Initialize connection and cursor
@@ -33,28 +49,28 @@ def get_database_table_usage(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_table_usage"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        select  current_database() as database_name,
-                schemaname as schema_name,
-                relname as table_name,
-                seq_scan as sequential_scans,
-                seq_tup_read as sequential_tuples_read,
-                idx_scan as index_scans,
-                idx_tup_fetch as index_tuples_fetched    
-        from   pg_stat_user_tables
-        order by schemaname, relname;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_TABLE_USAGE_QUERY)
         table_usage = cursor.fetchall()
 
         return table_usage
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_table_usage.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -1,8 +1,20 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+DATABASE_TABLES_QUERY = """
+    SELECT t.table_schema, 
+            t.table_name
+    FROM information_schema.tables as t
+    WHERE t.table_type = 'BASE TABLE'
+    AND t.table_schema not in ('pg_catalog', 'information_schema')
+    ORDER BY t.table_schema, t.table_name;
+    """
+
+
 def get_database_tables(server_name, user, password, db_name="postgres"):
     """
     Retrieves a list of tables from a PostgreSQL database.
@@ -18,6 +30,7 @@ def get_database_tables(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the database.
+        ServerUnavailable: If the circuit breaker of the server is open.
 
     """
 
@@ -26,25 +39,28 @@ def get_database_tables(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options(),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        SELECT t.table_schema, 
-                t.table_name
-        FROM information_schema.tables as t
-        WHERE t.table_type = 'BASE TABLE'
-        AND t.table_schema not in ('pg_catalog', 'information_schema')
-        ORDER BY t.table_schema, t.table_name;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_TABLES_QUERY)
         table_list = cursor.fetchall()
 
         return table_list
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_tables.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -1,8 +1,29 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+DATABASE_USERS_QUERY = """
+    SELECT r.rolname
+        ,r.rolsuper
+        ,r.rolinherit
+        ,r.rolcreaterole
+        ,r.rolcreatedb
+        ,r.rolcanlogin
+        ,r.rolreplication
+        ,r.rolconnlimit
+        ,r.rolvaliduntil
+        , ARRAY(SELECT b.rolname 
+        FROM pg_catalog.pg_auth_members m 
+        JOIN pg_catalog.pg_roles b ON (m.roleid = b.oid) WHERE m.member = r.oid) AS memberof
+        ,r.rolconfig
+    FROM pg_catalog.pg_roles r
+    ORDER BY 1;
+    """
+
+
 def get_database_users(server_name, user, password, db_name="postgres"):
     """
     Retrieve the users in a PostgreSQL server.
@@ -30,6 +51,7 @@ def get_database_users(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the database or executing the query.
+        ServerUnavailable: If the circuit breaker of the server is open.
     """
 
     # Initialize connection and cursor
@@ -37,34 +59,28 @@ def get_database_users(server_name, user, password, db_name="postgres"):
     cursor = None
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options("insert_database_users"),
+            ),
         )
         cursor = conn.cursor()
 
-        query = """
-        SELECT r.rolname
-            ,r.rolsuper
-            ,r.rolinherit
-            ,r.rolcreaterole
-            ,r.rolcreatedb
-            ,r.rolcanlogin
-            ,r.rolreplication
-            ,r.rolconnlimit
-            ,r.rolvaliduntil
-            , ARRAY(SELECT b.rolname 
-            FROM pg_catalog.pg_auth_members m 
-            JOIN pg_catalog.pg_roles b ON (m.roleid = b.oid) WHERE m.member = r.oid) AS memberof
-            ,r.rolconfig
-        FROM pg_catalog.pg_roles r
-        ORDER BY 1;
-        """
-
-        cursor.execute(query)
+        cursor.execute(DATABASE_USERS_QUERY)
         database_users = cursor.fetchall()
 
         return database_users
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_database_users.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
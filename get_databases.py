@@ -1,8 +1,13 @@
 import argparse
 import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import CONNECT_TIMEOUT, timeout_options
 from send_mail import send_mail
 
 
+DATABASES_QUERY = "SELECT datname FROM pg_database WHERE datistemplate = false;"
+
+
 def get_databases(server_name, user, password, db_name="postgres"):
     """
     Get a list of databases from a PostgreSQL server.
@@ -18,6 +23,7 @@ def get_databases(server_name, user, password, db_name="postgres"):
 
     Raises:
         Exception: If an error occurs while connecting to the database.
+        ServerUnavailable: If the circuit breaker of the server is open.
 
     """
 
@@ -26,17 +32,29 @@ def get_databases(server_name, user, password, db_name="postgres"):
     cursor = None  # Initialize cursor outside try block
 
     try:
-        conn = psycopg2.connect(
-            host=server_name, user=user, password=password, dbname=db_name
+        conn = connect_with_retry(
+            server_name,
+            lambda: psycopg2.connect(
+                host=server_name,
+                user=user,
+                password=password,
+                dbname=db_name,
+                connect_timeout=CONNECT_TIMEOUT,
+                options=timeout_options(),
+            ),
         )
         cursor = conn.cursor()
 
         # Get a list of non template databases
-        cursor.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
+        cursor.execute(DATABASES_QUERY)
         databases = [db[0] for db in cursor.fetchall()]
 
         return databases
 
+    except ServerUnavailable:
+        # The server is known to be down, let the caller skip the rest of it
+        raise
+
     except Exception as e:
         function_name = get_databases.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -1,7 +1,11 @@
 import argparse
-import psycopg2
+from collector_state import load_state, save_state
+from dba_pool import DBA_HOST, get_dba_connection, release_dba_connection
 from send_mail import send_mail
 
+# Name the last server list read is saved under in the collector state of DBA001
+SERVERS_STATE_NAME = "active_servers"
+
 
 def get_servers(dba_username, dba_password):
     """
@@ -21,16 +25,17 @@ def get_servers(dba_username, dba_password):
     cursor = None
 
     try:
-        # Connect to the DBA001 server
-        conn = psycopg2.connect(
-            host="DBA001", user=dba_username, password=dba_password, dbname="dbaadmin"
-        )
+        # Borrow a connection to the DBA001 server
+        conn = get_dba_connection(dba_username, dba_password)
         cursor = conn.cursor()
 
         # Get a list of active servers from the dba.servers table
         cursor.execute("SELECT server_name FROM dba.servers WHERE server_status = 1")
         server_list = [db[0] for db in cursor.fetchall()]
 
+        # Keep the list for runs that start while DBA001 is down
+        save_state(DBA_HOST, None, SERVERS_STATE_NAME, {"servers": server_list})
+
         return server_list
 
     except Exception as e:
@@ -50,7 +55,18 @@ def get_servers(dba_username, dba_password):
         if cursor is not None:
             cursor.close()
         if conn is not None:
-            conn.close()
+            release_dba_connection(conn)
+
+
+def cached_servers():
+    """
+    Get the active servers as of the last successful get_servers.
+
+    Returns:
+        list: The server names, or an empty list if get_servers never succeeded.
+    """
+    state = load_state(DBA_HOST, None, SERVERS_STATE_NAME)
+    return state["servers"] if state is not None else []
 
 
 if __name__ == "__main__":
@@ -1,9 +1,52 @@
 import argparse
-import psycopg2
+from bulk_insert import bulk_insert, get_current_timestamp
+from dba_pool import get_dba_connection, release_dba_connection
 from get_database_sizes import get_database_sizes
 from send_mail import send_mail
 
 
+# Columns of dba.databases, in the order the values are written
+DATABASES_COLUMNS = (
+    "server_name",
+    "database_name",
+    "database_size_bytes",
+    "database_size",
+    "last_updated",
+)
+
+
+def write_database_sizes(cursor_dba, target_server, databases, last_updated=None):
+    """
+    Writes the database sizes for one server into the dba.databases table.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        databases (list): The rows as returned by get_database_sizes.
+        last_updated (datetime, optional): Time to stamp the rows with, such as the start of the run. Defaults to None, the time of the DBA transaction.
+    """
+
+    # Stamp every row with the time of the DBA transaction, unless given one
+    if last_updated is None:
+        last_updated = get_current_timestamp(cursor_dba)
+
+    # Insert into dba.databases table, in whole MB and GB as before
+    rows = (
+        (
+            target_server,
+            db_name,
+            size_bytes // 1024 // 1024,
+            size_bytes // 1024 // 1024 // 1024,
+            last_updated,
+        )
+        for (
+            db_name,
+            size_bytes,
+        ) in databases
+    )
+    bulk_insert(cursor_dba, "dba.databases", DATABASES_COLUMNS, rows)
+
+
 def insert_database_sizes(
     target_server, target_username, target_password, dba_username, dba_password
 ):
@@ -16,6 +59,9 @@ def insert_database_sizes(
         target_password (str): Password for the target PostgreSQL server.
         dba_username (str): Username for the DBA PostgreSQL server.
         dba_password (str): Password for the DBA PostgreSQL server.
+
+    Returns:
+        bool: True if the information was inserted successfully, False otherwise.
     """
 
     # Initialize connection and cursor
@@ -27,33 +73,18 @@ def insert_database_sizes(
         # Get databases and their sizes from the target server
         databases = get_database_sizes(target_server, target_username, target_password)
 
-        # Connect to the DBA001 server
-        conn_dba = psycopg2.connect(
-            host="DBA001",
-            user=dba_username,
-            password=dba_password,
-            dbname="dbaadmin"
-        )
+        # Borrow a connection to the DBA001 server
+        conn_dba = get_dba_connection(dba_username, dba_password)
         cursor_dba = conn_dba.cursor()
 
-        # Insert into dba.database_sizes table
-        for (
-                db_name,
-                size_mb,
-                size_gb
-        ) in databases:
-            cursor_dba.execute(
-                "INSERT INTO dba.databases (server_name, database_name, database_size_bytes, database_size, last_updated) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)",
-                (
-                    target_server,
-                    db_name,
-                    size_mb,
-                    size_gb),
-                )
+        # Insert into dba.databases table
+        write_database_sizes(cursor_dba, target_server, databases)
 
         # Commit after processing all databases for this server
         conn_dba.commit()
 
+        return True
+
     except Exception as e:
         function_name = insert_database_sizes.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -69,12 +100,14 @@ def insert_database_sizes(
         if conn_dba is not None:
             conn_dba.rollback()
 
+        return False
+
     finally:
         # Commit changes and close connection
         if cursor_dba is not None:
             cursor_dba.close()
         if conn_dba is not None:
-            conn_dba.close()
+            release_dba_connection(conn_dba)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
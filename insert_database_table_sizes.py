@@ -1,10 +1,66 @@
 import argparse
-import psycopg2
+from bulk_insert import bulk_insert, get_current_timestamp
+from database_inventory import get_database_inventory
+from dba_pool import get_dba_connection, release_dba_connection
 from get_database_table_sizes import get_database_table_sizes
-from get_databases import get_databases
 from send_mail import send_mail
 
 
+# Columns of dba.tables, in the order the values are written
+TABLES_COLUMNS = (
+    "server_name",
+    "database_name",
+    "schema_name",
+    "table_name",
+    "table_size_bytes",
+    "index_size_bytes",
+    "total_size_bytes",
+    "row_count",
+    "last_updated",
+)
+
+
+def write_database_table_sizes(cursor_dba, target_server, table_sizes, last_updated=None):
+    """
+    Writes the table sizes for one database into the dba.tables table.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        table_sizes (list): The rows as returned by get_database_table_sizes.
+        last_updated (datetime, optional): Time to stamp the rows with, such as the start of the run. Defaults to None, the time of the DBA transaction.
+    """
+
+    # Stamp every row with the time of the DBA transaction, unless given one
+    if last_updated is None:
+        last_updated = get_current_timestamp(cursor_dba)
+
+    # Insert into dba.tables table
+    rows = (
+        (
+            target_server,
+            database_name,
+            schema_name,
+            table_name,
+            table_size,
+            index_size,
+            total_size,
+            row_estimate,
+            last_updated,
+        )
+        for (
+            database_name,
+            schema_name,
+            table_name,
+            table_size,
+            index_size,
+            total_size,
+            row_estimate,
+        ) in table_sizes
+    )
+    bulk_insert(cursor_dba, "dba.tables", TABLES_COLUMNS, rows)
+
+
 def insert_database_table_sizes(
     target_server, target_username, target_password, dba_username, dba_password
 ):
@@ -18,6 +74,9 @@ def insert_database_table_sizes(
         dba_username (str): Username for the DBA PostgreSQL server.
         dba_password (str): Password for the DBA PostgreSQL server.
 
+    Returns:
+        bool: True if the information was inserted successfully, False otherwise.
+
     Raises:
         Exception: An error occurred while connecting to the DBA database.
 
@@ -28,17 +87,12 @@ def insert_database_table_sizes(
     cursor_dba = None
 
     try:
-        # Connect to the DBA001 server
-        conn_dba = psycopg2.connect(
-            host="DBA001",
-            user=dba_username,
-            password=dba_password,
-            dbname="dbaadmin",
-        )
+        # Borrow a connection to the DBA001 server
+        conn_dba = get_dba_connection(dba_username, dba_password)
         cursor_dba = conn_dba.cursor()
 
         # Get databases from the target server
-        databases = get_databases(target_server, target_username, target_password)
+        databases = get_database_inventory(target_server, target_username, target_password)
 
         # Foreach database, get tables and their usage
         for current_database in databases:
@@ -48,33 +102,14 @@ def insert_database_table_sizes(
             )
 
             # Insert into dba.tables table
-            for (
-                database_name,
-                schema_name,
-                table_name,
-                table_size,
-                index_size,
-                total_size,
-                row_estimate,
-            ) in table_sizes:
-                cursor_dba.execute(
-                    "INSERT INTO dba.tables (server_name, database_name, schema_name, table_name, table_size_bytes, index_size_bytes, total_size_bytes, row_count, last_updated) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)",
-                    (
-                        target_server,
-                        database_name,
-                        schema_name,
-                        table_name,
-                        table_size,
-                        index_size,
-                        total_size,
-                        row_estimate,
-                    ),
-                )
-
-        # Commit after processing all databases for this server
-        conn_dba.commit()
+            write_database_table_sizes(cursor_dba, target_server, table_sizes)
+
+            # Commit each database on its own, so a failure keeps the ones already written
+            conn_dba.commit()
         print(f"Successfully inserted data for all databases on server {target_server}")
 
+        return True
+
     except Exception as e:
         function_name = insert_database_table_sizes.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -90,12 +125,14 @@ def insert_database_table_sizes(
         if conn_dba is not None:
             conn_dba.rollback()
 
+        return False
+
     finally:
         # Close connection
         if cursor_dba is not None:
             cursor_dba.close()
         if conn_dba is not None:
-            conn_dba.close()
+            release_dba_connection(conn_dba)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
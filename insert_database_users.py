@@ -1,9 +1,71 @@
 import argparse
-import psycopg2
+from bulk_insert import bulk_insert
+from dba_pool import get_dba_connection, release_dba_connection
 from get_database_users import get_database_users
 from send_mail import send_mail
 
 
+# Columns of dba.users, in the order the values are written
+USERS_COLUMNS = (
+    "server_name",
+    "rolname",
+    "rolsuper",
+    "rolinherit",
+    "rolcreaterole",
+    "rolcreatedb",
+    "rolcanlogin",
+    "rolreplication",
+    "rolconnlimit",
+    "rolvaliduntil",
+    "memberof",
+    "rolconfig",
+)
+
+
+def write_database_users(cursor_dba, target_server, database_users, last_updated=None):
+    """
+    Writes the users of one server into the dba.users table.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        database_users (list): The rows as returned by get_database_users.
+        last_updated (datetime, optional): Not used, dba.users has no timestamp. Defaults to None.
+    """
+
+    # Insert into dba.users table
+    rows = (
+        (
+            target_server,
+            rolname,
+            rolsuper,
+            rolinherit,
+            rolcreaterole,
+            rolcreatedb,
+            rolcanlogin,
+            rolreplication,
+            rolconnlimit,
+            rolvaliduntil,
+            memberof,
+            rolconfig,
+        )
+        for (
+            rolname,
+            rolsuper,
+            rolinherit,
+            rolcreaterole,
+            rolcreatedb,
+            rolcanlogin,
+            rolreplication,
+            rolconnlimit,
+            rolvaliduntil,
+            memberof,
+            rolconfig,
+        ) in database_users
+    )
+    bulk_insert(cursor_dba, "dba.users", USERS_COLUMNS, rows)
+
+
 def insert_database_users(
     target_server, target_username, target_password, dba_username, dba_password
 ):
@@ -16,6 +78,9 @@ def insert_database_users(
         target_password (str): Password for the target PostgreSQL server.
         dba_username (str): Username for the DBA PostgreSQL server.
         dba_password (str): Password for the DBA PostgreSQL server.
+
+    Returns:
+        bool: True if the information was inserted successfully, False otherwise.
     """
 
     # Initialize connection and cursor
@@ -23,13 +88,8 @@ def insert_database_users(
     cursor_dba = None
 
     try:
-        # Connect to the DBA001 server
-        conn_dba = psycopg2.connect(
-            host="DBA001",
-            user=dba_username,
-            password=dba_password,
-            dbname="dbaadmin",
-        )
+        # Borrow a connection to the DBA001 server
+        conn_dba = get_dba_connection(dba_username, dba_password)
         cursor_dba = conn_dba.cursor()
 
         # Get database users from the target server
@@ -38,39 +98,12 @@ def insert_database_users(
         )
 
         # Insert into dba.users table
-        for (
-            rolname,
-            rolsuper,
-            rolinherit,
-            rolcreaterole,
-            rolcreatedb,
-            rolcanlogin,
-            rolreplication,
-            rolconnlimit,
-            rolvaliduntil,
-            memberof,
-            rolconfig,
-        ) in database_users:
-            cursor_dba.execute(
-                "INSERT INTO dba.users(server_name, rolname, rolsuper, rolinherit, rolcreaterole, rolcreatedb, rolcanlogin, rolreplication, rolconnlimit, rolvaliduntil, memberof, rolconfig) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s )",
-                (
-                    target_server,
-                    rolname,
-                    rolsuper,
-                    rolinherit,
-                    rolcreaterole,
-                    rolcreatedb,
-                    rolcanlogin,
-                    rolreplication,
-                    rolconnlimit,
-                    rolvaliduntil,
-                    memberof,
-                    rolconfig,
-                ),
-            )
+        write_database_users(cursor_dba, target_server, database_users)
         # Commit after processing all databases for this server
         conn_dba.commit()
 
+        return True
+
     except Exception as e:
         function_name = insert_database_users.__name__
         error_message = f"An error occurred in {function_name}. The error is  {e}"
@@ -86,12 +119,14 @@ def insert_database_users(
         if conn_dba is not None:
             conn_dba.rollback()
 
+        return False
+
     finally:
         # Commit changes and close connection
         if cursor_dba is not None:
             cursor_dba.close()
         if conn_dba is not None:
-            conn_dba.close()
+            release_dba_connection(conn_dba)
 
 
 if __name__ == "__main__":
@@ -1,33 +1,299 @@
 from dotenv import dotenv_values
 import argparse
-from get_servers import get_servers
-from insert_database_index_sizes import insert_database_index_sizes
-from insert_database_index_usage import insert_database_index_usage
-from insert_database_sizes import insert_database_sizes
-from insert_database_table_sizes import insert_database_table_sizes
-from insert_database_table_usage import insert_database_table_usage
-from insert_database_grants import insert_database_grants
-from insert_database_users import insert_database_users
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from async_collect_server import (
+    ASYNC_GLOBAL_CONCURRENCY,
+    ASYNC_SERVER_CONCURRENCY,
+    collect_servers_async,
+)
+from collect_server import collect_server
+from collection_budget import add_budget_arguments, budget_from_args
+from collection_runs import finish_collection_run, start_collection_run
+from collection_timings import (
+    TIMINGS_LOG,
+    print_timing_summary,
+    start_timings,
+    write_collection_timings,
+)
+from database_inventory import invalidate_database_inventory
+from dba_pool import DBA_POOL_MIN_CONNECTIONS, close_dba_pools, init_dba_pool
+from dba_spool import Spool, pending_segments, start_spool_drainer
+from get_servers import cached_servers, get_servers
+from replica_routing import route_collectors
+from send_mail import flush_notifications
 
+# Options the asyncio engine does not implement, by their command line flag
+ASYNC_UNSUPPORTED_OPTIONS = {
+    "itersize": "--itersize",
+    "deltas": "--deltas",
+    "changes_only": "--changes-only",
+    "pipeline": "--pipeline",
+    "use_copy": "--copy",
+}
 
-def process_servers(dba_username, dba_password):
+
+def process_server(
+    server,
+    current_username,
+    current_password,
+    dba_username,
+    dba_password,
+    itersize=None,
+    deltas=False,
+    changes_only=False,
+    pipeline=False,
+    use_copy=False,
+    estimate_sizes=None,
+    run=None,
+    spool=None,
+    budget=None,
+    collector_names=None,
+):
+    """
+    Run every collector against a single server.
+    First, get database sizes and users for the server.
+    Next, for each database, get table sizes, table usage, index sizes,
+    index usage and grants on a single connection to that database.
+    If the server has a healthy standby, sizes and catalogs are collected
+    from the standby, except that the collectors of a database stay on the
+    server whenever its usage counters are collected, see replica_routing.
+
+    Args:
+        server (str): Name of the target PostgreSQL server.
+        current_username (str): Username for the target PostgreSQL server.
+        current_password (str): Password for the target PostgreSQL server.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        itersize (int, optional): Stream large collectors, fetching this many rows per round trip. Defaults to None.
+        deltas (bool, optional): Write usage deltas since the previous run. Defaults to False.
+        changes_only (bool, optional): Only write grants, users and indexes that changed. Defaults to False.
+        pipeline (bool, optional): Overlap reading from the target with writing to the DBA database. Defaults to False.
+        use_copy (bool, optional): Copy table sizes and usage rows without parsing them. Defaults to False.
+        estimate_sizes (int, optional): Estimate table sizes, measuring only this many of the largest tables. Defaults to None, measure every table.
+        run (CollectionRun, optional): The run to record completed units in and skip them from. Defaults to None.
+        spool (Spool, optional): The spool to write to instead of the DBA database. Defaults to None.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None, the default timeouts.
+        collector_names (set, optional): Run only these collectors. Defaults to None, every collector.
+
+    Returns:
+        dict: A summary of the server run with the following keys:
+              - server: The name of the server.
+              - collectors: A dict of collector name to True/False success.
+              - elapsed: The number of seconds spent on the server.
+              - error: The error message if the server failed outright, else None.
+    """
+    print(f"Processing server: {server}")
+
+    start_time = time.monotonic()
+    results = {}
+    error = None
+
+    try:
+        for host, route_names in route_collectors(
+            server,
+            current_username,
+            current_password,
+            dba_username,
+            dba_password,
+            collector_names,
+            budget,
+        ):
+            if host != server:
+                print(f"    Collecting {', '.join(sorted(route_names))} from standby {host}")
+            results.update(
+                collect_server(
+                    server,
+                    current_username,
+                    current_password,
+                    dba_username,
+                    dba_password,
+                    itersize=itersize,
+                    deltas=deltas,
+                    changes_only=changes_only,
+                    pipeline=pipeline,
+                    use_copy=use_copy,
+                    estimate_sizes=estimate_sizes,
+                    run=run,
+                    spool=spool,
+                    budget=budget,
+                    collector_names=route_names,
+                    host=host,
+                )
+            )
+    except Exception as e:
+        # Keep one bad server from taking down the rest of the fleet
+        error = str(e)
+        print(f"An error occurred while processing server {server}. The error is  {e}")
+
+    elapsed = time.monotonic() - start_time
+    print(f"    Finished with server: {server} in {elapsed:.1f}s")
+
+    return {
+        "server": server,
+        "collectors": results,
+        "elapsed": elapsed,
+        "error": error,
+    }
+
+
+def print_summary(summaries):
+    """
+    Print a per-server summary of a fleet run.
+
+    Args:
+        summaries (list): A list of summaries as returned by process_server.
+    """
+    print("Summary:")
+    for summary in sorted(summaries, key=lambda s: s["server"]):
+        failed = [
+            name for name, succeeded in summary["collectors"].items() if not succeeded
+        ]
+        if summary["error"] is not None:
+            status = f"ERROR ({summary['error']})"
+        elif failed:
+            status = f"FAILED ({', '.join(failed)})"
+        else:
+            status = "OK"
+        print(f"    {summary['server']}: {status} in {summary['elapsed']:.1f}s")
+
+    failed_servers = [
+        s for s in summaries if s["error"] is not None or not all(s["collectors"].values())
+    ]
+    print(f"Processed {len(summaries)} servers, {len(failed_servers)} with failures.")
+
+
+def unsupported_async_options(**options):
+    """
+    Args:
+        **options: Options of process_servers, by name.
+
+    Returns:
+        list: The flags of the options set that the asyncio engine does not implement.
+    """
+    return [flag for name, flag in ASYNC_UNSUPPORTED_OPTIONS.items() if options.get(name)]
+
+
+def process_servers(
+    dba_username,
+    dba_password,
+    workers=1,
+    itersize=None,
+    deltas=False,
+    changes_only=False,
+    use_asyncio=False,
+    concurrency=ASYNC_GLOBAL_CONCURRENCY,
+    server_concurrency=ASYNC_SERVER_CONCURRENCY,
+    timings_log=TIMINGS_LOG,
+    refresh_inventory=False,
+    pipeline=False,
+    use_copy=False,
+    estimate_sizes=None,
+    resume_run_id=None,
+    use_spool=False,
+    budget=None,
+):
     """
     Import key information from the active servers in the DBA database.
-    First, get database sizes for all databases on the server.
-    Next, get table sizes for all databases on the server.
-    Next, get table usage for all databases on the server.
-    Next, get all users on the server.
-    Finally, get grants for all databases on the server.
+    Servers are processed in parallel by up to `workers` threads. A failure on
+    one server does not affect the others. All workers borrow their DBA
+    connections from one pool holding at most `workers` connections.
+    With use_asyncio, every server is collected as coroutines in one event
+    loop instead, and `workers` only limits the concurrent DBA writes.
+    Every connect, query, fetch and write is timed. The spans are appended to
+    timings_log as JSON lines, written to dba.collection_timings at the end of
+    the run, and summarised after the per-server summary.
+    The database list of each server comes from the inventory cache, see
+    database_inventory, unless refresh_inventory is set.
+    Every run is recorded in dba.collection_runs, and each collector commits
+    on its own together with a progress row. A run that did not complete can
+    be resumed with resume_run_id, skipping the collectors it already wrote.
+    With use_spool, collected rows are appended to a local spool and a
+    background thread drains it into the DBA database, so collection does not
+    wait on DBA001 and carries on if it is down. Whatever is not drained by
+    the end of the run stays in the spool for the next run or dba_spool.py.
+    Every connection and query is bounded by the timeouts of budget. Once its
+    deadline passes no collector starts, and the run can be resumed later.
+    Failure emails are queued while the run goes on and sent as a digest by
+    a background thread, the rest of them once the run ends, see send_mail.
+    The asyncio engine does not stream, pipeline, copy, or write deltas or
+    changes only, so those options cannot be combined with use_asyncio.
 
     Args:
         dba_username (str): Username for the DBA PostgreSQL server.
         dba_password (str): Password for the DBA PostgreSQL server.
+        workers (int, optional): Maximum number of servers processed at once. Defaults to 1.
+        itersize (int, optional): Stream large collectors, fetching this many rows per round trip. Defaults to None.
+        deltas (bool, optional): Write usage deltas since the previous run. Defaults to False.
+        changes_only (bool, optional): Only write grants, users and indexes that changed. Defaults to False.
+        use_asyncio (bool, optional): Use the asyncio engine. Defaults to False.
+        concurrency (int, optional): Maximum target connections in flight with asyncio. Defaults to ASYNC_GLOBAL_CONCURRENCY.
+        server_concurrency (int, optional): Maximum connections in flight per server with asyncio. Defaults to ASYNC_SERVER_CONCURRENCY.
+        timings_log (str, optional): JSON lines file for the timing spans, None for no file. Defaults to TIMINGS_LOG.
+        refresh_inventory (bool, optional): Read pg_database on every server, ignoring the cached database lists. Defaults to False.
+        pipeline (bool, optional): Read the next database of a server while the previous one is written. Defaults to False.
+        use_copy (bool, optional): Copy table sizes and usage rows from the targets without parsing them. Defaults to False.
+        estimate_sizes (int, optional): Estimate table sizes from relpages, measuring only this many of the largest tables per database. Defaults to None, measure every table.
+        resume_run_id (int, optional): Resume an earlier run instead of starting a new one. Defaults to None.
+        use_spool (bool, optional): Write through the local spool instead of straight to the DBA database. Defaults to False.
+        budget (CollectionBudget, optional): The timeouts and deadline of the run. Defaults to None, the default timeouts.
+
+    Returns:
+        list: A list of per-server summaries as returned by process_server.
 
     Raises:
-        Exception: An error occurred while connecting to the DBA database.
+        ValueError: If use_asyncio is combined with an option in ASYNC_UNSUPPORTED_OPTIONS.
     """
+    if use_asyncio:
+        unsupported = unsupported_async_options(
+            itersize=itersize,
+            deltas=deltas,
+            changes_only=changes_only,
+            pipeline=pipeline,
+            use_copy=use_copy,
+        )
+        if unsupported:
+            raise ValueError(f"{', '.join(unsupported)} cannot be used with --asyncio")
+
+    # Share one pool of DBA connections between all workers. With a spool,
+    # DBA001 may be down, so no connection is opened up front.
+    init_dba_pool(
+        dba_username,
+        dba_password,
+        minconn=0 if use_spool else DBA_POOL_MIN_CONNECTIONS,
+        maxconn=max(1, workers),
+    )
+    start_timings(timings_log)
+
+    spool = None
+    if use_spool:
+        spool = Spool()
+        drainer, stop_drainer = start_spool_drainer(dba_username, dba_password, spool)
+
+    # Record the run, or pick up where an earlier one stopped
+    try:
+        run = start_collection_run(dba_username, dba_password, resume_run_id)
+        if resume_run_id is None:
+            print(f"Collection run {run.run_id}")
+        else:
+            print(f"Resuming collection run {run.run_id}, {len(run.completed)} collectors already complete")
+    except Exception as e:
+        # The spool can take the rows while DBA001 is down, but not the ledger
+        if spool is None or resume_run_id is not None:
+            raise
+        print(f"Collecting without a run ledger. The error is  {e}")
+        run = None
+
     # Get servers from the DBA database
     servers = get_servers(dba_username, dba_password)
+    if not servers and spool is not None:
+        servers = cached_servers()
+        print(f"Using the last known list of {len(servers)} servers")
+
+    if refresh_inventory:
+        for server in servers:
+            invalidate_database_inventory(server)
 
     # Load the .env file
     env_values = dotenv_values(".env")
@@ -36,46 +302,79 @@ def process_servers(dba_username, dba_password):
     current_username = env_values["DB_USERNAME"]
     current_password = env_values["DB_PASSWORD"]
 
-    # Foreach server, process it
-    for server in servers:
-        print(f"Processing server: {server}")
+    summaries = []
 
-        # Get database sizes for all databases on the server
-        insert_database_sizes(
-            server, current_username, current_password, dba_username, dba_password
+    if use_asyncio:
+        summaries = asyncio.run(
+            collect_servers_async(
+                servers,
+                current_username,
+                current_password,
+                dba_username,
+                dba_password,
+                concurrency,
+                server_concurrency,
+                run,
+                spool,
+                budget,
+                estimate_sizes,
+            )
         )
+    else:
+        # Foreach server, process it
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(
+                    process_server,
+                    server,
+                    current_username,
+                    current_password,
+                    dba_username,
+                    dba_password,
+                    itersize,
+                    deltas,
+                    changes_only,
+                    pipeline,
+                    use_copy,
+                    estimate_sizes,
+                    run,
+                    spool,
+                    budget,
+                )
+                for server in servers
+            ]
+            for future in as_completed(futures):
+                summaries.append(future.result())
 
-        # Next, get table sizes for all databases on the server
-        insert_database_table_sizes(
-            server, current_username, current_password, dba_username, dba_password
-        )
+    run_succeeded = all(
+        summary["error"] is None and all(summary["collectors"].values())
+        for summary in summaries
+    )
+    if run is not None:
+        finish_collection_run(dba_username, dba_password, run, run_succeeded)
 
-        # next, get table usage for all databases on the server
-        insert_database_table_usage(
-            server, current_username, current_password, dba_username, dba_password
-        )
+    write_collection_timings(dba_username, dba_password, spool)
 
-        # next, get index size for all databases on the server
-        insert_database_index_sizes(
-            server, current_username, current_password, dba_username, dba_password
-        )
+    if spool is not None:
+        # One last drain pass, then leave the rest for the next run
+        stop_drainer.set()
+        drainer.join()
+        segment_count = len(pending_segments(spool.spool_dir))
+        if segment_count:
+            print(f"{segment_count} spool segments left to drain in {spool.spool_dir}")
 
-        # next, get index usage for all databases on the server
-        insert_database_index_usage(
-            server, current_username, current_password, dba_username, dba_password
-        )
+    close_dba_pools()
 
-        # Next, get all users on the server
-        insert_database_users(
-            server, current_username, current_password, dba_username, dba_password
-        )
+    # Mail the failures of the run as one digest
+    flush_notifications()
 
-        # Next, get grants for all databases on the server
-        insert_database_grants(
-            server, current_username, current_password, dba_username, dba_password
-        )
+    print_summary(summaries)
+    print_timing_summary()
+    if run is not None and not run_succeeded:
+        print(f"Resume with --resume {run.run_id}")
+
+    return summaries
 
-        print(f"    Finished with server: {server}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -83,8 +382,115 @@ if __name__ == "__main__":
     )
     parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
     parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of servers to process in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--itersize",
+        type=int,
+        help="Stream large result sets, fetching this many rows per round trip",
+    )
+    parser.add_argument(
+        "--deltas",
+        action="store_true",
+        help="Also write table and index usage deltas since the previous run",
+    )
+    parser.add_argument(
+        "--changes-only",
+        action="store_true",
+        help="Only write grants, users and indexes that changed since the previous run",
+    )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Collect every server as coroutines in one event loop",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=ASYNC_GLOBAL_CONCURRENCY,
+        help=f"Target connections in flight with --asyncio (default: {ASYNC_GLOBAL_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--per-server",
+        type=int,
+        default=ASYNC_SERVER_CONCURRENCY,
+        help=f"Connections in flight per server with --asyncio (default: {ASYNC_SERVER_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--timings-log",
+        default=TIMINGS_LOG,
+        help=f"JSON lines file to append collection timings to (default: {TIMINGS_LOG})",
+    )
+    parser.add_argument(
+        "--refresh-inventory",
+        action="store_true",
+        help="Read the database list of every server again instead of using the cached one",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Read the next database of a server while the previous one is written",
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Copy table sizes and table and index usage from the targets with COPY, without parsing the rows",
+    )
+    parser.add_argument(
+        "--estimate-sizes",
+        type=int,
+        nargs="?",
+        const=0,
+        metavar="EXACT_TOP",
+        help="Estimate table sizes from relpages, measuring only the EXACT_TOP largest tables per database exactly (default: 0)",
+    )
+    parser.add_argument(
+        "--resume",
+        type=int,
+        metavar="RUN_ID",
+        help="Resume an earlier run, skipping the servers, databases and collectors it completed",
+    )
+    parser.add_argument(
+        "--spool",
+        action="store_true",
+        help="Write collected rows to a local spool, drained into the DBA database in the background",
+    )
+    add_budget_arguments(parser)
 
     args = parser.parse_args()
 
+    if args.asyncio:
+        unsupported_flags = unsupported_async_options(
+            itersize=args.itersize,
+            deltas=args.deltas,
+            changes_only=args.changes_only,
+            pipeline=args.pipeline,
+            use_copy=args.copy,
+        )
+        if unsupported_flags:
+            parser.error(f"{', '.join(unsupported_flags)} cannot be used with --asyncio")
+
     # Process servers from the DBA database
-    process_servers(args.dba_username, args.dba_password)
+    process_servers(
+        args.dba_username,
+        args.dba_password,
+        args.workers,
+        args.itersize,
+        args.deltas,
+        args.changes_only,
+        args.asyncio,
+        args.concurrency,
+        args.per_server,
+        args.timings_log,
+        args.refresh_inventory,
+        args.pipeline,
+        args.copy,
+        args.estimate_sizes,
+        args.resume,
+        args.spool,
+        budget_from_args(args),
+    )
@@ -0,0 +1,276 @@
+import argparse
+import os
+import threading
+import time
+import psycopg2
+from circuit_breaker import ServerUnavailable, connect_with_retry
+from collection_budget import COLLECTOR_PRIORITIES, CONNECT_TIMEOUT, timeout_options
+from dba_pool import get_dba_connection, release_dba_connection
+
+# Collectors that read sizes and catalogs, which are the same on a physical
+# standby as on its primary. Usage counters are only kept by the primary.
+REPLICA_COLLECTORS = {
+    "insert_database_sizes",
+    "insert_database_users",
+    "insert_database_table_sizes",
+    "insert_database_index_sizes",
+    "insert_database_grants",
+}
+
+# Collectors that read one snapshot of each database together, see
+# collect_server.begin_snapshot. They run on one host, so sizes and usage
+# counters are of the same moment.
+DATABASE_SNAPSHOT_COLLECTORS = {
+    "insert_database_table_sizes",
+    "insert_database_table_usage",
+    "insert_database_index_sizes",
+    "insert_database_index_usage",
+    "insert_database_grants",
+}
+
+# Seconds of replay lag above which a standby is not collected from.
+# PGINFO_MAX_REPLICA_LAG overrides it.
+MAX_REPLICA_LAG = float(os.environ.get("PGINFO_MAX_REPLICA_LAG", "300"))
+
+# Seconds the health of a standby is trusted before it is checked again
+REPLICA_CHECK_INTERVAL = 60
+
+# Seconds the standby list read from dba.server_replicas is trusted
+REPLICA_LIST_TTL = 600
+
+# Active standbys of each server, most preferred first
+REPLICAS_QUERY = """
+    SELECT server_name, replica_host
+    FROM dba.server_replicas
+    WHERE replica_status = 1
+    ORDER BY server_name, priority, replica_host;
+    """
+
+# Whether the host is a standby, and its replay lag in seconds. A streaming
+# standby that has replayed everything it received is not lagging however
+# long the primary has been idle. Without pg_monitor or pg_read_all_stats
+# the WAL receiver is not visible and the last replay time is used instead.
+STANDBY_QUERY = """
+    SELECT pg_is_in_recovery(),
+           CASE
+               WHEN NOT pg_is_in_recovery() THEN NULL
+               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                    AND EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming')
+                   THEN 0
+               ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+           END;
+    """
+
+# Standbys of each server, shared by every thread
+_replicas = {}
+_replicas_loaded_at = None
+_replicas_lock = threading.Lock()
+
+# Health of each standby host as (checked at, reason it is not usable or None)
+_health = {}
+_health_lock = threading.Lock()
+
+
+def get_replicas(dba_username, dba_password, ttl=REPLICA_LIST_TTL):
+    """
+    Get the standbys of every server from dba.server_replicas. The list is
+    read again once it is older than ttl seconds. If it cannot be read, the
+    last list read is kept, and every collector goes to the primaries if
+    there is none.
+
+    Args:
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        ttl (int, optional): Maximum age of the list in seconds. Defaults to REPLICA_LIST_TTL.
+
+    Returns:
+        dict: Server name to its standby host names, most preferred first.
+    """
+    global _replicas, _replicas_loaded_at
+
+    with _replicas_lock:
+        if _replicas_loaded_at is not None and time.monotonic() - _replicas_loaded_at < ttl:
+            return _replicas
+
+        conn = None
+        cursor = None
+        try:
+            conn = get_dba_connection(dba_username, dba_password)
+            cursor = conn.cursor()
+            cursor.execute(REPLICAS_QUERY)
+            replicas = {}
+            for server_name, replica_host in cursor.fetchall():
+                replicas.setdefault(server_name, []).append(replica_host)
+            conn.rollback()
+            _replicas = replicas
+        except Exception as e:
+            print(
+                f"Could not read dba.server_replicas, keeping the last standby list. The error is  {e}"
+            )
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if conn is not None:
+                release_dba_connection(conn)
+
+        # Not read again until the ttl is up, even after a failure
+        _replicas_loaded_at = time.monotonic()
+        return _replicas
+
+
+def check_standby(
+    replica_host, user, password, maintenance_db="postgres", budget=None, max_lag=MAX_REPLICA_LAG
+):
+    """
+    Check that a host is a standby that is not lagging. The result is trusted
+    for REPLICA_CHECK_INTERVAL seconds. A standby whose circuit breaker is
+    open is not connected to.
+
+    Args:
+        replica_host (str): Host name of the standby.
+        user (str): Username for the standby.
+        password (str): Password for the standby.
+        maintenance_db (str, optional): Database to connect to. Defaults to 'postgres'.
+        budget (CollectionBudget, optional): The connect timeout and deadline of the run. Defaults to None.
+        max_lag (float, optional): Seconds of replay lag allowed. Defaults to MAX_REPLICA_LAG.
+
+    Returns:
+        str: Why the standby cannot be collected from, or None if it can.
+    """
+    with _health_lock:
+        health = _health.get(replica_host)
+    if health is not None and time.monotonic() - health[0] < REPLICA_CHECK_INTERVAL:
+        return health[1]
+
+    connect_timeout = budget.connect_seconds() if budget is not None else CONNECT_TIMEOUT
+    conn = None
+    try:
+        conn = connect_with_retry(
+            replica_host,
+            lambda: psycopg2.connect(
+                host=replica_host,
+                user=user,
+                password=password,
+                dbname=maintenance_db,
+                connect_timeout=connect_timeout,
+                options=timeout_options(),
+            ),
+            attempts=1,
+            budget=budget,
+        )
+        cursor = conn.cursor()
+        cursor.execute(STANDBY_QUERY)
+        in_recovery, lag = cursor.fetchone()
+        cursor.close()
+
+        if not in_recovery:
+            reason = "not a standby"
+        elif lag is None or lag > max_lag:
+            reason = "replay lag unknown" if lag is None else f"{lag:.0f}s replay lag"
+        else:
+            reason = None
+    except (ServerUnavailable, psycopg2.Error) as e:
+        reason = str(e).strip()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    with _health_lock:
+        _health[replica_host] = (time.monotonic(), reason)
+    return reason
+
+
+def choose_standby(target_server, user, password, dba_username, dba_password, budget=None):
+    """
+    Args:
+        target_server (str): Name of the target PostgreSQL server, as in dba.servers.
+        user (str): Username for the target and its standbys.
+        password (str): Password for the target and its standbys.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        budget (CollectionBudget, optional): The connect timeout and deadline of the run. Defaults to None.
+
+    Returns:
+        str: The first healthy standby of the server, or None if it has none.
+    """
+    for replica_host in get_replicas(dba_username, dba_password).get(target_server, []):
+        reason = check_standby(replica_host, user, password, budget=budget)
+        if reason is None:
+            return replica_host
+        print(f"    Not collecting {target_server} from standby {replica_host}: {reason}")
+
+    return None
+
+
+def route_collectors(
+    target_server,
+    user,
+    password,
+    dba_username,
+    dba_password,
+    collector_names,
+    budget=None,
+):
+    """
+    Split the collectors of a server between its primary and a healthy
+    standby. Collectors in REPLICA_COLLECTORS go to the standby, the rest to
+    the primary. The collectors in DATABASE_SNAPSHOT_COLLECTORS are kept on
+    one host: if usage counters are collected from the primary, table
+    sizes, index sizes and grants are too, so every collector of a database
+    reads the same snapshot. Without a healthy standby everything goes to
+    the primary.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server, as in dba.servers.
+        user (str): Username for the target and its standbys.
+        password (str): Password for the target and its standbys.
+        dba_username (str): Username for the DBA PostgreSQL server.
+        dba_password (str): Password for the DBA PostgreSQL server.
+        collector_names (set): Names of the collectors to run, or None for every collector.
+        budget (CollectionBudget, optional): The connect timeout and deadline of the run. Defaults to None.
+
+    Returns:
+        list: (host, collector names) pairs, one per host to connect to.
+    """
+    names = set(COLLECTOR_PRIORITIES) if collector_names is None else collector_names
+    replica_names = names & REPLICA_COLLECTORS
+    if (names & DATABASE_SNAPSHOT_COLLECTORS) - REPLICA_COLLECTORS:
+        # Usage counters are only on the primary, keep the snapshot with them
+        replica_names -= DATABASE_SNAPSHOT_COLLECTORS
+    if not replica_names:
+        return [(target_server, collector_names)]
+
+    replica_host = choose_standby(
+        target_server, user, password, dba_username, dba_password, budget
+    )
+    if replica_host is None:
+        return [(target_server, collector_names)]
+
+    routes = [(replica_host, replica_names)]
+    if names - replica_names:
+        routes.append((target_server, names - replica_names))
+    return routes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show where the collectors of a server would run."
+    )
+    parser.add_argument("target_server", help="Name of the target PostgreSQL server")
+    parser.add_argument("target_username", help="Username for the target and its standbys")
+    parser.add_argument("target_password", help="Password for the target and its standbys")
+    parser.add_argument("dba_username", help="Username for the DBA PostgreSQL server")
+    parser.add_argument("dba_password", help="Password for the DBA PostgreSQL server")
+
+    args = parser.parse_args()
+
+    routes = route_collectors(
+        args.target_server,
+        args.target_username,
+        args.target_password,
+        args.dba_username,
+        args.dba_password,
+        None,
+    )
+    for host, collector_names in routes:
+        print(f"{host}: {', '.join(sorted(collector_names or COLLECTOR_PRIORITIES))}")
@@ -1,24 +1,50 @@
+import atexit
+import os
+import queue
 import smtplib
+import threading
+import time
+from collections import deque
+from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+# Use your SMTP server and port 587 or 25
+SMTP_SERVER = "smtp.example.com"
+SMTP_PORT = 587
 
-def send_mail(
-    subject,
-    body,
-    to_email,
-    from_email="your_email@example.com",
-    password="your_password",
-):
-    """
-    Sends a plain text email with the given subject and body to the specified recipient.
+# Default sender of every email
+FROM_EMAIL = "your_email@example.com"
+FROM_PASSWORD = "your_password"
+
+# Seconds between digests while a run goes on. Whatever is left is sent when
+# the run ends, see flush_notifications. PGINFO_MAIL_INTERVAL overrides it.
+MAIL_DIGEST_INTERVAL = float(os.environ.get("PGINFO_MAIL_INTERVAL", "300"))
 
+# Digests each recipient gets per hour at most. Failures past the limit wait
+# for the next digest. PGINFO_MAIL_PER_HOUR overrides it.
+MAIL_MAX_PER_HOUR = int(os.environ.get("PGINFO_MAIL_PER_HOUR", "6"))
+
+# Distinct failures listed in one digest, the rest are only counted
+MAIL_DIGEST_MAX_ERRORS = 100
+
+# Seconds the SMTP session is kept open after its last email
+MAIL_IDLE_SECONDS = 60
+
+# Seconds flush_notifications waits for the digests to go out
+MAIL_FLUSH_TIMEOUT = 60
+
+
+def build_message(subject, body, to_email, from_email=FROM_EMAIL):
+    """
     Args:
         subject (str): Email subject.
         body (str): Email body.
         to_email (str): Email address of the recipient.
-        from_email (str): Email address of the sender.
-        password (str): Password for the sender's email address.
+        from_email (str, optional): Email address of the sender. Defaults to FROM_EMAIL.
+
+    Returns:
+        MIMEMultipart: A plain text email.
     """
     msg = MIMEMultipart()
     msg["From"] = from_email
@@ -27,22 +53,326 @@ def send_mail(
 
     msg.attach(MIMEText(body, "plain"))
 
+    return msg
+
+
+def open_smtp_session(from_email=FROM_EMAIL, password=FROM_PASSWORD):
+    """
+    Args:
+        from_email (str, optional): Email address of the sender. Defaults to FROM_EMAIL.
+        password (str, optional): Password for the sender's email address. Defaults to FROM_PASSWORD.
+
+    Returns:
+        smtplib.SMTP: A logged in SMTP session.
+    """
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+    server.starttls()
+
+    # Depending on your email setup, a password may not be required
+    server.login(from_email, password)
+
+    return server
+
+
+def send_mail_now(
+    subject,
+    body,
+    to_email,
+    from_email=FROM_EMAIL,
+    password=FROM_PASSWORD,
+):
+    """
+    Sends a plain text email with the given subject and body to the specified
+    recipient right away, over its own SMTP session.
+
+    Args:
+        subject (str): Email subject.
+        body (str): Email body.
+        to_email (str): Email address of the recipient.
+        from_email (str): Email address of the sender.
+        password (str): Password for the sender's email address.
+    """
     try:
-        server = smtplib.SMTP(
-            "smtp.example.com", 587
-        )  # Use your SMTP server and port 587 or 25
-        server.starttls()
-
-        # Depending on your email setup, a password may not be required 1
-        server.login(from_email, password)
-        text = msg.as_string()
-        server.sendmail(from_email, to_email, text)
+        server = open_smtp_session(from_email, password)
+        msg = build_message(subject, body, to_email, from_email)
+        server.sendmail(from_email, to_email, msg.as_string())
         server.quit()
         print("Email sent successfully!")
     except Exception as e:
         print(f"Failed to send email: {e}")
 
 
+class MailNotifier:
+    """
+    Sends failure emails from a background thread. Each email is queued and
+    the caller carries on at once. Identical emails to a recipient are
+    counted instead of repeated, and everything queued for a recipient goes
+    out as one digest every MAIL_DIGEST_INTERVAL seconds and when the run is
+    flushed, up to MAIL_MAX_PER_HOUR digests an hour. One SMTP session is
+    kept open and reused for every digest until it is idle.
+    """
+
+    def __init__(self, interval=MAIL_DIGEST_INTERVAL, max_per_hour=MAIL_MAX_PER_HOUR):
+        self.interval = interval
+        self.max_per_hour = max_per_hour
+        self.queue = queue.Queue()
+        # (from_email, password, to_email) to {(subject, body): [count, first seen]}
+        self.pending = {}
+        self.sent_at = {}
+        self.session = None
+        self.session_sender = None
+        self.session_used_at = None
+        self.next_digest_at = time.monotonic() + interval
+        self.thread = threading.Thread(target=self.run, name="pginfo-mail", daemon=True)
+        self.thread.start()
+
+    def notify(self, subject, body, to_email, from_email=FROM_EMAIL, password=FROM_PASSWORD):
+        """
+        Queue an email for the next digest.
+
+        Args:
+            subject (str): Email subject.
+            body (str): Email body.
+            to_email (str): Email address of the recipient.
+            from_email (str, optional): Email address of the sender. Defaults to FROM_EMAIL.
+            password (str, optional): Password for the sender's email address. Defaults to FROM_PASSWORD.
+        """
+        self.queue.put(((from_email, password, to_email), (subject, body), datetime.now()))
+
+    def flush(self, timeout=MAIL_FLUSH_TIMEOUT):
+        """
+        Send everything queued so far, within the hourly limit, and close the SMTP session.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the digests. Defaults to MAIL_FLUSH_TIMEOUT.
+
+        Returns:
+            bool: True if the digests were sent or dropped in time, False otherwise.
+        """
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def run(self):
+        """
+        Background thread. Collect queued emails and send the digests when due.
+        """
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                item = None
+
+            try:
+                if isinstance(item, threading.Event):
+                    # Every email queued before the flush has been added by now
+                    try:
+                        self.send_digests(final=True)
+                        self.close_session()
+                    finally:
+                        item.set()
+                    continue
+
+                if item is not None:
+                    self.add(*item)
+                if time.monotonic() >= self.next_digest_at:
+                    self.send_digests(final=False)
+                if (
+                    self.session is not None
+                    and time.monotonic() - self.session_used_at >= MAIL_IDLE_SECONDS
+                ):
+                    self.close_session()
+            except Exception as e:
+                print(f"Failed to send email: {e}")
+
+    def add(self, key, message, queued_at):
+        """
+        Count one queued email against its recipient.
+
+        Args:
+            key (tuple): The sender, password and recipient.
+            message (tuple): The subject and body.
+            queued_at (datetime): When the email was queued.
+        """
+        errors = self.pending.setdefault(key, {})
+        if message in errors:
+            errors[message][0] += 1
+        else:
+            errors[message] = [1, queued_at]
+
+    def within_limit(self, to_email):
+        """
+        Args:
+            to_email (str): Email address of the recipient.
+
+        Returns:
+            bool: True if the recipient may get another digest this hour.
+        """
+        sent_at = self.sent_at.setdefault(to_email, deque())
+        hour_ago = time.monotonic() - 3600
+        while sent_at and sent_at[0] < hour_ago:
+            sent_at.popleft()
+        return len(sent_at) < self.max_per_hour
+
+    def send_digests(self, final):
+        """
+        Send one digest to each recipient with queued emails.
+
+        Args:
+            final (bool): Drop what cannot be sent now instead of keeping it for the next digest.
+        """
+        self.next_digest_at = time.monotonic() + self.interval
+
+        for key, errors in list(self.pending.items()):
+            from_email, password, to_email = key
+            count = sum(error_count for error_count, _ in errors.values())
+
+            if not self.within_limit(to_email):
+                if final:
+                    print(
+                        f"Not emailing {count} failures to {to_email}, "
+                        f"{self.max_per_hour} emails an hour reached"
+                    )
+                    del self.pending[key]
+                continue
+
+            subject, body = digest(errors)
+            try:
+                session = self.get_session(from_email, password)
+                msg = build_message(subject, body, to_email, from_email)
+                session.sendmail(from_email, to_email, msg.as_string())
+                self.session_used_at = time.monotonic()
+            except Exception as e:
+                print(f"Failed to send email: {e}")
+                self.close_session()
+                if final:
+                    print(f"Not emailing {count} failures to {to_email}")
+                    del self.pending[key]
+                continue
+
+            self.sent_at[to_email].append(time.monotonic())
+            del self.pending[key]
+            print(f"Email sent successfully! {count} failures to {to_email}")
+
+    def get_session(self, from_email, password):
+        """
+        Args:
+            from_email (str): Email address of the sender.
+            password (str): Password for the sender's email address.
+
+        Returns:
+            smtplib.SMTP: The open SMTP session if it still answers, otherwise a new one.
+        """
+        if self.session is not None and self.session_sender == (from_email, password):
+            try:
+                if self.session.noop()[0] == 250:
+                    return self.session
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.close_session()
+
+        self.session = open_smtp_session(from_email, password)
+        self.session_sender = (from_email, password)
+        self.session_used_at = time.monotonic()
+        return self.session
+
+    def close_session(self):
+        """
+        Log out of the SMTP session, if one is open.
+        """
+        if self.session is None:
+            return
+        try:
+            self.session.quit()
+        except Exception:
+            self.session.close()
+        self.session = None
+        self.session_sender = None
+
+
+def digest(errors):
+    """
+    Args:
+        errors (dict): (subject, body) to [count, first seen] of the queued emails to one recipient.
+
+    Returns:
+        tuple: The subject and body of the digest. A single email is sent as it is.
+    """
+    if len(errors) == 1:
+        (subject, body), (count, _) = next(iter(errors.items()))
+        if count == 1:
+            return subject, body
+
+    count = sum(error_count for error_count, _ in errors.values())
+    lines = [f"{count} failures, {len(errors)} distinct.", ""]
+    for (subject, body), (error_count, first_seen) in list(errors.items())[:MAIL_DIGEST_MAX_ERRORS]:
+        lines.append(f"{subject} ({error_count}x, first at {first_seen:%Y-%m-%d %H:%M:%S})")
+        lines.append(body)
+        lines.append("")
+    if len(errors) > MAIL_DIGEST_MAX_ERRORS:
+        lines.append(f"... and {len(errors) - MAIL_DIGEST_MAX_ERRORS} more distinct failures")
+
+    return f"Failure digest: {count} failures, {len(errors)} distinct", "\n".join(lines)
+
+
+# Notifier of this process, started by the first email
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """
+    Returns:
+        MailNotifier: The notifier of this process. What it holds is flushed at exit.
+    """
+    global _notifier
+
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = MailNotifier()
+            atexit.register(flush_notifications)
+        return _notifier
+
+
+def send_mail(
+    subject,
+    body,
+    to_email,
+    from_email=FROM_EMAIL,
+    password=FROM_PASSWORD,
+):
+    """
+    Queues a plain text email with the given subject and body to the specified
+    recipient, and returns at once. It is sent with the next digest, see MailNotifier.
+
+    Args:
+        subject (str): Email subject.
+        body (str): Email body.
+        to_email (str): Email address of the recipient.
+        from_email (str): Email address of the sender.
+        password (str): Password for the sender's email address.
+    """
+    get_notifier().notify(subject, body, to_email, from_email, password)
+
+
+def flush_notifications(timeout=MAIL_FLUSH_TIMEOUT):
+    """
+    Send the digest of every email queued so far, for example at the end of a run.
+
+    Args:
+        timeout (float, optional): Seconds to wait for the digests. Defaults to MAIL_FLUSH_TIMEOUT.
+
+    Returns:
+        bool: True if nothing was left to send when it returned, False otherwise.
+    """
+    with _notifier_lock:
+        notifier = _notifier
+    if notifier is None:
+        return True
+
+    return notifier.flush(timeout)
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -54,4 +384,4 @@ if __name__ == "__main__":
     parser.add_argument("to_email", help="Recipient email address")
     args = parser.parse_args()
 
-    send_mail(args.subject, args.body, args.to_email)
+    send_mail_now(args.subject, args.body, args.to_email)
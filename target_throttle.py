@@ -0,0 +1,398 @@
+import argparse
+import asyncio
+import os
+import threading
+import time
+import psycopg2
+from collection_budget import CONNECT_TIMEOUT, CollectionBudget, timeout_options
+
+# Active sessions on a target above which heavy collectors wait.
+# PGINFO_MAX_ACTIVE_SESSIONS overrides it.
+MAX_ACTIVE_SESSIONS = int(os.environ.get("PGINFO_MAX_ACTIVE_SESSIONS", "16"))
+
+# Active sessions waiting on I/O above which heavy collectors wait.
+# PGINFO_MAX_IO_WAITS overrides it.
+MAX_IO_WAITS = int(os.environ.get("PGINFO_MAX_IO_WAITS", "4"))
+
+# Blocks read per second across every database of a target above which
+# heavy collectors wait, 0 for no limit. PGINFO_MAX_BLOCK_READS overrides it.
+MAX_BLOCK_READS = float(os.environ.get("PGINFO_MAX_BLOCK_READS", "20000"))
+
+# Fraction of max_connections in use above which heavy collectors wait
+MAX_CONNECTION_USE = 0.9
+
+# Fraction of max_connections the collectors may use on one target at a
+# time, at least one session. PGINFO_SESSION_FRACTION overrides it.
+SESSION_FRACTION = float(os.environ.get("PGINFO_SESSION_FRACTION", "0.05"))
+
+# Seconds a sample of the load of a target is trusted
+SAMPLE_INTERVAL = 10
+
+# Seconds a run waits in all for a busy target to quiet down, across every
+# heavy collector and database of the target. Once spent, heavy collectors on
+# the target are postponed. PGINFO_THROTTLE_WAIT overrides it.
+THROTTLE_MAX_WAIT = float(os.environ.get("PGINFO_THROTTLE_WAIT", "60"))
+
+# Collectors that stat every table or index file of a database
+HEAVY_COLLECTORS = {"insert_database_table_sizes", "insert_database_index_sizes"}
+
+# Load of the target: active sessions besides this one, active sessions
+# waiting on I/O, client sessions, max_connections and blocks read so far.
+# Without pg_monitor or pg_read_all_stats only the sessions of the
+# collecting role are seen.
+LOAD_QUERY = """
+    SELECT count(*) FILTER (WHERE state = 'active' AND pid <> pg_backend_pid()),
+           count(*) FILTER (WHERE state = 'active' AND wait_event_type = 'IO'),
+           count(*),
+           current_setting('max_connections')::integer,
+           (SELECT sum(blks_read) FROM pg_stat_database)
+    FROM pg_stat_activity
+    WHERE backend_type = 'client backend';
+    """
+
+
+class TargetBusy(Exception):
+    """
+    Raised for heavy collectors postponed because their target stayed busy.
+    """
+
+
+class TargetThrottle:
+    """
+    The last sampled load of one target server. Heavy collectors run only
+    while the target is below every threshold, and the collectors use at
+    most a fraction of its max_connections at a time. Threads reserve the
+    sessions they hold at once up front, see acquire_sessions.
+    """
+
+    def __init__(
+        self,
+        server_name,
+        max_active_sessions=MAX_ACTIVE_SESSIONS,
+        max_io_waits=MAX_IO_WAITS,
+        max_block_reads=MAX_BLOCK_READS,
+        session_fraction=SESSION_FRACTION,
+    ):
+        self.server_name = server_name
+        self.max_active_sessions = max_active_sessions
+        self.max_io_waits = max_io_waits
+        self.max_block_reads = max_block_reads
+        self.session_fraction = session_fraction
+        self.active_sessions = None
+        self.io_waits = None
+        self.sessions = None
+        self.max_connections = None
+        self.blocks_read = None
+        self.block_read_rate = None
+        self.sampled_at = None
+        self.reserved_sessions = 0
+        self.lock = threading.Lock()
+        self.sessions_free = threading.Condition(self.lock)
+
+    def needs_sample(self):
+        """
+        Returns:
+            bool: True if the last sample is older than SAMPLE_INTERVAL.
+        """
+        with self.lock:
+            if self.sampled_at is None:
+                return True
+            return time.monotonic() - self.sampled_at >= SAMPLE_INTERVAL
+
+    def record(self, row):
+        """
+        Record a sample of the load.
+
+        Args:
+            row (tuple): The row returned by LOAD_QUERY.
+        """
+        active_sessions, io_waits, sessions, max_connections, blocks_read = row
+        now = time.monotonic()
+
+        with self.lock:
+            # Blocks read since the previous sample, per second
+            if self.blocks_read is not None and blocks_read is not None and now > self.sampled_at:
+                blocks = max(0, blocks_read - self.blocks_read)
+                self.block_read_rate = blocks / (now - self.sampled_at)
+            self.active_sessions = active_sessions
+            self.io_waits = io_waits
+            self.sessions = sessions
+            self.max_connections = max_connections
+            self.blocks_read = blocks_read
+            self.sampled_at = now
+
+    def busy_reason(self):
+        """
+        Returns:
+            str: Why the target is too busy for a heavy collector, or None if it is not.
+        """
+        with self.lock:
+            if self.sampled_at is None:
+                return None
+            if self.active_sessions > self.max_active_sessions:
+                return f"{self.active_sessions} active sessions"
+            if self.io_waits > self.max_io_waits:
+                return f"{self.io_waits} sessions waiting on I/O"
+            if self.sessions > self.max_connections * MAX_CONNECTION_USE:
+                return f"{self.sessions} of {self.max_connections} connections in use"
+            if (
+                self.max_block_reads
+                and self.block_read_rate is not None
+                and self.block_read_rate > self.max_block_reads
+            ):
+                return f"{self.block_read_rate:.0f} blocks read per second"
+            return None
+
+    def session_limit(self, default):
+        """
+        Args:
+            default (int): The limit to use before the target has been sampled.
+
+        Returns:
+            int: Sessions the collectors may open on the target at a time.
+        """
+        with self.lock:
+            limit = self._session_limit()
+            return default if limit is None else min(default, limit)
+
+    def _session_limit(self):
+        """
+        Call with the lock held.
+
+        Returns:
+            int: Sessions the collectors may open on the target at a time, or None before it has been sampled.
+        """
+        if self.max_connections is None:
+            return None
+        return max(1, int(self.max_connections * self.session_fraction))
+
+    def acquire_sessions(self, count, timeout=None):
+        """
+        Reserve sessions on the target for a thread that holds them at the
+        same time, waiting while other threads use the session limit. The
+        sessions are reserved all at once, so threads never wait on each
+        other while holding some. A thread is let in whenever no sessions
+        are reserved, even if it needs more than the limit.
+
+        Args:
+            count (int): Sessions to reserve.
+            timeout (float, optional): Seconds to wait at most. Defaults to None, no limit.
+
+        Returns:
+            bool: True if the sessions were reserved, False if the wait timed out.
+        """
+
+        def free():
+            limit = self._session_limit()
+            return (
+                limit is None
+                or self.reserved_sessions == 0
+                or self.reserved_sessions + count <= limit
+            )
+
+        with self.sessions_free:
+            if not self.sessions_free.wait_for(free, timeout):
+                return False
+            self.reserved_sessions += count
+            return True
+
+    def release_sessions(self, count):
+        """
+        Args:
+            count (int): Sessions reserved with acquire_sessions.
+        """
+        with self.sessions_free:
+            self.reserved_sessions -= count
+            self.sessions_free.notify_all()
+
+
+# Throttle of each target server, shared by every thread and coroutine
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_throttle(server_name):
+    """
+    Args:
+        server_name (str): Name of the target PostgreSQL server.
+
+    Returns:
+        TargetThrottle: The throttle of the server, created on first use.
+    """
+    with _throttles_lock:
+        throttle = _throttles.get(server_name)
+        if throttle is None:
+            throttle = TargetThrottle(server_name)
+            _throttles[server_name] = throttle
+        return throttle
+
+
+def sample_load(conn):
+    """
+    Sample the load of a target on a connection that is not in autocommit
+    mode. The transaction is rolled back, so the next sample is not served
+    from the statistics snapshot of this one.
+
+    Args:
+        conn (connection): An open psycopg2 connection to the target.
+
+    Returns:
+        tuple: The row returned by LOAD_QUERY.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LOAD_QUERY)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+def throttle_query(
+    target_server, collector_name, query, sample, budget=None, max_wait=THROTTLE_MAX_WAIT
+):
+    """
+    Wait for a target to quiet down before a heavy collector. The load is
+    sampled again at most every SAMPLE_INTERVAL seconds. A target that
+    cannot be sampled is not held up. The wait counts towards max_wait for
+    the target across the whole run, as tracked by the budget, so a target
+    that stays busy holds the run up for max_wait at most, not for each
+    collector and database. Once it is spent, heavy collectors on a target
+    last seen busy are postponed at once. A collector whose target stays busy
+    is postponed rather than run with a lighter query, so dba.tables only
+    holds sizes measured the way the run asked for.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        collector_name (str): Name of the collector.
+        query (str): The query of the collector.
+        sample (callable): Returns a LOAD_QUERY row for the target.
+        budget (CollectionBudget, optional): Counts the waits of the run, no waiting past its deadline. Defaults to None, a budget for this call only.
+        max_wait (float, optional): Seconds the run waits for the target at most. Defaults to THROTTLE_MAX_WAIT.
+
+    Returns:
+        str: The query to run.
+
+    Raises:
+        TargetBusy: If the collector should be postponed.
+    """
+    if collector_name not in HEAVY_COLLECTORS:
+        return query
+
+    throttle = get_throttle(target_server)
+    budget = budget or CollectionBudget()
+
+    while True:
+        wait = budget.throttle_wait_seconds(target_server, max_wait)
+        reason = throttle.busy_reason()
+        if reason is None or wait > 0:
+            if throttle.needs_sample():
+                try:
+                    throttle.record(sample())
+                except psycopg2.Error as e:
+                    print(f"    Could not sample the load of {target_server}. The error is  {e}")
+                    return query
+
+            reason = throttle.busy_reason()
+            if reason is None:
+                return query
+
+        if wait <= 0:
+            # The run has waited long enough for the target, postpone without sampling again
+            raise TargetBusy(f"{target_server} is busy ({reason}), {collector_name} postponed")
+
+        print(f"    {target_server} is busy ({reason}), waiting before {collector_name}")
+        seconds = min(SAMPLE_INTERVAL, wait)
+        time.sleep(seconds)
+        budget.record_throttle_wait(target_server, seconds)
+
+
+async def throttle_query_async(
+    target_server, collector_name, query, sample, budget=None, max_wait=THROTTLE_MAX_WAIT
+):
+    """
+    Asynchronous version of throttle_query, waiting on the event loop.
+
+    Args:
+        target_server (str): Name of the target PostgreSQL server.
+        collector_name (str): Name of the collector.
+        query (str): The query of the collector.
+        sample (callable): Returns a coroutine returning a LOAD_QUERY row for the target.
+        budget (CollectionBudget, optional): Counts the waits of the run, no waiting past its deadline. Defaults to None, a budget for this call only.
+        max_wait (float, optional): Seconds the run waits for the target at most. Defaults to THROTTLE_MAX_WAIT.
+
+    Returns:
+        str: The query to run.
+
+    Raises:
+        TargetBusy: If the collector should be postponed.
+    """
+    if collector_name not in HEAVY_COLLECTORS:
+        return query
+
+    throttle = get_throttle(target_server)
+    budget = budget or CollectionBudget()
+
+    while True:
+        wait = budget.throttle_wait_seconds(target_server, max_wait)
+        reason = throttle.busy_reason()
+        if reason is None or wait > 0:
+            if throttle.needs_sample():
+                try:
+                    throttle.record(await sample())
+                except psycopg2.Error as e:
+                    print(f"    Could not sample the load of {target_server}. The error is  {e}")
+                    return query
+
+            reason = throttle.busy_reason()
+            if reason is None:
+                return query
+
+        if wait <= 0:
+            # The run has waited long enough for the target, postpone without sampling again
+            raise TargetBusy(f"{target_server} is busy ({reason}), {collector_name} postponed")
+
+        print(f"    {target_server} is busy ({reason}), waiting before {collector_name}")
+        seconds = min(SAMPLE_INTERVAL, wait)
+        await asyncio.sleep(seconds)
+        budget.record_throttle_wait(target_server, seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sample the load of a PostgreSQL server as the collectors see it."
+    )
+    parser.add_argument("server_name", help="Name of the PostgreSQL server")
+    parser.add_argument("username", help="Username for the PostgreSQL server")
+    parser.add_argument("password", help="Password for the PostgreSQL server")
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=2,
+        help=f"Number of samples, {SAMPLE_INTERVAL}s apart (default: 2)",
+    )
+
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=args.server_name,
+        user=args.username,
+        password=args.password,
+        dbname="postgres",
+        connect_timeout=CONNECT_TIMEOUT,
+        options=timeout_options(),
+    )
+    try:
+        target_throttle = get_throttle(args.server_name)
+        for number in range(args.samples):
+            if number:
+                time.sleep(SAMPLE_INTERVAL)
+            target_throttle.record(sample_load(conn))
+            print(
+                f"{target_throttle.active_sessions} active, {target_throttle.io_waits} waiting on I/O, "
+                f"{target_throttle.sessions} of {target_throttle.max_connections} connections, "
+                f"session limit {target_throttle.session_limit(target_throttle.max_connections)}, "
+                f"busy: {target_throttle.busy_reason() or 'no'}"
+            )
+    finally:
+        conn.close()
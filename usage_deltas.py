@@ -0,0 +1,174 @@
+from datetime import datetime
+from bulk_insert import bulk_insert
+from collector_state import load_state
+
+# When the statistics of the current database were last reset, and the snapshot time
+STATS_RESET_QUERY = """
+    SELECT stats_reset, now()
+    FROM pg_stat_database
+    WHERE datname = current_database();
+    """
+
+# Usage collectors that get deltas: the delta table, the key columns at the
+# start of each row, and the counters that follow them
+USAGE_DELTA_COLLECTORS = {
+    "insert_database_table_usage": (
+        "dba.table_usage_deltas",
+        ("database_name", "schema_name", "table_name"),
+        (
+            "sequential_scans",
+            "sequential_tuple_scans",
+            "index_scans",
+            "index_tuple_fetches",
+        ),
+    ),
+    "insert_database_index_usage": (
+        "dba.index_usage_deltas",
+        ("database_name", "schema_name", "table_name", "index_name"),
+        ("index_scans", "index_tuples_read", "index_tuples_fetched"),
+    ),
+}
+
+
+def compute_usage_deltas(previous, rows, key_length, collected_at, stats_reset):
+    """
+    Compute per-interval deltas and rates between two usage snapshots.
+    A counter that went backwards, a statistics reset, or an object that is
+    new since the previous snapshot means the counter restarted from zero, so
+    its current value is the delta. Rows where nothing changed are left out.
+
+    Args:
+        previous (dict): The previous snapshot, or None on the first run.
+        rows (list): The current usage rows, key columns followed by counters.
+        key_length (int): Number of key columns at the start of each row.
+        collected_at (datetime): When the current rows were read.
+        stats_reset (datetime): When the database statistics were last reset, or None.
+
+    Returns:
+        tuple: A list of delta rows, and the snapshot to save for the next run.
+               Each delta row holds the key columns, interval start, interval
+               end, interval seconds, one delta per counter, one rate per
+               counter and whether the counters were reset.
+    """
+    state = {
+        "collected_at": collected_at.isoformat(),
+        "stats_reset": stats_reset.isoformat() if stats_reset is not None else None,
+        "rows": [list(row) for row in rows],
+    }
+
+    if previous is None:
+        return [], state
+
+    interval_start = datetime.fromisoformat(previous["collected_at"])
+    stats_were_reset = state["stats_reset"] != previous["stats_reset"]
+    if stats_were_reset and stats_reset is not None and stats_reset > interval_start:
+        # The counters only cover the time since the reset
+        interval_start = stats_reset
+
+    interval_seconds = (collected_at - interval_start).total_seconds()
+    if interval_seconds <= 0:
+        return [], state
+
+    previous_counters = {
+        tuple(row[:key_length]): row[key_length:] for row in previous["rows"]
+    }
+
+    delta_rows = []
+    for row in rows:
+        key = tuple(row[:key_length])
+        counters = row[key_length:]
+        old_counters = None if stats_were_reset else previous_counters.get(key)
+
+        counters_reset = old_counters is None
+        deltas = []
+        for position, value in enumerate(counters):
+            old_value = None if old_counters is None else old_counters[position]
+            if value is None:
+                deltas.append(None)
+            elif old_value is None or value < old_value:
+                deltas.append(value)
+                counters_reset = True
+            else:
+                deltas.append(value - old_value)
+
+        # Only write rows that moved
+        if not any(deltas):
+            continue
+
+        rates = [None if delta is None else delta / interval_seconds for delta in deltas]
+        delta_rows.append(
+            (
+                *key,
+                interval_start,
+                collected_at,
+                interval_seconds,
+                *deltas,
+                *rates,
+                counters_reset,
+            )
+        )
+
+    return delta_rows, state
+
+
+def read_usage_stats(conn):
+    """
+    Read when the statistics of the current database were last reset, and
+    when the usage rows were read. Call in the same transaction as the
+    collector query.
+
+    Args:
+        conn (connection): The open target connection the rows were read on.
+
+    Returns:
+        tuple: The stats reset time, or None, and the snapshot time.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(STATS_RESET_QUERY)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def write_usage_deltas(cursor_dba, target_server, database_name, collector_name, rows, usage_stats):
+    """
+    Compute and write the usage deltas for one collector on one database.
+    The new snapshot is returned rather than saved, so the caller can save it
+    only once the DBA transaction has been committed.
+
+    Args:
+        cursor_dba (cursor): An open cursor on the DBA database.
+        target_server (str): Name of the target PostgreSQL server.
+        database_name (str): Name of the target database.
+        collector_name (str): A key of USAGE_DELTA_COLLECTORS.
+        rows (list): The usage rows returned by the collector query.
+        usage_stats (tuple): The stats reset and snapshot times as returned by read_usage_stats.
+
+    Returns:
+        dict: The snapshot to save with collector_state.save_state.
+    """
+    table, key_columns, counter_columns = USAGE_DELTA_COLLECTORS[collector_name]
+    stats_reset, collected_at = usage_stats
+
+    previous = load_state(target_server, database_name, collector_name)
+    delta_rows, state = compute_usage_deltas(
+        previous, rows, len(key_columns), collected_at, stats_reset
+    )
+
+    columns = (
+        ("server_name",)
+        + key_columns
+        + ("interval_start", "interval_end", "interval_seconds")
+        + counter_columns
+        + tuple(f"{counter}_per_second" for counter in counter_columns)
+        + ("counters_reset",)
+    )
+    bulk_insert(
+        cursor_dba,
+        table,
+        columns,
+        ((target_server, *delta_row) for delta_row in delta_rows),
+    )
+
+    return state